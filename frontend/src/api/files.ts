@@ -15,8 +15,9 @@ export async function uploadFileWithProgress(
   onProgress?: (p: number) => void
 ) {
   const form = new FormData();
-  form.append("attachment", file);
+  // Поля идут перед файлом, чтобы сервер писал файл сразу в итоговую папку
   form.append("fields", JSON.stringify({ path: opts.path || "", comment: opts.comment || "" }));
+  form.append("attachment", file);
 
   return new Promise<any>(async (resolve, reject) => {
     try {
@@ -1,9 +1,9 @@
 import flask
-import redis
 from base_module.models.exception import ModuleException
 from base_module.models.logger import setup_logging, LoggerConfig
 from flask_cors import CORS
-from injectors.connections import pg
+from injectors import services
+from injectors.connections import pg, redis
 from routers.auth import auth_bp
 from routers.files import file_bp
 
@@ -15,8 +15,9 @@ app.config['JWT_TTL_SECONDS'] = 24 * 3600
 
 setup_logging(LoggerConfig(root_log_level='DEBUG'))
 
-app.redis = redis.Redis(host='redis', port=6379, db=0, decode_responses=True)
+app.redis = redis
 pg.setup(app)
+services.token_cache().setup(app)
 
 app.register_blueprint(file_bp)
 app.register_blueprint(auth_bp)
@@ -24,8 +25,8 @@ CORS(
     app,
     resources={r"/api/*": {"origins": "http://localhost:5173"}},
     supports_credentials=True,
-    expose_headers=["Content-Disposition"],
-    allow_headers=["Authorization", "Content-Type"],
+    expose_headers=["Content-Disposition", "Upload-Offset", "Upload-Length"],
+    allow_headers=["Authorization", "Content-Type", "Upload-Offset"],
 )
 
 
@@ -1 +1 @@
-from .config import PgConfig
+from .config import PgConfig, RedisConfig
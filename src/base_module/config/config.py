@@ -13,5 +13,26 @@ class PgConfig(Model):
     password: str = dc.field()
     database: str = dc.field()
     max_pool_connections: int = dc.field(default=100)
+    # Постоянные соединения пула процесса, остальные до
+    # max_pool_connections открываются при нагрузке и закрываются
+    pool_size: int = dc.field(default=5)
+    pool_timeout: int = dc.field(default=30)
+    pool_recycle: int = dc.field(default=1800)
+    pool_pre_ping: bool = dc.field(default=True)
+    # Кэш скомпилированных выражений SQLAlchemy, 0 - компиляция каждый раз
+    query_cache_size: int = dc.field(default=500)
+    # Запросы дольше порога пишутся в журнал, доля из них (только SELECT)
+    # с планом EXPLAIN (ANALYZE, BUFFERS), с побочными эффектами - EXPLAIN
+    slow_query_ms: int = dc.field(default=500)
+    slow_query_explain_rate: float = dc.field(default=0.0)
     debug: bool = dc.field(default=False)
     schema: str = dc.field(default='public')
+
+
+@dc.dataclass
+class RedisConfig(Model):
+    """Конфиг настройки redis"""
+
+    host: str = dc.field(default='redis')
+    port: int = dc.field(default=6379)
+    db: int = dc.field(default=0)
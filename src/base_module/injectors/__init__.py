@@ -1 +1,2 @@
 from .pg import PgConnectionInj
+from .instrumentation import QueryInstrumentation, QueryStats
@@ -0,0 +1,167 @@
+import contextvars
+import dataclasses as dc
+import random
+import re
+import time
+import typing as t
+
+import flask
+import sqlalchemy as sa
+
+from ..config import PgConfig
+from ..models import ClassesLoggerAdapter
+
+
+@dc.dataclass
+class QueryStats:
+    """Запросы к БД в рамках одного http-запроса"""
+
+    queries: int = dc.field(default=0)
+    commits: int = dc.field(default=0)
+    duration: float = dc.field(default=0.0)
+
+    @property
+    def round_trips(self) -> int:
+        return self.queries + self.commits
+
+
+class QueryInstrumentation:
+    """Счётчики запросов, журнал медленных запросов и выборочный EXPLAIN
+
+    Статистика копится в contextvar, который выставляется на время
+    http-запроса; запросы вне него (фоновые потоки, скрипты) попадают
+    только в журнал медленных запросов
+    """
+
+    STATS: contextvars.ContextVar[t.Optional[QueryStats]] = \
+        contextvars.ContextVar('query_stats', default=None)
+    STATEMENT_LOG_LIMIT = 2000
+    # SELECT с побочными эффектами: блокировки строк, advisory-блокировки,
+    # последовательности. ANALYZE выполнил бы их повторно
+    SIDE_EFFECTS_RE = re.compile(
+        r'\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(?:KEY\s+)?SHARE\b'
+        r'|\bpg_\w*lock\w*\s*\(|\b(?:nextval|setval)\s*\(',
+        re.IGNORECASE,
+    )
+
+    def __init__(self, conf: PgConfig):
+        """."""
+
+        self._slow_query_seconds = conf.slow_query_ms / 1000
+        self._explain_rate = conf.slow_query_explain_rate
+        self._logger = ClassesLoggerAdapter.create(self)
+
+    @classmethod
+    def current(cls) -> t.Optional[QueryStats]:
+        return cls.STATS.get()
+
+    def instrument(self, engine: sa.engine.Engine):
+        sa.event.listen(engine, 'before_cursor_execute', self._before_execute)
+        sa.event.listen(engine, 'after_cursor_execute', self._after_execute)
+        sa.event.listen(engine, 'commit', self._on_commit)
+
+    def setup(self, app: flask.Flask):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _start_request(self):
+        self.STATS.set(QueryStats())
+
+    def _finish_request(self, response: flask.Response):
+        stats = self.current()
+        if stats is None:
+            return response
+
+        duration_ms = stats.duration * 1000
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={duration_ms:.1f};desc="{stats.round_trips} round trips"',
+        )
+        self._logger.debug(
+            'Запросы к БД',
+            extra={
+                'endpoint': flask.request.endpoint,
+                'queries': stats.queries,
+                'commits': stats.commits,
+                'duration_ms': round(duration_ms, 1),
+            },
+        )
+        # Ответ-генератор может обращаться к БД после after_request,
+        # такие запросы в заголовок уже не попадут
+        return response
+
+    def _before_execute(
+            self, conn, cursor, statement, parameters, context, executemany,
+    ):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_execute(
+            self, conn, cursor, statement, parameters, context, executemany,
+    ):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if stats := self.current():
+            stats.queries += 1
+            stats.duration += elapsed
+
+        if elapsed < self._slow_query_seconds:
+            return
+
+        extra = {
+            'duration_ms': round(elapsed * 1000, 1),
+            'statement': statement[:self.STATEMENT_LOG_LIMIT],
+        }
+        if not executemany and self._should_explain(statement):
+            extra['plan'] = self._explain(conn, statement, parameters)
+
+        self._logger.warning('Медленный запрос', extra=extra)
+
+    def _on_commit(self, conn):
+        if stats := self.current():
+            stats.commits += 1
+
+    def _should_explain(self, statement: str) -> bool:
+        return (
+            self._explain_rate > 0
+            and statement.lstrip()[:6].upper() == 'SELECT'
+            and random.random() < self._explain_rate
+        )
+
+    def _explain(self, conn, statement: str, parameters) -> t.Optional[str]:
+        """План медленного запроса на том же соединении
+
+        ANALYZE выполняет запрос повторно, поэтому для SELECT с
+        побочными эффектами берётся план без выполнения.
+        Ошибка EXPLAIN не должна прерывать транзакцию запроса,
+        поэтому он выполняется в точке сохранения
+        """
+
+        if self.SIDE_EFFECTS_RE.search(statement):
+            explain = 'EXPLAIN'
+        else:
+            explain = 'EXPLAIN (ANALYZE, BUFFERS)'
+
+        dbapi_connection = conn.connection.dbapi_connection
+        in_transaction = not dbapi_connection.autocommit
+        cursor = dbapi_connection.cursor()
+        try:
+            if in_transaction:
+                cursor.execute('SAVEPOINT explain_sample')
+            try:
+                cursor.execute(
+                    f'{explain} {statement}', parameters,
+                )
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            except Exception as e:
+                if in_transaction:
+                    cursor.execute('ROLLBACK TO SAVEPOINT explain_sample')
+                self._logger.warning(
+                    'Ошибка EXPLAIN медленного запроса',
+                    exc_info=True, extra={'e': e},
+                )
+                return None
+
+            if in_transaction:
+                cursor.execute('RELEASE SAVEPOINT explain_sample')
+            return plan
+        finally:
+            cursor.close()
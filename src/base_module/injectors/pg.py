@@ -1,3 +1,5 @@
+import os
+import threading
 import time
 import typing as t
 
@@ -7,10 +9,11 @@ from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy_utils import database_exists, create_database
 
 from ..config import PgConfig
+from .instrumentation import QueryInstrumentation
 from ..models import (
     ModuleException,
     ClassesLoggerAdapter,
-    ThreadIsolatedSingleton,
+    Singleton,
     BaseOrmMappedModel,
 )
 
@@ -23,8 +26,12 @@ class ConnectionsException(ModuleException):
         raise cls('Сервис временно недоступен', code=503)
 
 
-class PgConnectionInj(metaclass=ThreadIsolatedSingleton):
-    """."""
+class PgConnectionInj(metaclass=Singleton):
+    """Подключение к postgres, один engine с пулом соединений на процесс
+
+    Сессии - scoped_session (своя у каждого потока) над общим engine.
+    После fork дочерний процесс не использует соединения родителя
+    """
 
     def __init__(
             self,
@@ -33,6 +40,7 @@ class PgConnectionInj(metaclass=ThreadIsolatedSingleton):
             acquire_attempts: int = 5,
             acquire_error_timeout: int = 5,
             init_statements: list = None,
+            migrations: list = None,
     ):
         """."""
 
@@ -41,16 +49,31 @@ class PgConnectionInj(metaclass=ThreadIsolatedSingleton):
         self._acquire_attempts = acquire_attempts
         self._acquire_error_timeout = acquire_error_timeout
         self._init_statements = init_statements or list()
+        self._migrations = migrations or list()
         self._pg: t.Union[sa.orm.scoped_session, Session, None] = None
+        self._engine: t.Optional[sa.engine.Engine] = None
+        self._lock = threading.Lock()
+        self._instrumentation = QueryInstrumentation(conf)
         self._logger = ClassesLoggerAdapter.create(self)
 
+        os.register_at_fork(after_in_child=self._after_fork)
+
     def _acquire_session(self) -> Session:
         if not self._pg:
-            self._init_db()
+            with self._lock:
+                if not self._pg:
+                    self._init_db()
+
+        return self._pg
+
+    def _after_fork(self):
+        """Соединения родителя остаются ему, пул ребёнка начинается пустым"""
 
-        with self._pg.begin():
-            self._pg.execute(sa.text(f'SET ROLE {self._conf.user}'))
-            return self._pg
+        self._lock = threading.Lock()
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+        if self._pg is not None:
+            self._pg.registry.clear()
 
     def acquire_session(self) -> Session:
         for i in range(self._acquire_attempts):
@@ -85,7 +108,18 @@ class PgConnectionInj(metaclass=ThreadIsolatedSingleton):
 
         return schemas
 
-    def _init_db(self):
+    @staticmethod
+    def __create_indexes(connection: sa.engine.base.Connection):
+        """Индексы, добавленные в модели после создания таблиц"""
+
+        for table in BaseOrmMappedModel.REGISTRY.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(
+                    sa.schema.CreateIndex(index, if_not_exists=True)
+                )
+
+    def _create_engine(self) -> sa.engine.Engine:
+        pool_size = min(self._conf.pool_size, self._conf.max_pool_connections)
         engine = sa.create_engine(
             sa.engine.URL.create(
                 'postgresql+psycopg2',
@@ -96,8 +130,30 @@ class PgConnectionInj(metaclass=ThreadIsolatedSingleton):
                 self._conf.database,
             ),
             echo=self._conf.debug,
-            query_cache_size=0,
+            query_cache_size=self._conf.query_cache_size,
+            poolclass=sa.pool.QueuePool,
+            pool_size=pool_size,
+            max_overflow=self._conf.max_pool_connections - pool_size,
+            pool_timeout=self._conf.pool_timeout,
+            pool_recycle=self._conf.pool_recycle,
+            pool_pre_ping=self._conf.pool_pre_ping,
         )
+
+        @sa.event.listens_for(engine, 'connect')
+        def set_role(dbapi_connection, connection_record):
+            # Роль выставляется один раз на соединение, а не на сессию
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute(f'SET ROLE {self._conf.user}')
+            finally:
+                cursor.close()
+            dbapi_connection.commit()
+
+        self._instrumentation.instrument(engine)
+        return engine
+
+    def _init_db(self):
+        engine = self._create_engine()
         if not database_exists(engine.url):
             create_database(engine.url)
 
@@ -116,7 +172,13 @@ class PgConnectionInj(metaclass=ThreadIsolatedSingleton):
 
                 BaseOrmMappedModel.REGISTRY.metadata.create_all(connection)
 
+                for statement in self._migrations:
+                    connection.execute(sa.text(statement))
+
+                self.__create_indexes(connection)
+
         session_fabric = sessionmaker(engine, expire_on_commit=False)
+        self._engine = engine
         self._pg = sa.orm.scoped_session(session_fabric)
 
     def _disconnect(self, response: flask.Response):
@@ -137,4 +199,5 @@ class PgConnectionInj(metaclass=ThreadIsolatedSingleton):
 
     def setup(self, app: flask.Flask):
         self.init_db()
+        self._instrumentation.setup(app)
         app.after_request(self._disconnect)
@@ -7,5 +7,6 @@ from .model import (
     ValuedEnum,
     view,
     MetaModel,
+    dumps_json,
 )
 from .singletons import ThreadIsolatedSingleton, Singleton
@@ -2,8 +2,19 @@ import dataclasses as dc
 import os
 
 import yaml
-from base_module.config import PgConfig
-from base_module.models import Model
+from base_module.config import PgConfig, RedisConfig
+from base_module.models import Model, ValuedEnum
+
+
+class DownloadMode(ValuedEnum):
+    """Способ отдачи файла при скачивании"""
+
+    # Байты файла отдаёт Python-воркер
+    DIRECT = 'direct'
+    # Отдаёт nginx по внутреннему location (X-Accel-Redirect)
+    X_ACCEL_REDIRECT = 'x-accel-redirect'
+    # Отдаёт фронт-сервер или offload-потоки uWSGI (X-Sendfile)
+    X_SENDFILE = 'x-sendfile'
 
 
 @dc.dataclass
@@ -11,12 +22,48 @@ class AppConfig(Model):
     """Конфиг приложения"""
 
     pg: PgConfig
+    redis: RedisConfig = dc.field(default_factory=RedisConfig)
     storage_path: str = dc.field(default='/app/storage')
     sync_interval: int = dc.field(default=3600)
+    sync_batch_size: int = dc.field(default=1000)
+    sync_watch_delay: float = dc.field(default=2.0)
+    sync_workers: int = dc.field(default=1)
+    sync_job_timeout: int = dc.field(default=3600)
+    # Как часто задача синхронизации обновляется при обходе диска
+    sync_progress_interval: float = dc.field(default=30.0)
+    jobs_enabled: bool = dc.field(default=False)
+    jobs_poll_interval: float = dc.field(default=1.0)
+    jobs_max_attempts: int = dc.field(default=5)
+    jobs_retry_delay: int = dc.field(default=30)
+    jobs_timeout: int = dc.field(default=3600)
+    jobs_heartbeat_interval: float = dc.field(default=60.0)
+    thumbnails_max_bytes: int = dc.field(default=1024 * 1024 * 1024)
+    thumbnails_max_age: int = dc.field(default=30 * 24 * 3600)
+    # Изображения больше (в пикселях) не декодируются для миниатюр
+    thumbnails_max_pixels: int = dc.field(default=50 * 1000 * 1000)
     debug: bool = dc.field(default=False)
     max_user_storage_bytes: int = dc.field(
         default=20 * 1024 * 1024 * 1024,
     )
+    files_page_limit: int = dc.field(default=100)
+    files_page_max_limit: int = dc.field(default=1000)
+    files_stream_batch: int = dc.field(default=1000)
+    stats_cache_ttl: int = dc.field(default=300)
+    # Срок записей кэша процесса, пока Redis недоступен
+    cache_local_ttl: int = dc.field(default=5)
+    # Кэш метаданных файлов и списков, 0 - отключён
+    metadata_cache_ttl: int = dc.field(default=300)
+    # Проверенные токены в памяти процесса, 0 - кэш отключён
+    token_cache_size: int = dc.field(default=10000)
+    token_cache_ttl: int = dc.field(default=300)
+    download_max_ranges: int = dc.field(default=16)
+    download_mode: DownloadMode = dc.field(default=DownloadMode.DIRECT)
+    download_accel_prefix: str = dc.field(default='/protected-storage/')
+    upload_chunk_size: int = dc.field(default=1024 * 1024)
+    upload_session_ttl: int = dc.field(default=24 * 3600)
+    batch_max_operations: int = dc.field(default=5000)
+    archive_chunk_size: int = dc.field(default=1024 * 1024)
+    archive_max_files: int = dc.field(default=5000)
 
 
 config: AppConfig = AppConfig.load(
@@ -1,7 +1,20 @@
+import redis as redis_lib
 from base_module.injectors import PgConnectionInj
 from config import config
 from models import *  # noqa
+from models.migrations import MIGRATIONS
 
 pg = PgConnectionInj(
     conf=config.pg,
+    init_statements=[
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    ],
+    migrations=MIGRATIONS,
+)
+
+redis = redis_lib.Redis(
+    host=config.redis.host,
+    port=config.redis.port,
+    db=config.redis.db,
+    decode_responses=True,
 )
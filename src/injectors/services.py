@@ -1,12 +1,51 @@
+from config import config
+from services.cache import CacheService, MetadataCache, TokenCache
 from services.files_service import FilesService
+from services.jobs import JobQueue
 
 from . import connections
 
+_cache = CacheService(
+    redis_client=connections.redis, local_ttl=config.cache_local_ttl,
+)
+_metadata = MetadataCache(_cache, ttl=config.metadata_cache_ttl)
+_tokens = TokenCache(
+    redis_client=connections.redis,
+    max_size=config.token_cache_size,
+    ttl=config.token_cache_ttl,
+)
+
+
+def cache_service() -> CacheService:
+    """Общий кэш процесса (Redis с локальной заменой)"""
+
+    return _cache
+
+
+def token_cache() -> TokenCache:
+    """Проверенные токены процесса с отзывом через Redis pub/sub"""
+
+    return _tokens
+
+
+def job_queue() -> JobQueue:
+    """Очередь фоновых задач (воркер)"""
+
+    return JobQueue(
+        pg_connection=connections.pg.acquire_session(),
+        max_attempts=config.jobs_max_attempts,
+        retry_delay=config.jobs_retry_delay,
+    )
+
 
 def files_service() -> FilesService:
     """Глобальный сервис работы с файлами (scripts)"""
 
-    return FilesService(pg_connection=connections.pg.acquire_session())
+    return FilesService(
+        pg_connection=connections.pg.acquire_session(),
+        cache=_cache,
+        metadata=_metadata,
+    )
 
 def user_files_service(user_id: int) -> FilesService:
     """Пользовательский сервис работы с файлами для API"""
@@ -14,4 +53,6 @@ def user_files_service(user_id: int) -> FilesService:
     return FilesService(
         pg_connection=connections.pg.acquire_session(),
         user_id=user_id,
+        cache=_cache,
+        metadata=_metadata,
     )
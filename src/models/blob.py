@@ -0,0 +1,47 @@
+import dataclasses as dc
+from datetime import datetime
+
+import sqlalchemy as sa
+from base_module.models import BaseOrmMappedModel
+
+SCHEMA_NAME = 'files'
+
+
+@dc.dataclass
+class Blob(BaseOrmMappedModel):
+    """SQL модель блоба содержимого (content-addressed по sha256)
+
+    Файлы с одинаковым содержимым - жёсткие ссылки на один блоб,
+    refcount - число записей files, ссылающихся на него
+    """
+
+    __tablename__ = 'blobs'
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    sha256: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(64), primary_key=True
+        )},
+    )
+    size: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False
+        )},
+    )
+    refcount: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    creation_date: datetime = dc.field(
+        default_factory=datetime.utcnow,
+        metadata={'sa': sa.Column(
+            sa.DateTime(), server_default=sa.func.now()
+        )},
+    )
+
+
+BaseOrmMappedModel.REGISTRY.mapped(Blob)
@@ -4,15 +4,67 @@ from datetime import datetime
 
 import sqlalchemy as sa
 from base_module.models import BaseOrmMappedModel
+from sqlalchemy import orm
+
+from .folder import Folder
 
 SCHEMA_NAME = 'files'
+ROOT_PATH = '.'
+
+FILE_CATEGORIES = {
+    'audio': {'mp3', 'wav', 'ogg', 'flac', 'aac'},
+    'video': {'mp4', 'avi', 'mkv', 'mov', 'webm'},
+    'images': {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'},
+    'documents': {
+        'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt'
+    },
+}
+OTHER_CATEGORY = 'other'
+
+
+def file_category(extension: typing.Optional[str]) -> str:
+    """Категория файла по расширению"""
+
+    ext = (extension or '').lower()
+    for category, extensions in FILE_CATEGORIES.items():
+        if ext in extensions:
+            return category
+
+    return OTHER_CATEGORY
+
 
 @dc.dataclass
 class File(BaseOrmMappedModel):
     """SQL модель файла"""
 
     __tablename__ = 'files'
-    __table_args__ = {'schema': SCHEMA_NAME}
+    __table_args__ = (
+        # Выборки по владельцу: списки, поиск по имени и по пути
+        sa.Index('ix_files_owner_id', 'owner_id'),
+        sa.Index(
+            'ix_files_owner_name_extension', 'owner_id', 'name', 'extension'
+        ),
+        sa.Index('ix_files_owner_folder', 'owner_id', 'folder_id'),
+        # Мгновенная загрузка: есть ли у пользователя такое содержимое
+        sa.Index('ix_files_owner_sha256', 'owner_id', 'sha256'),
+        # Статистика: GROUP BY category по индексу без чтения таблицы
+        sa.Index(
+            'ix_files_owner_category', 'owner_id', 'category',
+            postgresql_include=['size'],
+        ),
+        # Триграммные индексы для поиска подстроки (ILIKE '%term%')
+        sa.Index(
+            'ix_files_name_trgm', 'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'},
+        ),
+        sa.Index(
+            'ix_files_extension_trgm', 'extension',
+            postgresql_using='gin',
+            postgresql_ops={'extension': 'gin_trgm_ops'},
+        ),
+        {'schema': SCHEMA_NAME},
+    )
 
     id: int = dc.field(
         default=None,
@@ -41,7 +93,7 @@ class File(BaseOrmMappedModel):
     size: int = dc.field(
         default=None,
         metadata={'sa': sa.Column(
-            sa.Integer, nullable=False
+            sa.BigInteger, nullable=False
         )},
     )
     path: str = dc.field(
@@ -81,12 +133,67 @@ class File(BaseOrmMappedModel):
             nullable=False,
         )}
     )
+    # Путь до появления папок, актуальный путь - Folder.path
     relative_path: str = dc.field(
         default=None,
         metadata={'sa': sa.Column(
             sa.Text, nullable=True
         )},
     )
+    folder_id: typing.Optional[int] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger,
+            sa.ForeignKey(
+                'files.folders.id',
+                ondelete='RESTRICT',
+                name='fk_file_folder_id',
+            ),
+            nullable=True,
+        )},
+    )
+    sha256: typing.Optional[str] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(64), nullable=True
+        )},
+    )
+    category: str = dc.field(
+        default=OTHER_CATEGORY,
+        metadata={'sa': sa.Column(
+            sa.String(16), nullable=False, server_default=OTHER_CATEGORY
+        )},
+    )
+
+    def dump(
+            self, fields: typing.Optional[typing.Iterable[str]] = None,
+    ) -> dict:
+        """Сериализация, relative_path берётся из папки файла"""
+
+        data = super().dump(fields)
+        if 'relative_path' not in data:
+            return data
+
+        folder = self.__dict__.get('folder')
+        if folder is not None:
+            data['relative_path'] = folder.path
+        elif self.folder_id is None:
+            data['relative_path'] = ROOT_PATH
+
+        return data
 
 
 BaseOrmMappedModel.REGISTRY.mapped(File)
+
+# Папка подгружается тем же запросом, что и файл
+File.__mapper__.add_property(
+    'folder', orm.relationship(Folder, lazy='joined', innerjoin=False)
+)
+
+# btree для поиска по префиксу имени (LIKE 'term%')
+sa.Index(
+    'ix_files_owner_name_prefix',
+    File.__table__.c.owner_id,
+    sa.func.lower(File.__table__.c.name).label('lower_name'),
+    postgresql_ops={'lower_name': 'text_pattern_ops'},
+)
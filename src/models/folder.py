@@ -0,0 +1,90 @@
+import dataclasses as dc
+import typing
+from datetime import datetime
+
+import sqlalchemy as sa
+from base_module.models import BaseOrmMappedModel
+
+SCHEMA_NAME = 'files'
+
+
+@dc.dataclass
+class Folder(BaseOrmMappedModel):
+    """SQL модель папки пользователя
+
+    Дерево хранится списком смежности (parent_id), path - полный путь
+    от корня хранилища пользователя, он же путь каталога на диске.
+    Файлы ссылаются на папку по id, поэтому переименование и перенос
+    папки не меняют записи файлов
+    """
+
+    __tablename__ = 'folders'
+    __table_args__ = (
+        sa.UniqueConstraint('owner_id', 'path', name='uq_folders_owner_path'),
+        sa.Index('ix_folders_owner_parent', 'owner_id', 'parent_id'),
+        sa.Index(
+            'ix_folders_path_trgm', 'path',
+            postgresql_using='gin',
+            postgresql_ops={'path': 'gin_trgm_ops'},
+        ),
+        {'schema': SCHEMA_NAME},
+    )
+
+    id: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, autoincrement=True, primary_key=True
+        )},
+    )
+    owner_id: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger,
+            sa.ForeignKey(
+                'files.users.id',
+                ondelete='CASCADE',
+                use_alter=True,
+                name='fk_folder_owner_id',
+            ),
+            nullable=False,
+        )},
+    )
+    parent_id: typing.Optional[int] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger,
+            sa.ForeignKey(
+                'files.folders.id',
+                ondelete='RESTRICT',
+                name='fk_folder_parent_id',
+            ),
+            nullable=True,
+        )},
+    )
+    name: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(255), nullable=False
+        )},
+    )
+    path: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.Text, nullable=False
+        )},
+    )
+    creation_date: datetime = dc.field(
+        default_factory=datetime.utcnow,
+        metadata={'sa': sa.Column(
+            sa.DateTime(), server_default=sa.func.now()
+        )},
+    )
+    update_date: typing.Optional[datetime] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.DateTime, nullable=True
+        )},
+    )
+
+
+BaseOrmMappedModel.REGISTRY.mapped(Folder)
@@ -0,0 +1,106 @@
+import dataclasses as dc
+import typing
+from datetime import datetime
+
+import sqlalchemy as sa
+from base_module.models import BaseOrmMappedModel
+
+SCHEMA_NAME = 'files'
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Виды задач воркера
+JOB_PURGE = 'purge'
+JOB_CHECKSUM = 'checksum'
+JOB_SYNC = 'sync'
+JOB_THUMBNAIL = 'thumbnail'
+
+# Файл задачи: у файла не больше одной активной задачи каждого вида
+JOB_FILE_ID = sa.text("(payload ->> 'file_id')")
+JOB_ACTIVE_WHERE = sa.text("status IN ('pending', 'running')")
+
+
+@dc.dataclass
+class Job(BaseOrmMappedModel):
+    """SQL модель фоновой задачи
+
+    Воркеры забирают задачи через SELECT ... FOR UPDATE SKIP LOCKED.
+    Повторная задача того же вида для файла, пока прежняя не выполнена,
+    не ставится (частичный уникальный индекс)
+    """
+
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Выборка очереди: только ожидающие задачи, по времени запуска
+        sa.Index(
+            'ix_jobs_pending', 'run_after', 'id',
+            postgresql_where=sa.text("status = 'pending'"),
+        ),
+        sa.Index(
+            'uq_jobs_kind_file_active', 'kind', JOB_FILE_ID,
+            unique=True,
+            postgresql_where=JOB_ACTIVE_WHERE,
+        ),
+        {'schema': SCHEMA_NAME},
+    )
+
+    id: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, autoincrement=True, primary_key=True
+        )},
+    )
+    kind: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(32), nullable=False
+        )},
+    )
+    payload: dict = dc.field(
+        default_factory=dict,
+        metadata={'sa': sa.Column(
+            sa.JSON, nullable=False
+        )},
+    )
+    status: str = dc.field(
+        default=JOB_PENDING,
+        metadata={'sa': sa.Column(
+            sa.String(16), nullable=False
+        )},
+    )
+    attempts: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.Integer, nullable=False, server_default='0'
+        )},
+    )
+    error: typing.Optional[str] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.Text, nullable=True
+        )},
+    )
+    run_after: datetime = dc.field(
+        default_factory=datetime.utcnow,
+        metadata={'sa': sa.Column(
+            sa.DateTime, nullable=False
+        )},
+    )
+    creation_date: datetime = dc.field(
+        default_factory=datetime.utcnow,
+        metadata={'sa': sa.Column(
+            sa.DateTime(), server_default=sa.func.now()
+        )},
+    )
+    update_date: typing.Optional[datetime] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.DateTime, nullable=True
+        )},
+    )
+
+
+BaseOrmMappedModel.REGISTRY.mapped(Job)
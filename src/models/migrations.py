@@ -0,0 +1,124 @@
+"""Идемпотентные миграции таблиц, созданных прошлыми версиями
+
+Выполняются при старте после metadata.create_all
+"""
+
+from .file import FILE_CATEGORIES, OTHER_CATEGORY
+
+
+def _category_case(column: str) -> str:
+    whens = ' '.join(
+        "WHEN lower({column}) IN ({extensions}) THEN '{category}'".format(
+            column=column,
+            extensions=', '.join(f"'{ext}'" for ext in sorted(extensions)),
+            category=category,
+        )
+        for category, extensions in FILE_CATEGORIES.items()
+    )
+    return f"CASE {whens} ELSE '{OTHER_CATEGORY}' END"
+
+
+MIGRATIONS = [
+    # files.category - категория по расширению, заполняется при загрузке
+    f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'files'
+                AND table_name = 'files'
+                AND column_name = 'category'
+        ) THEN
+            ALTER TABLE files.files ADD COLUMN category VARCHAR(16)
+                NOT NULL DEFAULT '{OTHER_CATEGORY}';
+            UPDATE files.files SET category = {_category_case('extension')};
+        END IF;
+    END $$;
+    """,
+    # files.size - BIGINT для файлов больше 2 ГБ
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'files'
+                AND table_name = 'files'
+                AND column_name = 'size'
+                AND data_type = 'integer'
+        ) THEN
+            ALTER TABLE files.files ALTER COLUMN size TYPE BIGINT;
+        END IF;
+    END $$;
+    """,
+    # files.sha256 - контрольная сумма содержимого, считается при загрузке
+    'ALTER TABLE files.files ADD COLUMN IF NOT EXISTS sha256 VARCHAR(64)',
+    # files.folder_id - папки из прежних relative_path
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'files'
+                AND table_name = 'files'
+                AND column_name = 'folder_id'
+        ) THEN
+            ALTER TABLE files.files ADD COLUMN folder_id BIGINT
+                CONSTRAINT fk_file_folder_id
+                REFERENCES files.folders (id) ON DELETE RESTRICT;
+
+            INSERT INTO files.folders (owner_id, name, path)
+            SELECT DISTINCT
+                p.owner_id,
+                p.parts[p.depth],
+                array_to_string(p.parts[1:p.depth], '/')
+            FROM (
+                SELECT
+                    f.owner_id,
+                    f.parts,
+                    generate_series(1, array_length(f.parts, 1)) AS depth
+                FROM (
+                    SELECT DISTINCT
+                        owner_id,
+                        string_to_array(trim(both '/' from relative_path), '/')
+                            AS parts
+                    FROM files.files
+                    WHERE coalesce(trim(both '/' from relative_path), '')
+                        NOT IN ('', '.')
+                ) f
+            ) p
+            ON CONFLICT (owner_id, path) DO NOTHING;
+
+            UPDATE files.folders c SET parent_id = p.id
+            FROM files.folders p
+            WHERE c.parent_id IS NULL
+                AND p.owner_id = c.owner_id
+                AND left(c.path, length(p.path) + 1) = p.path || '/'
+                AND position('/' in substr(c.path, length(p.path) + 2)) = 0;
+
+            UPDATE files.files f SET folder_id = d.id
+            FROM files.folders d
+            WHERE d.owner_id = f.owner_id
+                AND d.path = trim(both '/' from f.relative_path);
+        END IF;
+    END $$;
+    """,
+    # Поиск по пути идёт по files.folders
+    'DROP INDEX IF EXISTS files.ix_files_owner_relative_path',
+    'DROP INDEX IF EXISTS files.ix_files_relative_path_trgm',
+    # Повторные активные задачи файла мешают уникальному индексу
+    # uq_jobs_kind_file_active, остаётся самая ранняя
+    """
+    DELETE FROM files.jobs j
+    USING files.jobs e
+    WHERE j.status IN ('pending', 'running')
+        AND e.status IN ('pending', 'running')
+        AND j.kind = e.kind
+        AND j.payload ->> 'file_id' = e.payload ->> 'file_id'
+        AND j.id > e.id
+        AND NOT EXISTS (
+            SELECT 1 FROM pg_indexes
+            WHERE schemaname = 'files'
+                AND indexname = 'uq_jobs_kind_file_active'
+        );
+    """,
+]
@@ -0,0 +1,113 @@
+import dataclasses as dc
+import typing
+from datetime import datetime
+
+import sqlalchemy as sa
+from base_module.models import BaseOrmMappedModel
+
+SCHEMA_NAME = 'files'
+
+SYNC_PENDING = 'pending'
+SYNC_RUNNING = 'running'
+SYNC_DONE = 'done'
+SYNC_FAILED = 'failed'
+SYNC_ACTIVE_STATUSES = (SYNC_PENDING, SYNC_RUNNING)
+
+
+@dc.dataclass
+class SyncJob(BaseOrmMappedModel):
+    """SQL модель задачи синхронизации хранилища пользователя
+
+    У пользователя не больше одной активной задачи (частичный
+    уникальный индекс), повторные запросы получают её же
+    """
+
+    __tablename__ = 'sync_jobs'
+    __table_args__ = (
+        sa.Index(
+            'uq_sync_jobs_owner_active', 'owner_id',
+            unique=True,
+            postgresql_where=sa.text(
+                "status IN ('pending', 'running')"
+            ),
+        ),
+        {'schema': SCHEMA_NAME},
+    )
+
+    id: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(32), primary_key=True
+        )},
+    )
+    owner_id: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger,
+            sa.ForeignKey(
+                'files.users.id',
+                ondelete='CASCADE',
+                use_alter=True,
+                name='fk_sync_job_owner_id',
+            ),
+            nullable=False,
+        )},
+    )
+    status: str = dc.field(
+        default=SYNC_PENDING,
+        metadata={'sa': sa.Column(
+            sa.String(16), nullable=False
+        )},
+    )
+    # Прогресс: записей в БД всего, проверено и удалено
+    total: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    processed: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    deleted: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    report: typing.Optional[dict] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.JSON, nullable=True
+        )},
+    )
+    error: typing.Optional[str] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.Text, nullable=True
+        )},
+    )
+    creation_date: datetime = dc.field(
+        default_factory=datetime.utcnow,
+        metadata={'sa': sa.Column(
+            sa.DateTime(), server_default=sa.func.now()
+        )},
+    )
+    update_date: typing.Optional[datetime] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.DateTime, nullable=True
+        )},
+    )
+    finish_date: typing.Optional[datetime] = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.DateTime, nullable=True
+        )},
+    )
+
+
+BaseOrmMappedModel.REGISTRY.mapped(SyncJob)
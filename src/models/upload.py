@@ -0,0 +1,91 @@
+import dataclasses as dc
+from datetime import datetime
+
+import sqlalchemy as sa
+from base_module.models import BaseOrmMappedModel
+
+SCHEMA_NAME = 'files'
+
+
+@dc.dataclass
+class UploadSession(BaseOrmMappedModel):
+    """SQL модель сессии возобновляемой загрузки
+
+    Запись о файле создаётся только при завершении сессии,
+    id сессии становится stored_name файла
+    """
+
+    __tablename__ = 'upload_sessions'
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    id: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(32), primary_key=True
+        )},
+    )
+    owner_id: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger,
+            sa.ForeignKey(
+                'files.users.id',
+                ondelete='CASCADE',
+                use_alter=True,
+                name='fk_upload_owner_id',
+            ),
+            nullable=False,
+            index=True,
+        )},
+    )
+    name: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(100), nullable=False
+        )},
+    )
+    extension: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(10), nullable=False
+        )},
+    )
+    relative_path: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.Text, nullable=True
+        )},
+    )
+    comment: str = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.String(200), nullable=True
+        )},
+    )
+    length: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False
+        )},
+    )
+    offset: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    creation_date: datetime = dc.field(
+        default_factory=datetime.utcnow,
+        metadata={'sa': sa.Column(
+            sa.DateTime(), nullable=False
+        )},
+    )
+    update_date: datetime = dc.field(
+        default_factory=datetime.utcnow,
+        metadata={'sa': sa.Column(
+            sa.DateTime(), nullable=False
+        )},
+    )
+
+
+BaseOrmMappedModel.REGISTRY.mapped(UploadSession)
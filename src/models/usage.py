@@ -0,0 +1,71 @@
+import dataclasses as dc
+
+import sqlalchemy as sa
+from base_module.models import BaseOrmMappedModel
+
+SCHEMA_NAME = 'files'
+
+
+@dc.dataclass
+class UserUsage(BaseOrmMappedModel):
+    """SQL модель занятого пользователем места
+
+    Поддерживается загрузкой и удалением файлов в той же транзакции,
+    что и запись о файле
+    """
+
+    __tablename__ = 'user_usage'
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    user_id: int = dc.field(
+        default=None,
+        metadata={'sa': sa.Column(
+            sa.BigInteger,
+            sa.ForeignKey(
+                'files.users.id',
+                ondelete='CASCADE',
+                use_alter=True,
+                name='fk_usage_user_id',
+            ),
+            primary_key=True,
+        )},
+    )
+    used_bytes: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    audio_bytes: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    video_bytes: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    images_bytes: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    documents_bytes: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+    other_bytes: int = dc.field(
+        default=0,
+        metadata={'sa': sa.Column(
+            sa.BigInteger, nullable=False, server_default='0'
+        )},
+    )
+
+
+BaseOrmMappedModel.REGISTRY.mapped(UserUsage)
@@ -6,6 +6,7 @@ from types import SimpleNamespace
 
 import jwt
 from flask import Blueprint, request, jsonify, g, current_app
+from injectors import services
 from injectors.connections import pg
 from models.user import User
 from sqlalchemy import select
@@ -46,6 +47,14 @@ def token_required(f):
             return jsonify({'error': 'Unauthorized'}), 401
 
         token = auth.split(' ', 1)[1]
+
+        # 0) Токен уже проверен этим процессом - без обращений к сети
+        tokens = services.token_cache()
+        cached = tokens.get(token)
+        if cached is not None:
+            g.user = SimpleNamespace(**cached)
+            return f(*args, **kwargs)
+
         payload = decode_token(token)
         if not payload or 'user_id' not in payload:
             return jsonify({'error': 'Invalid or expired token'}), 401
@@ -65,6 +74,7 @@ def token_required(f):
                         user_json = user_json.decode('utf-8')
                     data = json.loads(user_json)
                     g.user = SimpleNamespace(**data)
+                    tokens.set(token, data, payload.get('exp'))
                     return f(*args, **kwargs)
                 except Exception:
                     # fallthrough -> попробуем БД
@@ -84,7 +94,9 @@ def token_required(f):
                 return jsonify({'error': 'Unauthorized'}), 401
 
             # приводим к простому namespace чтобы остальной код работал (id, username)
-            g.user = SimpleNamespace(id=int(user.id), username=user.username)
+            data = {'id': int(user.id), 'username': user.username}
+            g.user = SimpleNamespace(**data)
+            tokens.set(token, data, payload.get('exp'))
             return f(*args, **kwargs)
         finally:
             try:
@@ -185,6 +197,9 @@ def logout():
             except Exception:
                 pass
 
+        # Сброс токена в кэшах всех процессов
+        services.token_cache().revoke(token)
+
     return jsonify({'detail': 'logged out'}), 200
 
 
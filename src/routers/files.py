@@ -1,6 +1,7 @@
 from threading import Thread
 
-from flask import Blueprint, jsonify
+from config import config
+from flask import Blueprint, jsonify, request
 from flask import g
 from injectors import services
 from routers.auth import token_required
@@ -11,13 +12,30 @@ file_bp = Blueprint('file', __name__, url_prefix='/api/files')
 @file_bp.route('/sync', methods=['POST'])
 @token_required
 def sync_files():
-    """Синхронизация локального хранилища и базы данных"""
+    """Синхронизация хранилища пользователя и базы данных
+
+    Повторный запрос во время синхронизации возвращает текущую задачу
+    """
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    job, created = fs.create_sync_job()
+    # При включённой очереди задачу выполнит воркер
+    if created and not config.jobs_enabled:
+        thread = Thread(target=fs.run_sync_job, args=(job['id'],), daemon=True)
+        thread.start()
+
+    return jsonify(job), 202 if created else 200
+
+
+@file_bp.route('/sync/<string:job_id>', methods=['GET'])
+@token_required
+def get_sync_job(job_id: str):
+    """Статус и прогресс задачи синхронизации"""
 
     user_id = g.user.id
     fs = services.user_files_service(user_id=user_id)
-    thread = Thread(target=fs.sync_storage_and_db)
-    thread.start()
-    return jsonify({'detail': 'Sync started in background'})
+    return jsonify(fs.get_sync_job(job_id))
 
 
 @file_bp.route('', methods=['GET'])
@@ -27,12 +45,27 @@ def get_files():
 
     user_id = g.user.id
     fs = services.user_files_service(user_id=user_id)
+    if request.args.get('stream'):
+        return fs.stream_files()
+    if 'limit' in request.args or 'cursor' in request.args:
+        return jsonify(fs.get_files_page())
+
     files = fs.get_files()
     if not files:
         return jsonify(status_code=404, detail='No files found')
     return jsonify(files)
 
 
+@file_bp.route('/search', methods=['GET'])
+@token_required
+def search_files():
+    """Поиск файлов по имени, расширению и пути"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.search_files())
+
+
 @file_bp.route('/<int:file_id>', methods=['GET'])
 @token_required
 def get_file(file_id):
@@ -54,6 +87,26 @@ def download_file(file_id):
     return fs.download_file(file_id)
 
 
+@file_bp.route('/<int:file_id>/thumbnail', methods=['GET'])
+@token_required
+def get_thumbnail(file_id: int):
+    """Миниатюра изображения"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return fs.get_thumbnail(file_id)
+
+
+@file_bp.route('/archive', methods=['GET'])
+@token_required
+def download_archive():
+    """Скачивание папки или набора файлов ZIP/TAR архивом"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return fs.download_archive()
+
+
 @file_bp.route('', methods=['POST'])
 @token_required
 def upload_file():
@@ -65,6 +118,151 @@ def upload_file():
     return jsonify(file)
 
 
+@file_bp.route('/blobs/<string:sha256>', methods=['GET'])
+@token_required
+def get_blob(sha256: str):
+    """Проверка наличия содержимого по sha256 перед загрузкой"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.get_blob(sha256))
+
+
+@file_bp.route('/blobs/<string:sha256>', methods=['POST'])
+@token_required
+def upload_from_blob(sha256: str):
+    """Мгновенная загрузка файла из уже хранимого содержимого"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    file = fs.upload_from_blob(sha256)
+    return jsonify(file)
+
+
+@file_bp.route('/uploads', methods=['POST'])
+@token_required
+def create_upload():
+    """Создание сессии возобновляемой загрузки"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    upload = fs.create_upload()
+    return _upload_response(upload, 201)
+
+
+@file_bp.route('/uploads/<string:upload_id>', methods=['GET'])
+@token_required
+def get_upload(upload_id: str):
+    """Текущее смещение загрузки (HEAD или GET)"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    upload = fs.get_upload(upload_id)
+    return _upload_response(upload)
+
+
+@file_bp.route('/uploads/<string:upload_id>', methods=['PATCH'])
+@token_required
+def append_upload_chunk(upload_id: str):
+    """Дозапись куска файла по смещению Upload-Offset"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    upload = fs.append_upload_chunk(upload_id)
+    return _upload_response(upload)
+
+
+@file_bp.route('/uploads/<string:upload_id>/finalize', methods=['POST'])
+@token_required
+def finalize_upload(upload_id: str):
+    """Завершение загрузки и добавление записи в БД"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    file = fs.finalize_upload(upload_id)
+    return jsonify(file)
+
+
+@file_bp.route('/uploads/<string:upload_id>', methods=['DELETE'])
+@token_required
+def delete_upload(upload_id: str):
+    """Отмена загрузки"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    fs.delete_upload(upload_id)
+    return '', 204
+
+
+def _upload_response(upload: dict, status: int = 200):
+    response = jsonify(upload)
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(upload['offset'])
+    response.headers['Upload-Length'] = str(upload['length'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@file_bp.route('/batch', methods=['POST'])
+@token_required
+def batch_files():
+    """Пакетное удаление, перемещение и изменение файлов"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.batch_files())
+
+
+@file_bp.route('/folders', methods=['GET'])
+@token_required
+def get_folders():
+    """Список папок пользователя"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.get_folders())
+
+
+@file_bp.route('/folders', methods=['POST'])
+@token_required
+def create_folder():
+    """Создание папки"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.create_folder()), 201
+
+
+@file_bp.route('/folders/<int:folder_id>', methods=['PATCH'])
+@token_required
+def update_folder(folder_id: int):
+    """Переименование и перенос папки"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.update_folder(folder_id))
+
+
+@file_bp.route('/folders/<int:folder_id>', methods=['DELETE'])
+@token_required
+def delete_folder(folder_id: int):
+    """Удаление пустой папки"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.delete_folder(folder_id))
+
+
+@file_bp.route('/cache', methods=['GET'])
+@token_required
+def get_cache_stats():
+    """Попадания в кэш метаданных (процесс, обработавший запрос)"""
+
+    user_id = g.user.id
+    fs = services.user_files_service(user_id=user_id)
+    return jsonify(fs.get_cache_stats())
+
+
 @file_bp.route('/<int:file_id>', methods=['PATCH'])
 @token_required
 def update_file(file_id):
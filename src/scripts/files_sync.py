@@ -1,32 +1,160 @@
+import argparse
+import collections
 import logging
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict
 
 from config import config
 from injectors import services
+from services.files_service import (
+    BLOBS_DIR, THUMBS_DIR, TRASH_DIR, UPLOADS_DIR
+)
+from services.watcher import StorageWatcher
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
-def sync_storages():
+def sync_storages(workers: int = 1):
     """Вызов метода синхронизации сервиса files"""
 
+    if workers > 1:
+        return sync_sharded(workers)
+
     log.info('Starting sync')
     fs = services.files_service()
     try:
-        fs.sync_storage_and_db()
-        log.info('Sync completed')
+        report = fs.sync_storage_and_db()
+        log.info(f'Sync completed: {report}')
+        return report
     except Exception as e:
         log.error(f'Sync failed: {e}')
         raise
 
 
-if __name__ == '__main__':
-    """Запуск регулярной синхронизации хранилища и БД"""
+def sync_user(owner_id: int) -> Dict[str, int]:
+    """Синхронизация хранилища одного пользователя (в процессе пула)"""
+
+    # Пользователя, которого синхронизирует задача API, пропускаем
+    return services.user_files_service(
+        user_id=owner_id
+    ).sync_storage_and_db(wait=False)
+
+
+def sync_sharded(workers: int) -> Dict[str, int]:
+    """Синхронизация по пользователям в пуле процессов
+
+    Каждый процесс сверяет каталог пользователя только с его записями,
+    отчёты процессов суммируются
+    """
+
+    started = time.monotonic()
+    owner_ids = services.files_service().get_sync_owner_ids()
+    log.info(f'Starting sharded sync: {len(owner_ids)} users, {workers} workers')
+
+    report = collections.Counter()
+    failed = []
+    # spawn - соединения с БД и потоки родителя не наследуются
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(sync_user, owner_id): owner_id
+            for owner_id in owner_ids
+        }
+        for future in as_completed(futures):
+            try:
+                report.update(future.result())
+            except Exception as e:
+                failed.append(futures[future])
+                log.error(f'Sync of user {futures[future]} failed: {e}')
+
+    report['users'] = len(owner_ids)
+    report['failed_users'] = len(failed)
+    log.info(
+        f'Sharded sync completed in {time.monotonic() - started:.1f}s: '
+        f'{dict(report)}'
+    )
+    if failed:
+        log.error(f'Failed users: {sorted(failed)}')
+
+    return dict(report)
+
+
+def run_interval(workers: int):
+    """Полная синхронизация раз в config.sync_interval секунд"""
 
-    sync_storages()
     interval = config.sync_interval
-    log.info('Running sync every hour.')
+    log.info(f'Running sync every {interval} seconds.')
     while True:
-        sync_storages()
+        sync_storages(workers)
+        services.files_service().prune_thumbnails()
         time.sleep(interval)
+
+
+def run_watch(workers: int):
+    """Сверка по событиям inotify
+
+    Полный обход выполняется при старте и при переполнении очереди
+    событий, в остальное время сверяются только затронутые файлы
+    """
+
+    try:
+        watcher = StorageWatcher(
+            config.storage_path,
+            ignore={BLOBS_DIR, THUMBS_DIR, TRASH_DIR, UPLOADS_DIR},
+            delay=config.sync_watch_delay,
+            batch_size=config.sync_batch_size,
+        )
+    except OSError as e:
+        log.error(f'Watcher is unavailable, falling back to interval: {e}')
+        run_interval(workers)
+        return
+
+    # Наблюдение уже включено - изменения во время обхода не потеряются
+    sync_storages(workers)
+    services.files_service().prune_thumbnails()
+    pruned_at = time.monotonic()
+    for batch in watcher.batches():
+        try:
+            if time.monotonic() - pruned_at > config.sync_interval:
+                services.files_service().prune_thumbnails()
+                pruned_at = time.monotonic()
+            if batch.full_scan:
+                sync_storages(workers)
+                continue
+
+            for owner_id in batch.owner_ids:
+                services.user_files_service(
+                    user_id=owner_id
+                ).sync_storage_and_db()
+            if batch.stored_names:
+                services.files_service().sync_stored_names(
+                    batch.stored_names
+                )
+        except Exception as e:
+            log.error(f'Sync failed: {e}')
+
+
+if __name__ == '__main__':
+    """Запуск регулярной синхронизации хранилища и БД"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='reconcile on inotify events instead of periodic full scans',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=config.sync_workers,
+        help='sync users in a pool of this many processes',
+    )
+    args = parser.parse_args()
+
+    if args.watch:
+        run_watch(args.workers)
+    else:
+        run_interval(args.workers)
@@ -0,0 +1,70 @@
+import logging
+import time
+
+from config import config
+from injectors import services
+from models.job import JOB_CHECKSUM, JOB_PURGE, JOB_SYNC, JOB_THUMBNAIL
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def handle_purge(payload: dict):
+    services.files_service().purge_trash(payload['names'])
+
+
+def handle_checksum(payload: dict):
+    services.files_service().compute_checksum(payload['file_id'])
+
+
+def handle_sync(payload: dict):
+    services.user_files_service(
+        user_id=payload['owner_id']
+    ).run_sync_job(payload['job_id'])
+
+
+def handle_thumbnail(payload: dict):
+    services.files_service().generate_thumbnails(payload['file_id'])
+
+
+HANDLERS = {
+    JOB_PURGE: handle_purge,
+    JOB_CHECKSUM: handle_checksum,
+    JOB_SYNC: handle_sync,
+    JOB_THUMBNAIL: handle_thumbnail,
+}
+
+
+def run_worker():
+    """Выполнение задач очереди, пока она не пуста, затем опрос"""
+
+    queue = services.job_queue()
+    last_requeue = 0.0
+    log.info('Jobs worker started')
+    while True:
+        if time.monotonic() - last_requeue > config.jobs_timeout / 4:
+            queue.requeue_stale(config.jobs_timeout)
+            last_requeue = time.monotonic()
+
+        job = queue.fetch()
+        if job is None:
+            time.sleep(config.jobs_poll_interval)
+            continue
+
+        handler = HANDLERS.get(job.kind)
+        try:
+            if handler is None:
+                raise ValueError(f'Unknown job kind: {job.kind}')
+            with queue.running(job, config.jobs_heartbeat_interval):
+                handler(job.payload)
+            queue.complete(job)
+            log.info(f'Job {job.id} ({job.kind}) completed')
+        except Exception as e:
+            log.error(f'Job {job.id} ({job.kind}) failed: {e}')
+            queue.fail(job, str(e))
+
+
+if __name__ == '__main__':
+    """Запуск воркера фоновых задач"""
+
+    run_worker()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from base_module.models import dumps_json
+from models.file import File, ROOT_PATH
+from models.user import User
+
+
+def make_files(count: int):
+    """Файлы без сессии БД, поля заполнены как у реальных записей"""
+
+    now = datetime.utcnow()
+    return [
+        File(
+            id=i,
+            name=f'file_{i}',
+            extension='txt',
+            stored_name=f'file_{i}.txt',
+            size=i * 10,
+            path='/app/storage',
+            creation_date=now - timedelta(seconds=i),
+            update_date=now,
+            comment='',
+            owner_id=1,
+            relative_path=ROOT_PATH,
+            sha256='0' * 64,
+        )
+        for i in range(count)
+    ]
+
+
+def make_users(count: int):
+    now = datetime.utcnow()
+    return [
+        User(id=i, username=f'user_{i}', password_hash='x', created_at=now)
+        for i in range(count)
+    ]
+
+
+def measure(name: str, func, rows):
+    started = time.perf_counter()
+    func(rows)
+    elapsed = time.perf_counter() - started
+    print(f'{name:<40} {elapsed:8.3f}s {elapsed / len(rows) * 1e6:8.2f}us/row')
+    return elapsed
+
+
+def run(count: int):
+    for model, rows in (
+            (File, make_files(count)),
+            (User, make_users(count)),
+    ):
+        print(f'{model.__name__}, {count} rows')
+        model.serializer()
+
+        factory = measure(
+            'dataclass_factory dump',
+            lambda items: [model.FACTORY.dump(item) for item in items],
+            rows,
+        )
+        compiled = measure(
+            'compiled dump',
+            lambda items: [item.dump() for item in items],
+            rows,
+        )
+        factory_json = measure(
+            'dataclass_factory dump + json.dumps',
+            lambda items: json.dumps(
+                [model.FACTORY.dump(item) for item in items]
+            ).encode(),
+            rows,
+        )
+        compiled_json = measure(
+            'compiled dump + dump_many_json',
+            model.dump_many_json,
+            rows,
+        )
+        measure(
+            'compiled dump, id+name only',
+            lambda items: dumps_json(
+                [item.dump(['id', 'name']) for item in items]
+            ),
+            rows,
+        )
+        print(
+            f'speedup: dump x{factory / compiled:.1f}, '
+            f'json x{factory_json / compiled_json:.1f}\n'
+        )
+
+
+if __name__ == '__main__':
+    """Сравнение сериализации моделей dataclass_factory и скомпилированной"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    run(args.rows)
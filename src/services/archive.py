@@ -0,0 +1,153 @@
+"""Потоковая сборка ZIP и TAR без временных архивов
+
+Архив пишется частями по мере чтения файлов с диска, в памяти держится
+не больше одного прочитанного куска и буферов сжатия
+"""
+
+import io
+import tarfile
+import time
+import zipfile
+from typing import Iterable, Iterator, NamedTuple
+
+ARCHIVE_MIMETYPES = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+# Уже сжатое содержимое кладётся в ZIP без сжатия (ZIP_STORED)
+COMPRESSED_EXTENSIONS = {
+    'mp3', 'ogg', 'flac', 'aac',
+    'mp4', 'avi', 'mkv', 'mov', 'webm',
+    'jpg', 'jpeg', 'png', 'gif', 'webp',
+    'zip', 'gz', 'tgz', 'bz2', 'xz', '7z', 'rar', 'zst',
+    'docx', 'xlsx', 'pptx',
+}
+
+# Минимальная дата, которую можно записать в заголовок ZIP
+ZIP_MIN_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+class ArchiveEntry(NamedTuple):
+    """Файл архива"""
+
+    arcname: str
+    path: str
+    size: int
+    mtime: float
+    extension: str = ''
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Поток без seek, накапливающий записанное до выдачи клиенту"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(
+    entries: Iterable[ArchiveEntry],
+    chunk_size: int,
+) -> Iterator[bytes]:
+    """ZIP архив частями
+
+    Поток не поддерживает seek, поэтому размеры и CRC пишутся
+    дескрипторами данных после содержимого каждого файла
+    """
+
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(
+                entry.arcname,
+                max(time.localtime(entry.mtime)[:6], ZIP_MIN_DATE),
+            )
+            info.external_attr = 0o644 << 16
+            # Размер заранее известен - по нему выбирается zip64
+            info.file_size = entry.size
+            if entry.extension.lower() in COMPRESSED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            with open(entry.path, 'rb') as src, archive.open(info, 'w') as dst:
+                while chunk := src.read(chunk_size):
+                    dst.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+
+            data = buffer.pop()
+            if data:
+                yield data
+
+    yield buffer.pop()
+
+
+def stream_tar(
+    entries: Iterable[ArchiveEntry],
+    chunk_size: int,
+) -> Iterator[bytes]:
+    """TAR архив (формат PAX) частями
+
+    Содержимое каждого файла обрезается или дополняется нулями до
+    размера из заголовка, даже если файл изменился во время чтения
+    """
+
+    written = 0
+    for entry in entries:
+        info = tarfile.TarInfo(entry.arcname)
+        info.size = entry.size
+        info.mtime = int(entry.mtime)
+        info.mode = 0o644
+
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        written += len(header)
+        yield header
+
+        left = entry.size
+        with open(entry.path, 'rb') as src:
+            while left > 0:
+                chunk = src.read(min(chunk_size, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield chunk
+
+        while left > 0:
+            padding = min(chunk_size, left)
+            left -= padding
+            yield tarfile.NUL * padding
+
+        written += entry.size
+        remainder = entry.size % tarfile.BLOCKSIZE
+        if remainder:
+            written += tarfile.BLOCKSIZE - remainder
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+    # Два пустых блока в конце и выравнивание по записи, как в tarfile
+    end = tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+    written += len(end)
+    remainder = written % tarfile.RECORDSIZE
+    if remainder:
+        end += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+    yield end
+
+
+ARCHIVE_WRITERS = {
+    'zip': stream_zip,
+    'tar': stream_tar,
+}
@@ -0,0 +1,329 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+import typing as t
+import uuid
+from collections import OrderedDict
+
+from base_module.models.logger import ClassesLoggerAdapter
+
+
+class LocalCache:
+    """Локальный LRU-кэш процесса с временем жизни записей"""
+
+    def __init__(self, max_size: int = 10000):
+        self._max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> t.Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            expires_at, value = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: t.Any, ttl: t.Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheService:
+    """Кэш JSON-значений в Redis
+
+    При недоступности Redis (или без клиента) используется локальный
+    кэш процесса с коротким сроком записей local_ttl: инвалидация из
+    других процессов до него не доходит
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        prefix: str = 'files',
+        local_max_size: int = 10000,
+        local_ttl: float = 5.0,
+    ):
+        self._redis = redis_client
+        self._prefix = prefix
+        self._local = LocalCache(local_max_size)
+        self._local_ttl = local_ttl
+        self._redis_available = redis_client is not None
+        self._logger = ClassesLoggerAdapter.create(self)
+
+    @property
+    def shared(self) -> bool:
+        """Последнее обращение к Redis было успешным
+
+        Иначе значения хранятся только в процессе и инвалидация из
+        других процессов их не сбрасывает
+        """
+
+        return self._redis is not None and self._redis_available
+
+    def get(self, key: str) -> t.Any:
+        key = self._key(key)
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(key)
+                self._redis_available = True
+                return json.loads(raw) if raw is not None else None
+            except Exception as e:
+                self._redis_unavailable(e)
+
+        return self._local.get(key)
+
+    def set(self, key: str, value: t.Any, ttl: t.Optional[int] = None):
+        key = self._key(key)
+        if self._redis is not None:
+            try:
+                self._redis.set(key, json.dumps(value), ex=ttl)
+                self._redis_available = True
+                return
+            except Exception as e:
+                self._redis_unavailable(e)
+
+        local_ttl = min(ttl, self._local_ttl) if ttl else self._local_ttl
+        self._local.set(key, value, local_ttl)
+
+    def delete(self, *keys: str):
+        keys = [self._key(key) for key in keys]
+        if not keys:
+            return
+
+        # Локальная копия могла остаться с периода недоступности Redis
+        self._local.delete(*keys)
+        if self._redis is not None:
+            try:
+                self._redis.delete(*keys)
+                self._redis_available = True
+            except Exception as e:
+                self._redis_available = False
+                self._logger.warning(
+                    'Не удалось инвалидировать кэш в Redis',
+                    extra={'e': str(e), 'keys': keys},
+                )
+
+    def _redis_unavailable(self, e: Exception):
+        self._redis_available = False
+        self._logger.debug(
+            'Redis недоступен, используем локальный кэш',
+            extra={'e': str(e)},
+        )
+
+    def _key(self, key: str) -> str:
+        return f'{self._prefix}:{key}'
+
+
+class MetadataCache:
+    """Кэш метаданных файлов пользователя поверх CacheService
+
+    Записи ключуются версией данных пользователя: любое изменение его
+    файлов или папок удаляет версию, и все прежние записи (файлы по id,
+    страницы списков) перестают читаться без перебора ключей.
+    Пока Redis недоступен, кэш не используется: сброс версии в одном
+    процессе не виден остальным. Счётчики попаданий - в памяти процесса
+    """
+
+    def __init__(self, cache: CacheService, ttl: int):
+        self._cache = cache
+        self._ttl = ttl
+        self._counters = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    def get(
+        self, owner_id: int, kind: str, key: str,
+    ) -> t.Tuple[t.Any, t.Optional[str]]:
+        """Значение (None при промахе) и версия для последующего set
+
+        Без Redis версия None, и set ничего не сохраняет
+        """
+
+        version = self._version(owner_id)
+        if not self._cache.shared:
+            with self._lock:
+                self._counters[kind]['bypassed'] += 1
+            return None, None
+
+        value = self._cache.get(self._key(owner_id, version, kind, key))
+        with self._lock:
+            self._counters[kind]['hits' if value is not None else 'misses'] += 1
+
+        return value, version
+
+    def set(
+        self,
+        owner_id: int,
+        version: t.Optional[str],
+        kind: str,
+        key: str,
+        value: t.Any,
+    ):
+        if version is None or not self._cache.shared:
+            return
+
+        self._cache.set(
+            self._key(owner_id, version, kind, key), value, ttl=self._ttl
+        )
+
+    def invalidation_keys(self, *owner_ids: int) -> t.List[str]:
+        """Ключи, удаление которых сбрасывает кэш пользователей"""
+
+        return [self._version_key(owner_id) for owner_id in owner_ids]
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            counters = {
+                kind: dict(counter) for kind, counter in self._counters.items()
+            }
+
+        hits = sum(counter.get('hits', 0) for counter in counters.values())
+        misses = sum(counter.get('misses', 0) for counter in counters.values())
+        return {
+            'pid': os.getpid(),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': (
+                round(hits / (hits + misses), 4) if hits + misses else None
+            ),
+            'by_kind': counters,
+        }
+
+    def _version(self, owner_id: int) -> str:
+        key = self._version_key(owner_id)
+        version = self._cache.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            self._cache.set(key, version)
+
+        return version
+
+    @staticmethod
+    def _version_key(owner_id: int) -> str:
+        return f'meta_version:{owner_id}'
+
+    @staticmethod
+    def _key(owner_id: int, version: str, kind: str, key: str) -> str:
+        return f'meta:{owner_id}:{version}:{kind}:{key}'
+
+
+class TokenCache:
+    """Проверенные токены в памяти процесса: токен -> пользователь
+
+    Ключ - sha256 токена, запись живёт не дольше exp токена и ttl.
+    Отзыв токена (logout) рассылается через Redis pub/sub всем
+    процессам; пока подписка не активна, кэш не используется - отзыв
+    мог быть пропущен
+    """
+
+    CHANNEL = 'files:tokens:revoked'
+
+    def __init__(
+        self,
+        redis_client=None,
+        max_size: int = 10000,
+        ttl: int = 300,
+        retry_delay: float = 5.0,
+    ):
+        self._redis = redis_client
+        self._local = LocalCache(max_size)
+        self._ttl = ttl
+        self._retry_delay = retry_delay
+        self._subscribed = threading.Event()
+        self._listener: t.Optional[threading.Thread] = None
+        self._logger = ClassesLoggerAdapter.create(self)
+
+    def setup(self, app):
+        """Запуск подписки на отзыв токенов в фоновом потоке"""
+
+        if self._redis is None or self._ttl <= 0 or self._listener:
+            return
+
+        self._listener = threading.Thread(
+            target=self._listen, name='token-revocations', daemon=True,
+        )
+        self._listener.start()
+
+    def get(self, token: str) -> t.Optional[dict]:
+        if not self._subscribed.is_set():
+            return None
+        return self._local.get(self._key(token))
+
+    def set(self, token: str, user: dict, expires_at: t.Optional[float]):
+        """expires_at - exp токена (unix time)"""
+
+        if not self._subscribed.is_set():
+            return
+
+        ttl = self._ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        self._local.set(self._key(token), user, ttl)
+
+    def revoke(self, token: str):
+        key = self._key(token)
+        self._local.delete(key)
+        if self._redis is None:
+            return
+
+        try:
+            self._redis.publish(self.CHANNEL, key)
+        except Exception as e:
+            self._logger.warning(
+                'Не удалось разослать отзыв токена', extra={'e': str(e)},
+            )
+
+    def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.CHANNEL)
+                # Отзывы за время без подписки потеряны
+                self._local.clear()
+                self._subscribed.set()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._local.delete(message['data'])
+            except Exception as e:
+                self._logger.warning(
+                    'Подписка на отзыв токенов прервана',
+                    extra={'e': str(e)},
+                )
+            finally:
+                self._subscribed.clear()
+                pubsub.close()
+
+            time.sleep(self._retry_delay)
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
@@ -0,0 +1,60 @@
+import os
+import typing as t
+import uuid
+
+from base_module.models.logger import ClassesLoggerAdapter
+
+
+class DiskJournal:
+    """Журнал переносов файлов, выполненных внутри транзакции БД
+
+    Файлы не удаляются, а переносятся в корзину, поэтому любое изменение
+    на диске можно отменить, если транзакция не будет зафиксирована
+    """
+
+    def __init__(self, trash_dir: str):
+        self._trash_dir = trash_dir
+        self._undo: t.List[t.Tuple[str, str, t.Optional[str]]] = []
+        self.trashed: t.List[str] = []
+        self._logger = ClassesLoggerAdapter.create(self)
+
+    def mark(self) -> int:
+        """Точка, до которой можно откатить журнал"""
+
+        return len(self._undo)
+
+    def rename(self, src: str, dst: str):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.rename(src, dst)
+        self._undo.append((dst, src, None))
+
+    def trash(self, path: str) -> bool:
+        """Перенос файла в корзину, False - файла уже нет"""
+
+        os.makedirs(self._trash_dir, exist_ok=True)
+        name = uuid.uuid4().hex
+        trash_path = os.path.join(self._trash_dir, name)
+        try:
+            os.rename(path, trash_path)
+        except FileNotFoundError:
+            return False
+
+        self._undo.append((trash_path, path, name))
+        self.trashed.append(name)
+        return True
+
+    def rollback(self, mark: int = 0):
+        """Возврат файлов на места в обратном порядке"""
+
+        while len(self._undo) > mark:
+            current, original, name = self._undo.pop()
+            if name is not None:
+                self.trashed.remove(name)
+            try:
+                os.makedirs(os.path.dirname(original), exist_ok=True)
+                os.rename(current, original)
+            except OSError as e:
+                self._logger.error(
+                    'Не удалось вернуть файл после отката транзакции',
+                    extra={'e': str(e), 'from': current, 'to': original},
+                )
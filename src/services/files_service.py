@@ -1,35 +1,116 @@
+import base64
+import binascii
+import collections
+import contextlib
 import datetime
+import hashlib
 import json
 import os
-import shutil
+import re
+import time
+import urllib.parse
 import uuid
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Callable, Iterable, Tuple, Union
 
 import sqlalchemy as sa
-from base_module.models import ModuleException
+from base_module.models import ModuleException, dumps_json
 from base_module.models.logger import ClassesLoggerAdapter
-from config import config
-from flask import request, send_file
-from models.file import File
+from config import DownloadMode, config
+from flask import Response, request, send_file, stream_with_context
+from models.blob import Blob
+from models.file import (
+    File, FILE_CATEGORIES, OTHER_CATEGORY, ROOT_PATH, file_category
+)
+from models.folder import Folder
+from models.job import JOB_CHECKSUM, JOB_PURGE, JOB_SYNC, JOB_THUMBNAIL
+from models.upload import UploadSession
+from models.sync_job import (
+    SyncJob, SYNC_ACTIVE_STATUSES, SYNC_DONE, SYNC_FAILED, SYNC_PENDING,
+    SYNC_RUNNING,
+)
+from models.usage import UserUsage
+from PIL import Image
+from services.archive import ARCHIVE_MIMETYPES, ARCHIVE_WRITERS, ArchiveEntry
+from services.cache import CacheService, MetadataCache
+from services.disk_journal import DiskJournal
+from services.jobs import JobQueue
+from services.locks import file_lock, sync_lock
+from services.thumbnails import (
+    THUMBNAIL_MIMETYPE, THUMBNAIL_SIZES, prune_thumbnails, render_thumbnails
+)
+from services.multipart import MultipartFileReceiver, UploadTooLarge
+from sqlalchemy import orm
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session as PGSession
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
 
+# Каталог блобов содержимого в корне хранилища
+BLOBS_DIR = '.blobs'
+
+# Каталог временных файлов загрузок в хранилище пользователя
+UPLOADS_DIR = '.uploads'
+
+# id сессии загрузки (uuid4 hex), из него строится путь временного файла
+UPLOAD_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+# Корзина в корне хранилища: удалённые файлы до очистки воркером
+TRASH_DIR = '.trash'
+
+# Миниатюры изображений в корне хранилища, рядом с блобами
+THUMBS_DIR = '.thumbs'
+
+# Служебные каталоги корня хранилища, не относящиеся к пользователям
+SERVICE_DIRS = (BLOBS_DIR, TRASH_DIR, THUMBS_DIR)
+
+# Запас на заголовки частей и поле fields при раннем отказе по Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Путь файла в хранилище пользователя берётся из папки
+FILE_RELATIVE_PATH = sa.func.coalesce(Folder.path, ROOT_PATH).label(
+    'relative_path'
+)
+
+# Колонки выдачи файла без ORM-объекта: строки сериализуются в то же,
+# что и File.dump()
+FILE_COLUMNS = tuple(
+    column for column in File.__table__.c if column.key != 'relative_path'
+) + (FILE_RELATIVE_PATH,)
+
+# Колонки, по которым синхронизация находит файл на диске
+SYNC_COLUMNS = (
+    File.stored_name,
+    File.owner_id,
+    File.extension,
+    File.folder_id,
+    FILE_RELATIVE_PATH,
+)
+
 
 class FilesService:
     """Сервис работы с файлами"""
 
-    FILE_CATEGORIES = {
-        'audio': {'mp3', 'wav', 'ogg', 'flac', 'aac'},
-        'video': {'mp4', 'avi', 'mkv', 'mov', 'webm'},
-        'images': {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'},
-        'documents': {
-            'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt'
-        },
-    }
+    FILE_CATEGORIES = FILE_CATEGORIES
 
-    def __init__(self, pg_connection: PGSession, user_id: int | None = None):
+    def __init__(
+        self,
+        pg_connection: PGSession,
+        user_id: int | None = None,
+        cache: CacheService | None = None,
+        jobs: JobQueue | None = None,
+        metadata: MetadataCache | None = None,
+    ):
         self._pg = pg_connection
         self._user_id = user_id
+        self._cache = cache or CacheService()
+        self._metadata = metadata or MetadataCache(
+            self._cache, ttl=config.metadata_cache_ttl
+        )
+        self._jobs = jobs or JobQueue(
+            pg_connection,
+            max_attempts=config.jobs_max_attempts,
+            retry_delay=config.jobs_retry_delay,
+        )
         self._logger = ClassesLoggerAdapter.create(self)
 
         self.max_user_storage = config.max_user_storage_bytes / 1024 / 1024
@@ -41,122 +122,722 @@ class FilesService:
 
         os.makedirs(self._st, exist_ok=True)
 
-    def sync_storage_and_db(self):
-        """Глобальная синхронизация хранилища и БД
+    def sync_storage_and_db(
+        self,
+        progress: Optional[Callable[[Optional[Dict[str, int]]], None]] = None,
+        wait: bool = True,
+    ) -> Dict[str, int]:
+        """Синхронизация хранилища и БД
         Только удаляет записи из БД, если файлов нет на диске
         Не добавляет новые записи в БД (файлы добавляются только через API)
+
+        Сервис пользователя сверяет только его каталог и его записи.
+        Диск обходится одним проходом os.scandir, в котором же удаляются
+        пустые каталоги. Записи читаются пачками по stored_name (keyset),
+        отсутствующие на диске удаляются пакетно в коротких транзакциях,
+        поэтому память и блокировки не зависят от числа файлов.
+
+        Выполняется под блокировкой синхронизации (sync_lock): при
+        wait=False занятая блокировка пропускает синхронизацию.
+        progress вызывается после каждой пачки и не реже раза в
+        sync_progress_interval секунд при обходе диска, при ожидании
+        блокировки - с None
+        """
+
+        on_wait = (lambda: progress(None)) if progress else None
+        with self.sync_lock(blocking=wait, on_wait=on_wait) as acquired:
+            if not acquired:
+                self._logger.info('Синхронизация уже выполняется, пропуск')
+                return {'locked': 1}
+
+            return self._sync_storage_and_db(progress)
+
+    def sync_lock(self, blocking: bool = True, on_wait=None):
+        """Блокировка синхронизации хранилища этого сервиса"""
+
+        return sync_lock(
+            self._pg.get_bind(),
+            self._user_id,
+            blocking=blocking,
+            on_wait=on_wait,
+        )
+
+    def _sync_storage_and_db(
+        self,
+        progress: Optional[Callable[[Optional[Dict[str, int]]], None]],
+    ) -> Dict[str, int]:
+        report = collections.Counter()
+
+        on_entry = None
+        if progress is not None:
+            # Обход большого дерева может идти дольше sync_job_timeout,
+            # задача не должна выглядеть брошенной
+            last_progress = time.monotonic()
+
+            def on_entry():
+                nonlocal last_progress
+                now = time.monotonic()
+                if now - last_progress >= config.sync_progress_interval:
+                    last_progress = now
+                    progress(dict(report))
+
+        self._scan_storage(self._st, report, top=True, on_entry=on_entry)
+        self._logger.info(
+            f'Найдено {report["disk_files"]} файлов на диске в UUID формате'
+        )
+
+        self._cleanup_uploads()
+
+        with self._pg.begin():
+            query = self._pg.query(sa.func.count(File.id))
+            if self._user_id is not None:
+                query = query.filter(File.owner_id == self._user_id)
+            report['db_total'] = query.scalar()
+        if progress is not None:
+            progress(dict(report))
+
+        last_stored_name = ''
+        while True:
+            with self._pg.begin():
+                query = self._sync_rows_query().filter(
+                    File.stored_name > last_stored_name
+                )
+                if self._user_id is not None:
+                    query = query.filter(File.owner_id == self._user_id)
+                rows = (
+                    query.order_by(File.stored_name)
+                    .limit(config.sync_batch_size)
+                    .all()
+                )
+
+            if not rows:
+                break
+
+            last_stored_name = rows[-1].stored_name
+            report['db_files'] += len(rows)
+            missing = [
+                row for row in rows
+                if not os.path.exists(self._row_full_path(row))
+            ]
+            if missing:
+                report['deleted'] += self._delete_missing_files(missing)
+            if progress is not None:
+                progress(dict(report))
+
+        self._logger.info(f'Найдено {report["db_files"]} записей в БД')
+        self._logger.info(f'Удалено {report["deleted"]} записей из БД')
+        self._logger.debug('Синхронизация прошла успешно')
+
+        return dict(report)
+
+    def create_sync_job(self) -> Tuple[Dict[str, Any], bool]:
+        """Задача синхронизации хранилища пользователя
+
+        Пока у пользователя есть активная задача, новая не создаётся -
+        возвращается активная. Второй элемент - создана ли задача
+        """
+
+        now = datetime.datetime.utcnow()
+        with self._pg.begin():
+            # Задачи упавшего процесса не должны блокировать новые
+            self._pg.execute(
+                sa.update(SyncJob)
+                .where(
+                    SyncJob.owner_id == self._user_id,
+                    SyncJob.status.in_(SYNC_ACTIVE_STATUSES),
+                    SyncJob.update_date < now - datetime.timedelta(
+                        seconds=config.sync_job_timeout
+                    ),
+                )
+                .values(
+                    status=SYNC_FAILED,
+                    error='Abandoned',
+                    finish_date=now,
+                )
+            )
+
+            created_id = self._pg.execute(
+                postgresql.insert(SyncJob)
+                .values(
+                    id=uuid.uuid4().hex,
+                    owner_id=self._user_id,
+                    status=SYNC_PENDING,
+                    creation_date=now,
+                    update_date=now,
+                )
+                .on_conflict_do_nothing(
+                    index_elements=['owner_id'],
+                    index_where=sa.text("status IN ('pending', 'running')"),
+                )
+                .returning(SyncJob.id)
+            ).scalar()
+            if created_id is not None and config.jobs_enabled:
+                self._jobs.enqueue(
+                    JOB_SYNC,
+                    {'owner_id': self._user_id, 'job_id': created_id},
+                )
+
+            job = (
+                self._pg.query(SyncJob)
+                .filter(
+                    SyncJob.owner_id == self._user_id,
+                    SyncJob.status.in_(SYNC_ACTIVE_STATUSES),
+                )
+                .first()
+            )
+            if job is None:
+                # Активная задача завершилась между вставкой и чтением
+                raise ModuleException(
+                    'Sync job conflict, retry', {'data': ''}, 409
+                )
+
+            self._logger.debug(
+                'Задача синхронизации',
+                extra={'id': job.id, 'created': created_id is not None},
+            )
+            return job.dump(), created_id is not None
+
+    def get_sync_job(self, job_id: str) -> Dict[str, Any]:
+        """Статус и прогресс задачи синхронизации"""
+
+        with self._pg.begin():
+            job = self._pg.query(SyncJob).get(job_id)
+            if job is None or job.owner_id != self._user_id:
+                raise ModuleException('Sync job not found', {'data': ''}, 404)
+
+            return job.dump()
+
+    def run_sync_job(self, job_id: str):
+        """Выполнение задачи синхронизации с записью прогресса"""
+
+        def update_job(**values):
+            values['update_date'] = datetime.datetime.utcnow()
+            with self._pg.begin():
+                self._pg.execute(
+                    sa.update(SyncJob)
+                    .where(SyncJob.id == job_id)
+                    .values(values)
+                )
+
+        def progress(report: Optional[Dict[str, int]]):
+            if report is None:
+                update_job()
+            else:
+                update_job(
+                    status=SYNC_RUNNING,
+                    total=report.get('db_total', 0),
+                    processed=report.get('db_files', 0),
+                    deleted=report.get('deleted', 0),
+                )
+
+        try:
+            report = self.sync_storage_and_db(progress=progress)
+            update_job(
+                status=SYNC_DONE,
+                processed=report.get('db_files', 0),
+                deleted=report.get('deleted', 0),
+                report=report,
+                finish_date=datetime.datetime.utcnow(),
+            )
+        except Exception as e:
+            self._logger.error(
+                'Ошибка синхронизации', exc_info=True, extra={'id': job_id}
+            )
+            update_job(
+                status=SYNC_FAILED,
+                error=str(e),
+                finish_date=datetime.datetime.utcnow(),
+            )
+        finally:
+            self._pg.close()
+
+    def get_sync_owner_ids(self) -> List[int]:
+        """Пользователи для шардированной синхронизации
+
+        Каталоги пользователей на диске и владельцы записей в БД,
+        крупные хранилища первыми - так пул загружается равномернее
+        """
+
+        owner_ids = set()
+        with os.scandir(config.storage_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and entry.name.isdigit():
+                    owner_ids.add(int(entry.name))
+
+        with self._pg.begin():
+            owner_ids.update(
+                owner_id
+                for owner_id, in self._pg.query(File.owner_id).distinct()
+            )
+            used_bytes = dict(
+                self._pg.query(UserUsage.user_id, UserUsage.used_bytes)
+            )
+
+        return sorted(
+            owner_ids,
+            key=lambda owner_id: (-(used_bytes.get(owner_id) or 0), owner_id),
+        )
+
+    def sync_stored_names(self, stored_names: Iterable[str]) -> int:
+        """Сверка только указанных файлов (по событиям файловой системы)
+
+        Возвращает число удалённых записей
         """
 
-        # Собираем все stored_name (UUID) файлов на диске
-        disk_stored_names = set()
+        stored_names = sorted(set(stored_names))
+        deleted = 0
+        for start in range(0, len(stored_names), config.sync_batch_size):
+            batch = stored_names[start:start + config.sync_batch_size]
+            with self._pg.begin():
+                query = self._sync_rows_query().filter(
+                    File.stored_name == sa.any_(sa.bindparam(
+                        'batch', batch, type_=postgresql.ARRAY(sa.String)
+                    ))
+                )
+                if self._user_id is not None:
+                    query = query.filter(File.owner_id == self._user_id)
+                rows = query.all()
 
-        for root, _, files in os.walk(config.storage_path):
-            for filename in files:
-                full_path = os.path.normpath(os.path.join(root, filename))
-                dir_path, fname = os.path.split(full_path)
+            missing = [
+                row for row in rows
+                if not os.path.exists(self._row_full_path(row))
+            ]
+            if missing:
+                deleted += self._delete_missing_files(missing)
+
+        self._logger.info(
+            f'Сверено {len(stored_names)} файлов, удалено {deleted} записей'
+        )
+        return deleted
 
-                # Разделяем имя и расширение
-                name, extension = os.path.splitext(fname)
-                extension = extension.lstrip('.')
+    def _scan_storage(
+        self,
+        path: str,
+        report: collections.Counter,
+        top: bool = False,
+        on_entry: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """Обход каталога: учёт файлов и удаление пустых подкаталогов
+
+        on_entry вызывается для каждого элемента каталога.
+        Возвращает True, если каталог пуст после обхода
+        """
 
+        empty = True
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if on_entry is not None:
+                    on_entry()
+
+                if entry.is_dir(follow_symlinks=False):
+                    # Блобы, корзина и миниатюры - не файлы пользователей
+                    if top and entry.name in SERVICE_DIRS:
+                        empty = False
+                        continue
+
+                    if not self._scan_storage(
+                            entry.path, report, on_entry=on_entry):
+                        empty = False
+                        continue
+
+                    try:
+                        os.rmdir(entry.path)
+                        report['pruned_dirs'] += 1
+                    except OSError:
+                        empty = False
+                        self._logger.warning(
+                            f'Не удаётся удалить пустую директорию {entry.path}'
+                        )
+                    continue
+
+                empty = False
+                name, _ = os.path.splitext(entry.name)
                 # Проверяем, является ли имя UUID (32 hex символа)
-                # Если да - добавляем в список
                 if len(name) == 32 and all(
                         c in '0123456789abcdef' for c in name):
-                    disk_stored_names.add(name)
+                    report['disk_files'] += 1
                 else:
                     # Если файл не в UUID формате, пропускаем его
                     # (возможно, старый файл или системный файл)
+                    report['skipped_files'] += 1
                     self._logger.warning(
-                        f'Файл не в UUID формате, пропускаем: {filename}',
-                        extra={'path': full_path}
+                        f'Файл не в UUID формате, пропускаем: {entry.name}',
+                        extra={'path': entry.path}
                     )
 
-        self._logger.info(
-            f'Найдено {len(disk_stored_names)} файлов на диске в UUID формате'
+        return empty
+
+    def _sync_rows_query(self):
+        """Строки SYNC_COLUMNS вместо ORM-объектов File"""
+
+        return (
+            self._pg.query(*SYNC_COLUMNS)
+            .select_from(File)
+            .outerjoin(Folder, File.folder_id == Folder.id)
         )
 
+    def _delete_missing_files(self, candidates: List[sa.Row]) -> int:
+        """Пакетное удаление записей о файлах, отсутствующих на диске
+
+        candidates - строки SYNC_COLUMNS. Перед удалением строки
+        блокируются, а их папки перечитываются: файл мог быть перенесён
+        уже после чтения пачки
+        """
+
+        folder_ids = {
+            row.folder_id for row in candidates if row.folder_id is not None
+        }
+
         with self._pg.begin():
-            # Получаем все файлы из БД
-            db_files = self._pg.query(File).all()
-
-            self._logger.info(f'Найдено {len(db_files)} записей в БД')
-
-            # Удаляем записи, которых нет на диске
-            deleted_count = 0
-            for file in db_files:
-                if file.stored_name not in disk_stored_names:
-                    self._logger.info(
-                        'Удаление записи из БД (файл отсутствует на диске)',
-                        extra={
-                            'id': file.id,
-                            'stored_name': file.stored_name,
-                            'name': file.name,
-                            'path': file.relative_path
-                        }
-                    )
-                    self._pg.delete(file)
-                    deleted_count += 1
+            if folder_ids:
+                # Дожидаемся незавершённых переименований папок
+                self._pg.execute(
+                    sa.select(Folder.id)
+                    .where(Folder.id == sa.any_(sa.bindparam(
+                        'folder_ids', list(folder_ids),
+                        type_=postgresql.ARRAY(sa.BigInteger),
+                    )))
+                    .with_for_update(read=True)
+                )
 
-            self._logger.info(f'Удалено {deleted_count} записей из БД')
+            rows = (
+                self._sync_rows_query()
+                .filter(File.stored_name == sa.any_(sa.bindparam(
+                    'batch',
+                    [row.stored_name for row in candidates],
+                    type_=postgresql.ARRAY(sa.String),
+                )))
+                .with_for_update(of=File)
+                .all()
+            )
+            batch = [
+                row.stored_name for row in rows
+                if not os.path.exists(self._row_full_path(row))
+            ]
+            if not batch:
+                return 0
+
+            deleted = self._pg.execute(
+                sa.delete(File)
+                .where(File.stored_name == sa.any_(sa.bindparam(
+                    'batch', batch, type_=postgresql.ARRAY(sa.String)
+                )))
+                .returning(
+                    File.id, File.stored_name, File.name, File.owner_id,
+                    File.size, File.category, File.sha256,
+                )
+                .execution_options(synchronize_session=False)
+            ).all()
 
-        for root, _, _ in os.walk(config.storage_path, topdown=False):
-            if (
-                    not os.listdir(root)
-                    and os.path.abspath(root) != os.path.abspath(
-                config.storage_path)
-            ):
-                try:
-                    os.rmdir(root)
-                except OSError:
-                    self._logger.warning(
-                        f'Не удаётся удалить пустую директорию {root}')
+            usage = collections.defaultdict(collections.Counter)
+            blobs = collections.Counter()
+            self._discard_thumbnails(
+                row.stored_name for row in deleted if not row.sha256
+            )
+            for row in deleted:
+                self._logger.info(
+                    'Удаление записи из БД (файл отсутствует на диске)',
+                    extra={
+                        'id': row.id,
+                        'stored_name': row.stored_name,
+                        'name': row.name,
+                    }
+                )
+                usage[row.owner_id][row.category] -= row.size or 0
+                if row.sha256:
+                    blobs[row.sha256] += 1
 
-        self._logger.debug('Синхронизация прошла успешно')
+            for owner_id, deltas in usage.items():
+                self._change_usage_by_category(owner_id, deltas)
+            self._release_blobs(blobs)
+
+        self._invalidate_cache(*usage)
+        return len(deleted)
 
     def get_files(self) -> List[Dict[str, Any]]:
         """Получение списка файлов с расширенным поиском"""
 
-        path_filter = request.args.get('path', '').lower()
+        files = self._cached_metadata(
+            'files', self._request_args_key(), self._load_files
+        )
+        if not files:
+            raise ModuleException('No files found', {'data': ''}, 404)
+
+        return files
+
+    def _load_files(self) -> List[Dict[str, Any]]:
         with self._pg.begin():
-            query = self._pg.query(File).filter(File.owner_id == self._user_id)
+            rows = self._files_query().all()
 
-            if path_filter:
-                query = query.filter(
-                    (File.relative_path.ilike(f'%{path_filter}%')) |
-                    (File.name.ilike(f'%{path_filter}%')) |
-                    (File.extension.ilike(f'%{path_filter}%'))
-                )
+        self._logger.debug('Файлы успешно получены')
+        dump = File.serializer()
+        return [dump(row) for row in rows]
+
+    def get_files_page(self) -> Dict[str, Any]:
+        """Постраничное получение списка файлов (keyset по id)"""
+
+        return self._cached_metadata(
+            'files_page', self._request_args_key(), self._load_files_page
+        )
+
+    def _load_files_page(self) -> Dict[str, Any]:
+        limit = self._get_page_limit()
+        after_id = self._decode_cursor(request.args.get('cursor'))
+
+        with self._pg.begin():
+            query = self._files_query().order_by(File.id)
+            if after_id is not None:
+                query = query.filter(File.id > after_id)
+
+            rows = query.limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        self._logger.debug(
+            'Страница файлов успешно получена',
+            extra={'count': len(rows), 'after_id': after_id},
+        )
+        dump = File.serializer()
+        return {
+            'items': [dump(row) for row in rows],
+            'next_cursor': (
+                self._encode_cursor(rows[-1].id) if has_more else None
+            ),
+        }
+
+    def stream_files(self) -> Response:
+        """Потоковая выдача списка файлов одним JSON-массивом
+
+        Строки читаются серверным курсором пачками по
+        config.files_stream_batch, поэтому память не растёт с числом файлов
+        """
+
+        def generate():
+            try:
+                with self._pg.begin():
+                    yield b'['
+                    rows = (
+                        self._files_query()
+                        .order_by(File.id)
+                        .yield_per(config.files_stream_batch)
+                    )
+                    dump = File.serializer()
+                    for i, row in enumerate(rows):
+                        yield (b',' if i else b'') + dumps_json(dump(row))
+                    yield b']'
+            finally:
+                # after_request уже вернул сессию, закрываем её сами
+                self._pg.close()
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/json',
+        )
+
+    def search_files(self) -> Dict[str, Any]:
+        """Ранжированный поиск файлов по имени, расширению и пути
+
+        mode=substring (по умолчанию) - поиск подстроки по триграммным
+        индексам, mode=prefix - поиск по началу имени через btree
+        """
+
+        term = request.args.get('q', '').strip().lower()
+        if not term:
+            raise ModuleException('Missing search query', {'data': ''}, 400)
+
+        mode = request.args.get('mode', 'substring')
+        if mode not in ('substring', 'prefix'):
+            raise ModuleException('Invalid search mode', {'data': ''}, 400)
+
+        # Триграммы строятся минимум по 3 символам, короткий запрос
+        # индекс не отсечёт - ищем по префиксу
+        if len(term) < 3:
+            mode = 'prefix'
+
+        limit = self._get_page_limit()
+        try:
+            offset = max(int(request.args.get('offset', 0)), 0)
+        except ValueError:
+            raise ModuleException('Invalid offset', {'data': ''}, 400)
+
+        query = self._file_rows_query()
+        if mode == 'prefix':
+            lower_name = sa.func.lower(File.name)
+            query = query.filter(
+                lower_name.like(f'{self._escape_like(term)}%', escape='\\')
+            ).order_by(lower_name, File.id)
+        else:
+            rank = sa.func.greatest(
+                sa.func.similarity(File.name, term),
+                sa.func.similarity(File.extension, term),
+                sa.func.similarity(sa.func.coalesce(Folder.path, ''), term),
+            )
+            query = query.filter(
+                self._substring_filter(term)
+            ).order_by(rank.desc(), File.id)
+
+        with self._pg.begin():
+            rows = query.offset(offset).limit(limit).all()
+
+            self._logger.debug(
+                'Поиск файлов выполнен',
+                extra={'mode': mode, 'count': len(rows)},
+            )
+            dump = File.serializer()
+            return {
+                'items': [dump(row) for row in rows],
+                'limit': limit,
+                'offset': offset,
+            }
+
+    def _files_query(self):
+        """Строки файлов пользователя с фильтром по пути или папке"""
+
+        path_filter = request.args.get('path', '').lower()
+        query = self._file_rows_query()
+
+        if path_filter:
+            query = query.filter(self._substring_filter(path_filter))
+
+        # folder_id=0 - файлы в корне хранилища
+        folder_id = request.args.get('folder_id')
+        if folder_id is not None:
+            try:
+                folder_id = int(folder_id)
+            except ValueError:
+                raise ModuleException('Invalid folder_id', {'data': ''}, 400)
+
+            if folder_id:
+                query = query.filter(File.folder_id == folder_id)
+            else:
+                query = query.filter(File.folder_id.is_(None))
+
+        return query
+
+    def _owned_files_query(self):
+        """Файлы пользователя вместе с папкой одним запросом
+
+        Папка присоединяется явно, чтобы по её пути можно было фильтровать
+        """
+
+        return (
+            self._pg.query(File)
+            .outerjoin(File.folder)
+            .options(orm.contains_eager(File.folder))
+            .filter(File.owner_id == self._user_id)
+        )
+
+    def _file_rows_query(self):
+        """Файлы пользователя строками FILE_COLUMNS, только для чтения
+
+        Без ORM-объектов, identity map и инструментирования атрибутов;
+        строка сериализуется File.serializer() так же, как File.dump()
+        """
+
+        return (
+            self._pg.query(*FILE_COLUMNS)
+            .select_from(File)
+            .outerjoin(Folder, File.folder_id == Folder.id)
+            .filter(File.owner_id == self._user_id)
+        )
+
+    def _substring_filter(self, term: str):
+        """Поиск подстроки в пути, имени и расширении (ILIKE)
+
+        OR условий по files и folders через внешнее соединение не может
+        использовать триграммные индексы обеих таблиц, поэтому id файлов
+        собираются UNION: совпадения имени и расширения по индексам files
+        и совпадения пути по индексу folders с присоединением файлов папки
+        """
+
+        pattern = f'%{self._escape_like(term)}%'
+        by_name = sa.select(File.id).where(
+            File.owner_id == self._user_id,
+            File.name.ilike(pattern, escape='\\')
+            | File.extension.ilike(pattern, escape='\\'),
+        )
+        by_path = (
+            sa.select(File.id)
+            .join(Folder, File.folder_id == Folder.id)
+            .where(
+                Folder.owner_id == self._user_id,
+                Folder.path.ilike(pattern, escape='\\'),
+                File.owner_id == self._user_id,
+            )
+        )
+        return File.id.in_(sa.union(by_name, by_path))
+
+    @staticmethod
+    def _escape_like(term: str) -> str:
+        """Экранирование спецсимволов LIKE"""
+
+        return (
+            term.replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_')
+        )
+
+    @staticmethod
+    def _get_page_limit() -> int:
+        """Размер страницы из параметра limit"""
+
+        raw_limit = request.args.get('limit')
+        if not raw_limit:
+            return config.files_page_limit
+
+        try:
+            limit = int(raw_limit)
+        except ValueError:
+            raise ModuleException('Invalid limit', {'data': ''}, 400)
+
+        if limit < 1:
+            raise ModuleException('Invalid limit', {'data': ''}, 400)
+
+        return min(limit, config.files_page_max_limit)
+
+    @staticmethod
+    def _encode_cursor(last_id: int) -> str:
+        """Непрозрачный курсор следующей страницы"""
+
+        raw = json.dumps({'id': last_id}).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
 
-            files = query.all()
-            if not files:
-                raise ModuleException('No files found', {'data': ''}, 404)
+    @staticmethod
+    def _decode_cursor(cursor: Optional[str]) -> Optional[int]:
+        """id последнего файла предыдущей страницы"""
 
-            self._logger.debug('Файлы успешно получены')
-            return [file.dump() for file in files]
+        if not cursor:
+            return None
+
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded))
+            return int(data['id'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise ModuleException('Invalid cursor', {'data': ''}, 400)
 
     def get_file_by_id(
         self,
         input_id: int,
         session: Optional[PGSession] = None,
+        for_update: bool = False,
     ) -> Union[Dict[str, Any], File]:
-        """Получение файла по ID"""
+        """Получение файла по ID
 
-        if session is None:
-            with self._pg.begin():
-                file = self._pg.query(File).get(input_id)
-                if not file or (self._user_id and file.owner_id != self._user_id):
-                    raise ModuleException(
-                        'File not found or access denied', {'data': ''}, 404
-                    )
+        С session - строка в транзакции вызывающего, for_update
+        блокирует её до конца транзакции
+        """
 
-                self._logger.debug(
-                    'Файл успешно получен',
-                    extra={'id': input_id},
-                )
-                return file.dump()
+        if session is None:
+            return self._cached_metadata(
+                'file', str(input_id), lambda: self._load_file(input_id)
+            )
         else:
-            file = session.query(File).get(input_id)
+            query = session.query(File).filter(File.id == input_id)
+            if for_update:
+                query = query.with_for_update(of=File)
+            file = query.first()
             if not file or (self._user_id and file.owner_id != self._user_id):
                 raise ModuleException(
                     'File not found or access denied', {'data': ''}, 404
@@ -165,6 +846,17 @@ class FilesService:
             self._logger.debug('Файл успешно получен', extra={'id': input_id})
             return file
 
+    def _load_file(self, input_id: int) -> Dict[str, Any]:
+        with self._pg.begin():
+            file = self._pg.query(File).get(input_id)
+            if not file or (self._user_id and file.owner_id != self._user_id):
+                raise ModuleException(
+                    'File not found or access denied', {'data': ''}, 404
+                )
+
+            self._logger.debug('Файл успешно получен', extra={'id': input_id})
+            return file.dump()
+
     def get_file_by_name(self, file_name: str) -> Dict[str, Any]:
         """Получение файла по имени пользователя"""
 
@@ -191,7 +883,11 @@ class FilesService:
             return file.dump()
 
     def download_file(self, file_id: int):
-        """Скачивание файла по ID"""
+        """Скачивание файла по ID
+
+        Поддерживает Range (в том числе несколько диапазонов),
+        If-None-Match/If-Modified-Since (304) и If-Range
+        """
 
         file = self.get_file_by_id(file_id)
 
@@ -217,241 +913,2041 @@ class FilesService:
         download_filename = f"{file['name']}.{file['extension']}" if file[
             'extension'] else file['name']
 
-        import urllib.parse
-        encoded_filename = urllib.parse.quote(download_filename, safe='')
+        etag = self._file_etag(file)
+        last_modified = self._file_last_modified(file)
 
-        response = send_file(
-            full_path,
-            as_attachment=True,
-            download_name=download_filename,
-            mimetype='application/octet-stream',
-        )
+        if config.download_mode != DownloadMode.DIRECT:
+            response = self._offload_response(full_path, etag, last_modified)
+        else:
+            response = self._multirange_response(
+                full_path, etag, last_modified
+            )
+
+        if response is None:
+            # Без Range или один диапазон, 304 и If-Range обрабатывает werkzeug
+            response = send_file(
+                full_path,
+                as_attachment=True,
+                download_name=download_filename,
+                mimetype='application/octet-stream',
+                conditional=True,
+                etag=etag,
+                last_modified=last_modified,
+            )
 
-        response.headers[
-            'Content-Disposition'] = f"attachment; filename*=UTF-8''{encoded_filename}"
+        response.cache_control.private = True
+        response.headers['Content-Disposition'] = self._content_disposition(
+            download_filename
+        )
 
         return response
 
-    def upload_file(self) -> Dict[str, Any]:
-        """Загрузка файла в хранилище пользователя и БД"""
+    def download_archive(self) -> Response:
+        """Скачивание папки или набора файлов одним ZIP/TAR архивом
+
+        Архив собирается на лету из файлов на диске, строки читаются
+        серверным курсором, поэтому память не зависит от числа файлов
+        """
 
-        raw_fields = request.form.get('fields')
-        if not raw_fields:
-            raise ModuleException('Missing form fields', {'data': ''}, 400)
+        archive_format = request.args.get('format', 'zip')
+        if archive_format not in ARCHIVE_WRITERS:
+            raise ModuleException('Invalid archive format', {'data': ''}, 400)
 
-        fields = json.loads(raw_fields)
-        uploaded_file = request.files.get('attachment')
-        if not uploaded_file:
-            raise ModuleException('File not found', {'data': ''}, 400)
+        try:
+            folder_id = request.args.get('folder_id', type=int)
+            ids = [
+                int(file_id)
+                for file_id in request.args.get('ids', '').split(',')
+                if file_id.strip()
+            ]
+        except ValueError:
+            raise ModuleException('Invalid ids', {'data': ''}, 400)
 
-        relative_path = os.path.normpath(fields.get('path', '')).lstrip(os.sep)
-        full_storage_path = os.path.join(self._st, relative_path)
+        if not folder_id and not ids:
+            raise ModuleException('Missing folder_id or ids', {'data': ''}, 400)
+        if len(ids) > config.archive_max_files:
+            raise ModuleException(
+                'Too many files',
+                {'data': {'max': config.archive_max_files}},
+                400,
+            )
 
-        original_filename = uploaded_file.filename
-        if not original_filename:
-            raise ModuleException('Invalid filename', {'data': ''}, 400)
+        folder = None
+        if folder_id:
+            with self._pg.begin():
+                folder = self._get_folder_by_id(folder_id)
+
+        def entries():
+            try:
+                with self._pg.begin():
+                    query = self._owned_files_query().order_by(File.id)
+                    if folder is not None:
+                        # Папка вместе со всеми подпапками
+                        query = query.filter(
+                            (Folder.id == folder.id) |
+                            (sa.func.left(Folder.path, len(folder.path) + 1)
+                             == folder.path + '/')
+                        )
+                    else:
+                        query = query.filter(File.id == sa.any_(sa.bindparam(
+                            'ids', ids, type_=postgresql.ARRAY(sa.Integer)
+                        )))
+
+                    arcnames = set()
+                    for file in query.yield_per(config.files_stream_batch):
+                        entry = self._archive_entry(file, folder, arcnames)
+                        if entry is not None:
+                            yield entry
+            finally:
+                # after_request уже вернул сессию, закрываем её сами
+                self._pg.close()
+
+        writer = ARCHIVE_WRITERS[archive_format]
+        response = Response(
+            stream_with_context(writer(entries(), config.archive_chunk_size)),
+            mimetype=ARCHIVE_MIMETYPES[archive_format],
+        )
+        response.cache_control.private = True
+        response.headers['Content-Disposition'] = self._content_disposition(
+            f'{folder.name if folder else "files"}.{archive_format}'
+        )
 
-        if '.' in original_filename:
-            name, extension = original_filename.rsplit('.', 1)
-        else:
-            name, extension = original_filename, ''
+        self._logger.debug(
+            'Начата выдача архива',
+            extra={'folder_id': folder_id, 'count': len(ids)},
+        )
+        return response
 
-        stored_name = uuid.uuid4().hex
-        disk_filename = (
-            f"{stored_name}.{extension}"
-            if extension else stored_name
+    def _archive_entry(
+        self,
+        file: File,
+        folder: Optional[Folder],
+        arcnames: set,
+    ) -> Optional[ArchiveEntry]:
+        """Файл архива: путь внутри архива и размер по файлу на диске
+
+        Пути считаются от выбранной папки, одинаковые имена
+        различаются суффиксом " (n)"
+        """
+
+        full_path = self._file_full_path(file)
+        try:
+            stat = os.stat(full_path)
+        except FileNotFoundError:
+            self._logger.warning(
+                'Файл отсутствует на диске, пропущен в архиве',
+                extra={'id': file.id, 'stored_name': file.stored_name},
+            )
+            return None
+
+        relative_path = self._file_relative_path(file)
+        if folder is not None:
+            relative_path = relative_path[len(folder.path) - len(folder.name):]
+        directory = '' if relative_path == ROOT_PATH else relative_path + '/'
+
+        suffix = f'.{file.extension}' if file.extension else ''
+        arcname = f'{directory}{file.name}{suffix}'
+        copy = 1
+        while arcname in arcnames:
+            arcname = f'{directory}{file.name} ({copy}){suffix}'
+            copy += 1
+        arcnames.add(arcname)
+
+        return ArchiveEntry(
+            arcname=arcname,
+            path=full_path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            extension=file.extension or '',
         )
 
-        os.makedirs(full_storage_path, exist_ok=True)
-        full_path = os.path.join(full_storage_path, disk_filename)
+    def get_thumbnail(self, file_id: int) -> Response:
+        """Миниатюра изображения фиксированного размера
 
-        uploaded_file.stream.seek(0, os.SEEK_END)
-        new_file_size = uploaded_file.stream.tell()
-        uploaded_file.stream.seek(0)
+        Миниатюры строятся воркером после загрузки (при jobs_enabled,
+        пока её нет - 202, повторные запросы не ставят новых задач,
+        пока прежняя не выполнена) или при первом запросе. Ключ
+        миниатюры - sha256 содержимого, одинаковые файлы делят миниатюры
+        """
 
-        with self._pg.begin():
-            used_bytes = self._get_user_used_bytes()
+        size = request.args.get('size', 'medium')
+        if size not in THUMBNAIL_SIZES:
+            raise ModuleException('Invalid thumbnail size', {'data': ''}, 400)
 
-        if used_bytes + new_file_size > self.max_user_storage * 1024 * 1024:
-            raise ModuleException(
-                'Storage limit exceeded (20 GB)',
-                {
-                    'data': {
-                        'used_mb': round(used_bytes / 1024 / 1024, 2),
-                        'limit_mb': self.max_user_storage
-                    },
-                },
-                413,
+        file = self.get_file_by_id(file_id)
+        if file['category'] != 'images':
+            raise ModuleException('File is not an image', {'data': ''}, 400)
+
+        key = file['sha256'] or file['stored_name']
+        path = self._thumbnail_path(key, size)
+        if not os.path.exists(path):
+            if config.jobs_enabled:
+                with self._pg.begin():
+                    self._jobs.enqueue(JOB_THUMBNAIL, {'file_id': file_id})
+                response = Response(status=202)
+                response.headers['Retry-After'] = '2'
+                return response
+
+            self._render_thumbnails(
+                key,
+                os.path.join(
+                    self._st,
+                    file['relative_path'],
+                    self._disk_filename(file['stored_name'], file['extension']),
+                ),
             )
 
         try:
-            with open(full_path, 'wb') as f:
-                shutil.copyfileobj(uploaded_file.stream, f)
-        except Exception as e:
-            raise ModuleException(
-                'Failed to write file', {'error': str(e)}, 500
+            # mtime - время последнего использования для вытеснения
+            os.utime(path)
+        except OSError:
+            pass
+
+        response = send_file(
+            path,
+            mimetype=THUMBNAIL_MIMETYPE,
+            conditional=True,
+            etag=f'{key}-{size}',
+            max_age=config.thumbnails_max_age,
+        )
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+
+    def generate_thumbnails(self, file_id: int):
+        """Построение миниатюр файла (задача thumbnail)"""
+
+        with self._pg.begin():
+            file = self._pg.query(File).get(file_id)
+            if file is None or file.category != 'images':
+                return
+            key = file.sha256 or file.stored_name
+            full_path = self._file_full_path(file)
+
+        if all(
+            os.path.exists(self._thumbnail_path(key, size))
+            for size in THUMBNAIL_SIZES
+        ):
+            return
+
+        try:
+            self._render_thumbnails(key, full_path)
+        except ModuleException as e:
+            # Повтор не поможет: изображение не декодируется
+            if e.code != 422:
+                raise
+
+    def prune_thumbnails(self) -> int:
+        """Вытеснение миниатюр сверх config.thumbnails_max_bytes"""
+
+        removed = prune_thumbnails(
+            os.path.join(config.storage_path, THUMBS_DIR),
+            config.thumbnails_max_bytes,
+        )
+        self._logger.info(f'Вытеснено {removed} миниатюр')
+        return removed
+
+    def _render_thumbnails(self, key: str, full_path: str):
+        try:
+            render_thumbnails(
+                full_path,
+                {
+                    size: self._thumbnail_path(key, size)
+                    for size in THUMBNAIL_SIZES
+                },
+                max_pixels=config.thumbnails_max_pixels,
             )
+        except FileNotFoundError:
+            raise ModuleException('File not found', {'data': ''}, 404)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # Повреждённое, неподдерживаемое или слишком большое изображение
+            self._logger.warning(
+                'Не удалось построить миниатюру',
+                extra={'path': full_path, 'e': str(e)},
+            )
+            raise ModuleException(
+                'Cannot render thumbnail', {'data': ''}, 422
+            )
+
+    def _discard_thumbnails(self, keys: Iterable[str]):
+        """Удаление миниатюр по ключам (sha256 или stored_name)"""
+
+        for key in keys:
+            for size in THUMBNAIL_SIZES:
+                try:
+                    os.remove(self._thumbnail_path(key, size))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _thumbnail_path(key: str, size: str) -> str:
+        return os.path.join(
+            config.storage_path, THUMBS_DIR, key[:2], f'{key}_{size}.jpg'
+        )
+
+    @staticmethod
+    def _offload_response(
+        full_path: str,
+        etag: str,
+        last_modified: Optional[datetime.datetime],
+    ) -> Response:
+        """Ответ только с заголовками, байты отдаёт фронт-сервер
+
+        Range обрабатывает фронт, 304 дешевле отдать сразу
+        """
+
+        if not is_resource_modified(
+            request.environ, etag=etag, last_modified=last_modified,
+        ):
+            response = Response(status=304)
+        else:
+            response = Response(mimetype='application/octet-stream')
+            # Длину тела выставит фронт-сервер по самому файлу
+            response.automatically_set_content_length = False
+            if config.download_mode == DownloadMode.X_ACCEL_REDIRECT:
+                relative = os.path.relpath(full_path, config.storage_path)
+                response.headers['X-Accel-Redirect'] = (
+                    config.download_accel_prefix.rstrip('/') + '/'
+                    + urllib.parse.quote(relative.replace(os.sep, '/'))
+                )
+            else:
+                response.headers['X-Sendfile'] = os.path.abspath(full_path)
+
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+
+    @staticmethod
+    def _content_disposition(download_filename: str) -> str:
+        """Content-Disposition с именем файла в UTF-8"""
+
+        encoded_filename = urllib.parse.quote(download_filename, safe='')
+        return f"attachment; filename*=UTF-8''{encoded_filename}"
+
+    @staticmethod
+    def _file_etag(file: Dict[str, Any]) -> str:
+        """Стабильный ETag: stored_name не меняется, дата - при изменении"""
+
+        changed = file['update_date'] or file['creation_date'] or ''
+        if isinstance(changed, datetime.datetime):
+            changed = changed.isoformat()
+
+        return f"{file['stored_name']}-{changed}"
+
+    @staticmethod
+    def _file_last_modified(
+        file: Dict[str, Any],
+    ) -> Optional[datetime.datetime]:
+        changed = file['update_date'] or file['creation_date']
+        if not changed:
+            return None
+        if isinstance(changed, str):
+            changed = datetime.datetime.fromisoformat(changed)
+
+        return changed.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+
+    def _multirange_response(
+        self,
+        full_path: str,
+        etag: str,
+        last_modified: Optional[datetime.datetime],
+    ) -> Optional[Response]:
+        """Ответ на запрос нескольких диапазонов
+
+        Range разбирается здесь: werkzeug отвечает 416 на пересекающиеся
+        и неупорядоченные диапазоны. Диапазоны объединяются и отдаются
+        одним 206 или multipart/byteranges; при превышении
+        download_max_ranges, неразобранном Range или несовпадении If-Range
+        файл отдаётся целиком (200). None - запрос должен обработать
+        send_file (нет Range или один диапазон)
+        """
+
+        header = request.headers.get('Range')
+        if not header:
+            return None
+
+        ranges = self._parse_range_header(header)
+        if ranges is not None and len(ranges) == 1:
+            return None
+
+        if not is_resource_modified(
+            request.environ, etag=etag, last_modified=last_modified,
+        ):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
 
         size = os.path.getsize(full_path)
+        if ranges is None:
+            return self._full_file_response(
+                full_path, size, etag, last_modified
+            )
+
+        if len(ranges) > config.download_max_ranges:
+            self._logger.debug(
+                'Слишком много диапазонов, отдаём файл целиком',
+                extra={'ranges': len(ranges)},
+            )
+            return self._full_file_response(
+                full_path, size, etag, last_modified
+            )
+
+        if_range = request.if_range
+        if (
+            (if_range.etag is not None and if_range.etag != etag)
+            or (if_range.date is not None and if_range.date != last_modified)
+        ):
+            return self._full_file_response(
+                full_path, size, etag, last_modified
+            )
+
+        spans = []
+        for first, last in ranges:
+            if first is None:
+                start, stop = max(size - last, 0), size
+            else:
+                start = first
+                stop = size if last is None else min(last + 1, size)
+            if start < stop:
+                spans.append([start, stop])
+
+        if not spans:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+
+        # Пересекающиеся и соседние диапазоны объединяем
+        spans.sort()
+        merged = [spans[0]]
+        for start, stop in spans[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+
+        if len(merged) == 1:
+            start, stop = merged[0]
+            response = Response(
+                self._read_file_range(full_path, start, stop),
+                status=206,
+                mimetype='application/octet-stream',
+            )
+            response.headers['Content-Range'] = (
+                f'bytes {start}-{stop - 1}/{size}'
+            )
+            response.content_length = stop - start
+        else:
+            boundary = uuid.uuid4().hex
+            parts = [
+                (
+                    (
+                        f'--{boundary}\r\n'
+                        f'Content-Type: application/octet-stream\r\n'
+                        f'Content-Range: bytes {start}-{stop - 1}/{size}'
+                        f'\r\n\r\n'
+                    ).encode(),
+                    start,
+                    stop,
+                )
+                for start, stop in merged
+            ]
+            closing = f'--{boundary}--\r\n'.encode()
+
+            def generate():
+                for head, start, stop in parts:
+                    yield head
+                    yield from self._read_file_range(full_path, start, stop)
+                    yield b'\r\n'
+                yield closing
+
+            response = Response(
+                generate(),
+                status=206,
+                mimetype=f'multipart/byteranges; boundary={boundary}',
+            )
+            response.content_length = sum(
+                len(head) + stop - start + 2 for head, start, stop in parts
+            ) + len(closing)
+
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+
+    @staticmethod
+    def _parse_range_header(
+        header: str,
+    ) -> Optional[List[Tuple[Optional[int], Optional[int]]]]:
+        """Диапазоны заголовка Range в порядке запроса
+
+        (first, last) - байты с first по last включительно, last = None -
+        до конца файла, first = None - последние last байт.
+        None - заголовок не разобран
+        """
+
+        unit, _, spec = header.partition('=')
+        if unit.strip().lower() != 'bytes':
+            return None
+
+        ranges = []
+        for item in spec.split(','):
+            item = item.strip()
+            if not item:
+                continue
+
+            first, sep, last = item.partition('-')
+            first, last = first.strip(), last.strip()
+            if not sep:
+                return None
+            if not first:
+                if not last.isdigit():
+                    return None
+                ranges.append((None, int(last)))
+                continue
+            if not first.isdigit() or (last and not last.isdigit()):
+                return None
+            if last and int(last) < int(first):
+                return None
+            ranges.append((int(first), int(last) if last else None))
+
+        return ranges or None
+
+    def _full_file_response(
+        self,
+        full_path: str,
+        size: int,
+        etag: str,
+        last_modified: Optional[datetime.datetime],
+    ) -> Response:
+        """Файл целиком (200) без обработки Range"""
+
+        response = Response(
+            self._read_file_range(full_path, 0, size),
+            mimetype='application/octet-stream',
+        )
+        response.content_length = size
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+
+    @staticmethod
+    def _read_file_range(
+        full_path: str,
+        start: int,
+        stop: int,
+        chunk_size: int = 64 * 1024,
+    ):
+        """Чтение диапазона [start, stop) файла кусками"""
+
+        with open(full_path, 'rb') as f:
+            f.seek(start)
+            left = stop - start
+            while left > 0:
+                chunk = f.read(min(chunk_size, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield chunk
+
+    def upload_file(self) -> Dict[str, Any]:
+        """Загрузка файла в хранилище пользователя и БД
+
+        Тело multipart разбирается потоково: файл пишется сразу на своё
+        место без промежуточного spool, размер и sha256 считаются на лету,
+        при превышении лимита загрузка прерывается
+        """
+
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            raise ModuleException('Invalid content type', {'data': ''}, 400)
+
+        # Ранний отказ до чтения тела, окончательная проверка -
+        # атомарным резервированием в транзакции вставки
+        with self._pg.begin():
+            used_bytes = self._get_user_used_bytes()
+
+        available = config.max_user_storage_bytes - used_bytes
+        if (request.content_length or 0) > available + MULTIPART_OVERHEAD:
+            self._raise_storage_limit(used_bytes)
+
+        stored_name = uuid.uuid4().hex
+
+        def target_path(fields: Optional[dict], filename: str) -> str:
+            _, extension = self._split_filename(filename)
+            if fields is None:
+                # Поля придут после файла - пишем рядом и перенесём
+                directory = os.path.join(self._st, UPLOADS_DIR)
+            else:
+                directory = os.path.join(
+                    self._st, self._normalize_path(fields.get('path', ''))
+                )
+
+            os.makedirs(directory, exist_ok=True)
+            return os.path.join(
+                directory, self._disk_filename(stored_name, extension)
+            )
+
+        receiver = MultipartFileReceiver(
+            request.stream,
+            boundary.encode(),
+            max_file_size=available,
+            chunk_size=config.upload_chunk_size,
+        )
+        try:
+            receiver.receive(target_path)
+        except UploadTooLarge:
+            self._raise_storage_limit(used_bytes)
+
+        try:
+            if receiver.fields is None:
+                raise ModuleException('Missing form fields', {'data': ''}, 400)
+            if receiver.path is None:
+                raise ModuleException('File not found', {'data': ''}, 400)
+
+            fields = receiver.fields
+            name, extension = self._split_filename(receiver.filename)
+            relative_path = self._normalize_path(fields.get('path', ''))
+            full_storage_path = os.path.join(self._st, relative_path)
+            full_path = os.path.join(
+                full_storage_path, self._disk_filename(stored_name, extension)
+            )
+            if receiver.path != full_path:
+                os.makedirs(full_storage_path, exist_ok=True)
+                os.rename(receiver.path, full_path)
+                receiver.path = full_path
+
+            with self._pg.begin():
+                db_file = self._create_file_record(
+                    name=name,
+                    extension=extension,
+                    stored_name=stored_name,
+                    size=receiver.size,
+                    relative_path=relative_path,
+                    comment=fields.get('comment', ''),
+                    sha256=receiver.sha256,
+                )
+                self._attach_blob(receiver.sha256, receiver.size, full_path)
+        except Exception:
+            if receiver.path is not None and os.path.exists(receiver.path):
+                os.remove(receiver.path)
+            raise
+
+        self._invalidate_cache(self._user_id)
+        self._logger.debug(
+            'Файл успешно загружен',
+            extra={'filename': receiver.filename, 'size': receiver.size},
+        )
+
+        return db_file.dump()
+
+    @staticmethod
+    def _disk_filename(stored_name: str, extension: Optional[str]) -> str:
+        """Имя файла на диске"""
+
+        return f'{stored_name}.{extension}' if extension else stored_name
+
+    def get_blob(self, sha256: str) -> Dict[str, Any]:
+        """Проверка перед загрузкой: есть ли у пользователя такое содержимое"""
+
+        with self._pg.begin():
+            blob = self._get_owned_blob(sha256)
+
+        return {'sha256': blob.sha256, 'size': blob.size}
+
+    def upload_from_blob(self, sha256: str) -> Dict[str, Any]:
+        """Мгновенная загрузка: новый файл из уже хранимого содержимого
+
+        Доступна только для содержимого, которое уже есть у пользователя,
+        иначе по одному хэшу можно было бы получить чужой файл
+        """
+
+        data = request.get_json(silent=True) or {}
+        fields = data.get('fields', {})
+        name, extension = self._split_filename(fields.get('filename'))
+        relative_path = self._normalize_path(fields.get('path', ''))
+
+        stored_name = uuid.uuid4().hex
+        full_storage_path = os.path.join(self._st, relative_path)
+        full_path = os.path.join(
+            full_storage_path, self._disk_filename(stored_name, extension)
+        )
+
+        try:
+            with self._pg.begin():
+                blob = self._get_owned_blob(sha256)
+                db_file = self._create_file_record(
+                    name=name,
+                    extension=extension,
+                    stored_name=stored_name,
+                    size=blob.size,
+                    relative_path=relative_path,
+                    comment=fields.get('comment', ''),
+                    sha256=blob.sha256,
+                )
+                os.makedirs(full_storage_path, exist_ok=True)
+                os.link(self._blob_path(blob.sha256), full_path)
+                self._increment_blob(blob.sha256, blob.size)
+        except Exception:
+            if os.path.exists(full_path):
+                os.remove(full_path)
+            raise
+
+        self._invalidate_cache(self._user_id)
+        self._logger.debug(
+            'Файл загружен из существующего блоба',
+            extra={'sha256': sha256, 'id': db_file.id},
+        )
+        return db_file.dump()
+
+    def _get_owned_blob(self, sha256: str) -> Blob:
+        sha256 = (sha256 or '').lower()
+        if len(sha256) != 64 or any(
+                c not in '0123456789abcdef' for c in sha256):
+            raise ModuleException('Invalid sha256', {'data': ''}, 400)
+
+        owned = (
+            self._pg.query(File.id)
+            .filter(File.owner_id == self._user_id, File.sha256 == sha256)
+            .first()
+        )
+        blob = self._pg.query(Blob).get(sha256) if owned else None
+        if not blob or not os.path.exists(self._blob_path(sha256)):
+            raise ModuleException('Blob not found', {'data': ''}, 404)
+
+        return blob
+
+    def _increment_blob(self, sha256: str, size: int) -> int:
+        """+1 ссылка на блоб, возвращает новое число ссылок"""
+
+        statement = postgresql.insert(Blob).values(
+            sha256=sha256, size=size, refcount=1,
+        ).on_conflict_do_update(
+            index_elements=['sha256'],
+            set_={'refcount': Blob.__table__.c.refcount + 1},
+        ).returning(Blob.refcount)
+        return self._pg.execute(statement).scalar_one()
+
+    def _attach_blob(self, sha256: str, size: int, full_path: str):
+        """Учёт загруженного файла в хранилище блобов
+
+        Новое содержимое становится блобом (жёсткая ссылка на файл),
+        повторное - файл заменяется жёсткой ссылкой на блоб и копия
+        освобождается. Выполняется в транзакции записи о файле
+        """
+
+        refcount = self._increment_blob(sha256, size)
+        blob_path = self._blob_path(sha256)
+
+        try:
+            if refcount > 1 and os.path.exists(blob_path):
+                link_path = f'{full_path}.{uuid.uuid4().hex}'
+                os.link(blob_path, link_path)
+                os.replace(link_path, full_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                link_path = f'{blob_path}.{uuid.uuid4().hex}'
+                os.link(full_path, link_path)
+                os.replace(link_path, blob_path)
+        except OSError as e:
+            # ФС без жёстких ссылок: файл остаётся самостоятельной копией
+            self._logger.warning(
+                'Не удалось связать файл с блобом',
+                extra={'sha256': sha256, 'e': str(e)},
+            )
+
+    def _release_blobs(
+        self,
+        counts: Dict[str, int],
+        journal: Optional[DiskJournal] = None,
+    ):
+        """Снятие ссылок на блобы, последняя ссылка удаляет блоб с диска
+
+        counts - sha256 и число снимаемых ссылок. Блокировка строк блобов
+        держится до конца транзакции, поэтому параллельная загрузка того
+        же содержимого дождётся удаления
+        """
+
+        counts = {sha256: n for sha256, n in counts.items() if n}
+        if not counts:
+            return
+
+        shas = sorted(counts)
+        table = Blob.__table__
+        released = sa.select(
+            sa.func.unnest(sa.bindparam(
+                'shas', shas, type_=postgresql.ARRAY(sa.String)
+            )).label('sha256'),
+            sa.func.unnest(sa.bindparam(
+                'counts',
+                [counts[sha256] for sha256 in shas],
+                type_=postgresql.ARRAY(sa.BigInteger),
+            )).label('n'),
+        ).subquery('released')
+        rows = self._pg.execute(
+            sa.update(table)
+            .where(table.c.sha256 == released.c.sha256)
+            .values(refcount=table.c.refcount - released.c.n)
+            .returning(table.c.sha256, table.c.refcount)
+        ).all()
+
+        orphaned = [sha256 for sha256, refcount in rows if refcount <= 0]
+        if not orphaned:
+            return
+
+        self._pg.execute(
+            sa.delete(table).where(table.c.sha256 == sa.any_(sa.bindparam(
+                'orphaned', orphaned, type_=postgresql.ARRAY(sa.String)
+            )))
+        )
+        self._discard_files(
+            (self._blob_path(sha256) for sha256 in orphaned), journal
+        )
+        self._discard_thumbnails(orphaned)
+
+    @staticmethod
+    def _blob_path(sha256: str) -> str:
+        return os.path.join(
+            config.storage_path, BLOBS_DIR, sha256[:2], sha256
+        )
+
+    @staticmethod
+    def _file_sha256(full_path: str, chunk_size: int = 1024 * 1024) -> str:
+        digest = hashlib.sha256()
+        with open(full_path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def _discard_files(
+        self,
+        paths: Iterable[str],
+        journal: Optional[DiskJournal] = None,
+    ):
+        """Удаление файлов с диска в транзакции вызывающего
+
+        При config.jobs_enabled файлы переносятся в корзину (rename),
+        место освобождает воркер задачей purge. С журналом файлы только
+        переносятся в корзину, очистку выполняет _disk_transaction
+        """
+
+        if journal is not None:
+            for path in paths:
+                journal.trash(path)
+            return
+
+        if not config.jobs_enabled:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        trash_dir = os.path.join(config.storage_path, TRASH_DIR)
+        os.makedirs(trash_dir, exist_ok=True)
+        names = []
+        for path in paths:
+            name = uuid.uuid4().hex
+            try:
+                os.rename(path, os.path.join(trash_dir, name))
+            except FileNotFoundError:
+                continue
+            names.append(name)
+
+        if names:
+            self._jobs.enqueue(JOB_PURGE, {'names': names})
+
+    @contextlib.contextmanager
+    def _disk_transaction(self):
+        """Транзакция БД, изменения на диске в которой откатываются с ней
+
+        Переносы и удаления файлов, записанные в журнал, отменяются, если
+        транзакция не зафиксирована. Удалённые файлы лежат в корзине до
+        фиксации, затем их удаляет воркер (задача purge ставится в той же
+        транзакции) или сам сервис
+        """
+
+        journal = DiskJournal(os.path.join(config.storage_path, TRASH_DIR))
+        try:
+            with self._pg.begin():
+                yield journal
+                if config.jobs_enabled and journal.trashed:
+                    self._jobs.enqueue(JOB_PURGE, {'names': journal.trashed})
+        except BaseException:
+            journal.rollback()
+            raise
+
+        if not config.jobs_enabled and journal.trashed:
+            self.purge_trash(journal.trashed)
+
+    def purge_trash(self, names: Iterable[str]) -> int:
+        """Окончательное удаление файлов из корзины (задача purge)"""
+
+        trash_dir = os.path.join(config.storage_path, TRASH_DIR)
+        removed = 0
+        for name in names:
+            try:
+                os.remove(os.path.join(trash_dir, os.path.basename(name)))
+                removed += 1
+            except FileNotFoundError:
+                continue
+
+        self._logger.debug(f'Удалено {removed} файлов из корзины')
+        return removed
+
+    def compute_checksum(self, file_id: int):
+        """Отложенный расчёт sha256 и дедупликация файла (задача checksum)
+
+        Файл читается вне транзакции, запись и путь перечитываются
+        под блокировкой строки - файл мог быть перенесён за это время
+        """
+
+        with self._pg.begin():
+            file = self._pg.query(File).get(file_id)
+            if file is None or file.sha256:
+                return
+            full_path = self._file_full_path(file)
+
+        sha256 = self._file_sha256(full_path)
+
+        with self._pg.begin():
+            file = (
+                self._pg.query(File)
+                .filter(File.id == file_id)
+                .with_for_update(of=File)
+                .populate_existing()
+                .one_or_none()
+            )
+            if file is None or file.sha256:
+                return
+
+            file.sha256 = sha256
+            self._attach_blob(sha256, file.size, self._file_full_path(file))
+            # Миниатюры теперь ищутся по sha256
+            self._discard_thumbnails([file.stored_name])
+
+        self._invalidate_cache(file.owner_id)
+        self._logger.debug(
+            'Контрольная сумма рассчитана',
+            extra={'id': file_id, 'sha256': sha256},
+        )
+
+    def create_upload(self) -> Dict[str, Any]:
+        """Создание сессии возобновляемой загрузки"""
+
+        data = request.get_json(silent=True) or {}
+        fields = data.get('fields', {})
+
+        name, extension = self._split_filename(fields.get('filename'))
+        relative_path = self._normalize_path(fields.get('path', ''))
+
+        try:
+            length = int(fields.get('size'))
+        except (TypeError, ValueError):
+            raise ModuleException('Invalid size', {'data': ''}, 400)
+        if length < 0:
+            raise ModuleException('Invalid size', {'data': ''}, 400)
 
         with self._pg.begin():
-            db_file = File(
+            # Строка учёта блокируется до конца транзакции, чтобы
+            # параллельные сессии не заняли одно и то же место
+            used_bytes = self._get_user_used_bytes(for_update=True)
+            used_bytes += self._get_pending_upload_bytes()
+            if used_bytes + length > config.max_user_storage_bytes:
+                self._raise_storage_limit(used_bytes)
+
+            upload = UploadSession(
+                id=uuid.uuid4().hex,
+                owner_id=self._user_id,
                 name=name,
                 extension=extension,
-                stored_name=stored_name,
-                size=size,
-                path=self._st,
                 relative_path=relative_path,
-                owner_id=self._user_id,
-                creation_date=datetime.datetime.utcnow(),
-                update_date=None,
                 comment=fields.get('comment', ''),
+                length=length,
+                offset=0,
             )
-            self._pg.add(db_file)
-            self._pg.flush()
-            self._pg.refresh(db_file)
+            temp_path = self._upload_temp_path(upload)
+            os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+            open(temp_path, 'wb').close()
 
-            self._logger.debug(
-                'Файл успешно загружен',
-                extra={'filename': original_filename},
-            )
+            self._pg.add(upload)
+
+        self._logger.debug(
+            'Сессия загрузки создана',
+            extra={'upload_id': upload.id, 'length': length},
+        )
+        return upload.dump()
+
+    def get_upload(self, upload_id: str) -> Dict[str, Any]:
+        """Состояние сессии загрузки (текущее смещение)"""
+
+        with self._pg.begin():
+            return self._get_upload(upload_id).dump()
+
+    def append_upload_chunk(self, upload_id: str) -> Dict[str, Any]:
+        """Дозапись куска тела запроса по смещению Upload-Offset
+
+        Писатели одной сессии исключаются блокировкой временного файла,
+        тело читается вне транзакции, смещение записывается короткой
+        транзакцией после записи куска
+        """
+
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise ModuleException('Invalid Upload-Offset', {'data': ''}, 400)
+
+        if not UPLOAD_ID_RE.fullmatch(upload_id):
+            raise ModuleException('Upload not found', {'data': ''}, 404)
+
+        temp_path = self._upload_temp_path(
+            UploadSession(id=upload_id, owner_id=self._user_id)
+        )
+        try:
+            with file_lock(temp_path) as f:
+                if f is None:
+                    raise ModuleException('Upload is busy', {'data': ''}, 409)
+
+                # Смещение читается под блокировкой файла: его меняет
+                # только владелец блокировки
+                with self._pg.begin():
+                    upload = self._get_upload(upload_id)
+                if offset != upload.offset:
+                    raise ModuleException(
+                        'Upload offset mismatch',
+                        {'data': {'offset': upload.offset}},
+                        409,
+                    )
+
+                left = upload.length - upload.offset
+                # Хвост от оборванного куска, не попавший в БД, отбрасываем
+                f.seek(upload.offset)
+                f.truncate()
+                while True:
+                    chunk = request.stream.read(config.upload_chunk_size)
+                    if not chunk:
+                        break
+                    if len(chunk) > left:
+                        f.truncate(upload.offset)
+                        raise ModuleException(
+                            'Chunk exceeds upload length',
+                            {'data': {'offset': upload.offset}},
+                            400,
+                        )
+                    f.write(chunk)
+                    left -= len(chunk)
+                f.flush()
+
+                with self._pg.begin():
+                    # Сессию могли завершить или отменить во время записи
+                    upload = self._get_upload(upload_id, for_update=True)
+                    if upload.offset != offset:
+                        raise ModuleException(
+                            'Upload offset mismatch',
+                            {'data': {'offset': upload.offset}},
+                            409,
+                        )
+                    upload.offset = f.tell()
+                    upload.update_date = datetime.datetime.utcnow()
+        except FileNotFoundError:
+            raise ModuleException('Upload not found', {'data': ''}, 404)
+
+        return upload.dump()
+
+    def finalize_upload(self, upload_id: str) -> Dict[str, Any]:
+        """Завершение загрузки: перенос файла и создание записи о нём
+
+        Сессия исключается блокировкой временного файла, как при
+        дозаписи, sha256 считается вне транзакции, запись о файле
+        создаётся короткой транзакцией
+        """
+
+        if not UPLOAD_ID_RE.fullmatch(upload_id):
+            raise ModuleException('Upload not found', {'data': ''}, 404)
 
+        temp_path = self._upload_temp_path(
+            UploadSession(id=upload_id, owner_id=self._user_id)
+        )
+        try:
+            with file_lock(temp_path) as f:
+                if f is None:
+                    raise ModuleException('Upload is busy', {'data': ''}, 409)
+
+                with self._pg.begin():
+                    upload = self._get_upload(upload_id)
+                self._check_upload_complete(upload)
+
+                # Чтение всего файла ради sha256 откладывается воркеру
+                sha256 = None
+                if not config.jobs_enabled:
+                    sha256 = self._file_sha256(temp_path)
+
+                with self._pg.begin():
+                    # Сессию могли отменить во время подсчёта sha256
+                    upload = self._get_upload(upload_id, for_update=True)
+                    self._check_upload_complete(upload)
+                    db_file = self._create_file_record(
+                        name=upload.name,
+                        extension=upload.extension,
+                        stored_name=upload.id,
+                        size=upload.length,
+                        relative_path=upload.relative_path,
+                        comment=upload.comment,
+                        sha256=sha256,
+                    )
+                    self._pg.delete(upload)
+
+                    full_storage_path = os.path.join(
+                        self._st, upload.relative_path
+                    )
+                    full_path = os.path.join(
+                        full_storage_path,
+                        self._disk_filename(upload.id, upload.extension),
+                    )
+                    os.makedirs(full_storage_path, exist_ok=True)
+                    os.rename(temp_path, full_path)
+                    if sha256 is None:
+                        self._jobs.enqueue(
+                            JOB_CHECKSUM, {'file_id': db_file.id}
+                        )
+                    else:
+                        self._attach_blob(sha256, upload.length, full_path)
+        except FileNotFoundError:
+            raise ModuleException('Upload not found', {'data': ''}, 404)
+
+        self._invalidate_cache(self._user_id)
+        self._logger.debug(
+            'Возобновляемая загрузка завершена',
+            extra={'upload_id': upload_id, 'id': db_file.id},
+        )
         return db_file.dump()
 
+    @staticmethod
+    def _check_upload_complete(upload: UploadSession):
+        if upload.offset != upload.length:
+            raise ModuleException(
+                'Upload is not complete',
+                {'data': {'offset': upload.offset}},
+                409,
+            )
+
+    def delete_upload(self, upload_id: str):
+        """Отмена загрузки"""
+
+        with self._pg.begin():
+            upload = self._get_upload(upload_id, for_update=True)
+            self._discard_files([self._upload_temp_path(upload)])
+            self._pg.delete(upload)
+
+        self._logger.debug(
+            'Загрузка отменена', extra={'upload_id': upload_id}
+        )
+
+    def _get_upload(
+        self,
+        upload_id: str,
+        for_update: bool = False,
+    ) -> UploadSession:
+        query = self._pg.query(UploadSession).filter(
+            UploadSession.id == upload_id,
+            UploadSession.owner_id == self._user_id,
+        )
+        if for_update:
+            query = query.with_for_update()
+
+        upload = query.first()
+        if not upload:
+            raise ModuleException('Upload not found', {'data': ''}, 404)
+
+        return upload
+
+    @staticmethod
+    def _upload_temp_path(upload: UploadSession) -> str:
+        """Временный файл загрузки в хранилище пользователя"""
+
+        return os.path.join(
+            config.storage_path,
+            str(upload.owner_id),
+            UPLOADS_DIR,
+            f'{upload.id}.part',
+        )
+
+    def _cleanup_uploads(self):
+        """Удаление брошенных сессий загрузки и их временных файлов"""
+
+        expired_at = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=config.upload_session_ttl
+        )
+        with self._pg.begin():
+            query = self._pg.query(UploadSession).filter(
+                UploadSession.update_date < expired_at
+            )
+            if self._user_id is not None:
+                query = query.filter(UploadSession.owner_id == self._user_id)
+            uploads = query.with_for_update(skip_locked=True).all()
+            for upload in uploads:
+                temp_path = self._upload_temp_path(upload)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                self._pg.delete(upload)
+
+        self._logger.info(f'Удалено {len(uploads)} брошенных загрузок')
+
+    @staticmethod
+    def _split_filename(original_filename: Optional[str]):
+        """Имя и расширение исходного имени файла"""
+
+        if not original_filename:
+            raise ModuleException('Invalid filename', {'data': ''}, 400)
+
+        if '.' in original_filename:
+            return original_filename.rsplit('.', 1)
+
+        return original_filename, ''
+
+    @staticmethod
+    def _normalize_path(path: Optional[str]) -> str:
+        """Относительный путь внутри хранилища пользователя"""
+
+        relative_path = os.path.normpath(path or '').lstrip(os.sep)
+        if relative_path == '..' or relative_path.startswith('..' + os.sep):
+            raise ModuleException('Invalid path', {'data': ''}, 400)
+
+        return relative_path
+
+    def _create_file_record(
+        self,
+        name: str,
+        extension: str,
+        stored_name: str,
+        size: int,
+        relative_path: str,
+        comment: str,
+        sha256: Optional[str] = None,
+    ) -> File:
+        """Запись о файле вместе с резервированием места под него
+
+        Выполняется в транзакции вызывающего
+        """
+
+        category = file_category(extension)
+        used_bytes = self._reserve_usage(size, category)
+        if used_bytes is None:
+            self._raise_storage_limit(self._get_user_used_bytes())
+
+        folder = self._get_folder(relative_path, create=True)
+        db_file = File(
+            name=name,
+            extension=extension,
+            stored_name=stored_name,
+            size=size,
+            path=self._st,
+            folder_id=folder.id if folder else None,
+            owner_id=self._user_id,
+            creation_date=datetime.datetime.utcnow(),
+            update_date=None,
+            comment=comment,
+            category=category,
+            sha256=sha256,
+        )
+        db_file.folder = folder
+        self._pg.add(db_file)
+        self._pg.flush()
+        self._pg.refresh(db_file)
+
+        if category == 'images' and config.jobs_enabled:
+            self._jobs.enqueue(JOB_THUMBNAIL, {'file_id': db_file.id})
+
+        return db_file
+
+    def _file_relative_path(self, file: File) -> str:
+        """Путь каталога файла внутри хранилища пользователя"""
+
+        return file.folder.path if file.folder is not None else ROOT_PATH
+
+    def _file_full_path(self, file: File) -> str:
+        """Путь файла на диске"""
+
+        return os.path.join(
+            config.storage_path,
+            str(file.owner_id),
+            self._file_relative_path(file),
+            self._disk_filename(file.stored_name, file.extension),
+        )
+
+    def _row_full_path(self, row: sa.Row) -> str:
+        """Путь файла на диске по строке SYNC_COLUMNS"""
+
+        return os.path.join(
+            config.storage_path,
+            str(row.owner_id),
+            row.relative_path,
+            self._disk_filename(row.stored_name, row.extension),
+        )
+
     def update_file(self, file_id: int) -> Dict[str, Any]:
         """Обновление файла и записи о нём"""
 
-        data = request.get_json()
-        fields = data.get('fields', {})
+        data = request.get_json(silent=True) or {}
+        fields = self._validate_file_fields(data.get('fields', {}))
+
+        with self._disk_transaction() as journal:
+            file = self.get_file_by_id(
+                file_id, session=self._pg, for_update=True
+            )
+            self._apply_file_update(file, fields, journal)
+
+            self._pg.add(file)
+            self._pg.flush()
+            self._pg.refresh(file)
+
+            self._logger.debug('Файл успешно обновлён', extra={'id': file_id})
+
+        self._invalidate_cache(file.owner_id)
+        return file.dump()
+
+    @staticmethod
+    def _validate_file_fields(fields: Any) -> Dict[str, Any]:
+        """Проверка полей изменения файла до любых изменений на диске"""
+
+        if not isinstance(fields, dict):
+            raise ModuleException('Invalid fields', {'data': ''}, 400)
+
+        columns = File.__table__.c
+        limits = {
+            'name': columns.name.type.length,
+            'comment': columns.comment.type.length,
+            'path': None,
+        }
+        for key, max_length in limits.items():
+            value = fields.get(key)
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                raise ModuleException(f'Invalid {key}', {'data': ''}, 400)
+            if max_length is not None and len(value) > max_length:
+                raise ModuleException(
+                    f'Too long {key}', {'data': {'max': max_length}}, 400
+                )
+
+        if fields.get('path'):
+            FilesService._validate_folder_path(fields['path'])
+
+        return fields
+
+    @staticmethod
+    def _validate_folder_fields(fields: Any) -> Dict[str, Any]:
+        """Проверка полей создания и изменения папки до блокировки строк"""
+
+        if not isinstance(fields, dict):
+            raise ModuleException('Invalid fields', {'data': ''}, 400)
+
+        name = fields.get('name')
+        if name is not None:
+            if (
+                not isinstance(name, str)
+                or not name
+                or '/' in name
+                or name in (ROOT_PATH, '..')
+            ):
+                raise ModuleException('Invalid name', {'data': ''}, 400)
+
+            max_length = Folder.__table__.c.name.type.length
+            if len(name) > max_length:
+                raise ModuleException(
+                    'Too long name', {'data': {'max': max_length}}, 400
+                )
+
+        path = fields.get('path')
+        if path is not None:
+            if not isinstance(path, str):
+                raise ModuleException('Invalid path', {'data': ''}, 400)
+            FilesService._validate_folder_path(path)
+
+        return fields
+
+    @staticmethod
+    def _validate_folder_path(path: str):
+        """Имена папок пути не длиннее столбца folders.name"""
+
+        max_length = Folder.__table__.c.name.type.length
+        parts = FilesService._normalize_path(path).split('/')
+        if any(len(part) > max_length for part in parts):
+            raise ModuleException(
+                'Too long folder name', {'data': {'max': max_length}}, 400
+            )
+
+    def _apply_file_update(
+        self,
+        file: File,
+        fields: Dict[str, Any],
+        journal: Optional[DiskJournal] = None,
+        folders: Optional[Dict[str, Optional[Folder]]] = None,
+    ):
+        """Изменение имени, пути и комментария файла
+
+        При смене пути файл переносится на диске (через журнал, если он
+        передан). folders - уже найденные папки по пути.
+        Поля должны быть проверены _validate_file_fields
+        """
+
         name = fields.get('name')
         path = fields.get('path')
         comment = fields.get('comment')
 
+        folder = file.folder
         if path:
-            path = os.path.normpath(path)
+            relative_path = self._normalize_path(path)
+            if folders is not None and relative_path in folders:
+                folder = folders[relative_path]
+            else:
+                folder = self._get_folder(relative_path, create=True)
+
+        disk_filename = self._disk_filename(file.stored_name, file.extension)
+        old_full_path = self._file_full_path(file)
+        new_full_path = os.path.join(
+            self._st,
+            folder.path if folder is not None else ROOT_PATH,
+            disk_filename,
+        )
 
-        with self._pg.begin():
-            file = self.get_file_by_id(file_id, session=self._pg)
+        if old_full_path != new_full_path:
+            if not os.path.exists(old_full_path):
+                raise ModuleException('File not found', {'data': ''}, 404)
+            if journal is not None:
+                journal.rename(old_full_path, new_full_path)
+            else:
+                os.makedirs(os.path.dirname(new_full_path), exist_ok=True)
+                os.rename(old_full_path, new_full_path)
+
+        if name:
+            file.name = name
+        if path:
+            file.folder = folder
+            file.folder_id = folder.id if folder else None
+        if comment:
+            file.comment = comment
+
+        file.update_date = datetime.datetime.utcnow()
+
+    def batch_files(self) -> Dict[str, Any]:
+        """Пакетное удаление, перемещение и изменение файлов
+
+        Файлы загружаются одним запросом WHERE id = ANY(...), изменения
+        в БД пишутся пакетными DELETE/UPDATE в одной транзакции.
+        Результат возвращается по каждой операции: ошибка операции
+        откатывает только её изменения (точка сохранения и журнал диска),
+        ошибка записи пакета - все переносы и удаления на диске
+        """
 
-            old_full_path = os.path.join(
-                self._st,
-                file.relative_path,
-                f"{file.stored_name}.{file.extension}"
+        data = request.get_json(silent=True) or {}
+        operations = data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            raise ModuleException('Missing operations', {'data': ''}, 400)
+        if len(operations) > config.batch_max_operations:
+            raise ModuleException(
+                'Too many operations',
+                {'data': {'max': config.batch_max_operations}},
+                400,
             )
 
-            if name:
-                file.name = name
-            if path:
-                file.relative_path = path
-            if comment:
-                file.comment = comment
+        ids = set()
+        for operation in operations:
+            try:
+                ids.add(int(operation['id']))
+            except (TypeError, KeyError, ValueError):
+                pass
 
-            new_full_path = os.path.join(
-                self._st,
-                file.relative_path,
-                f"{file.stored_name}.{file.extension}"
+        results = []
+        deleted: Dict[int, File] = {}
+        updated: Dict[int, File] = {}
+        folders: Dict[str, Optional[Folder]] = {}
+
+        with self._disk_transaction() as journal:
+            files = (
+                self._pg.query(File)
+                .filter(
+                    File.owner_id == self._user_id,
+                    File.id == sa.any_(sa.bindparam(
+                        'ids', list(ids), type_=postgresql.ARRAY(sa.Integer)
+                    )),
+                )
+                .with_for_update(of=File)
+                .all()
             )
+            # Изменения пишутся пакетно, а не через unit of work сессии
+            for file in files:
+                self._pg.expunge(file)
+            files = {file.id: file for file in files}
+
+            for index, operation in enumerate(operations):
+                result = {'index': index}
+                mark = journal.mark()
+                try:
+                    result.update(self._apply_batch_operation(
+                        operation, files, deleted, updated, folders, journal
+                    ))
+                    result['status'] = 'ok'
+                except ModuleException as e:
+                    journal.rollback(mark)
+                    result.update(status='error', error=e.msg, code=e.code)
+                except (OSError, sa.exc.SQLAlchemyError) as e:
+                    journal.rollback(mark)
+                    result.update(status='error', error=str(e), code=500)
+                results.append(result)
+
+            self._flush_batch(deleted, updated, journal)
+
+        if deleted or updated:
+            self._invalidate_cache(self._user_id)
 
-            if old_full_path != new_full_path:
-                os.makedirs(os.path.dirname(new_full_path), exist_ok=True)
-                if not os.path.exists(old_full_path):
-                    raise ModuleException('File not found', {'data': ''}, 404)
-                os.rename(old_full_path, new_full_path)
+        self._logger.debug(
+            'Пакетная операция выполнена',
+            extra={'deleted': len(deleted), 'updated': len(updated)},
+        )
+        return {'results': results}
 
-            file.update_date = datetime.datetime.utcnow()
-            self._pg.add(file)
-            self._pg.flush()
-            self._pg.refresh(file)
+    def _apply_batch_operation(
+        self,
+        operation: Dict[str, Any],
+        files: Dict[int, File],
+        deleted: Dict[int, File],
+        updated: Dict[int, File],
+        folders: Dict[str, Optional[Folder]],
+        journal: DiskJournal,
+    ) -> Dict[str, Any]:
+        """Изменения на диске для одной операции пакета
+
+        Папки назначения ищутся (и создаются) один раз на путь
+        """
 
-            self._logger.debug('Файл успешно обновлён', extra={'id': file_id})
-            return file.dump()
+        if not isinstance(operation, dict):
+            raise ModuleException('Invalid operation', {'data': ''}, 400)
+
+        op = operation.get('op')
+        try:
+            file_id = int(operation.get('id'))
+        except (TypeError, ValueError):
+            raise ModuleException('Invalid id', {'data': ''}, 400)
+
+        file = files.get(file_id)
+        if not file or file_id in deleted:
+            raise ModuleException(
+                'File not found or access denied', {'data': ''}, 404
+            )
+
+        if op == 'delete':
+            self._discard_files([self._file_full_path(file)], journal)
+            if not file.sha256:
+                self._discard_thumbnails([file.stored_name])
+
+            deleted[file_id] = file
+            updated.pop(file_id, None)
+        elif op in ('update', 'move'):
+            fields = operation.get('fields') or {}
+            if op == 'move':
+                fields = {'path': operation.get('path')}
+            fields = self._validate_file_fields(fields)
+            if not fields.get('path') and op == 'move':
+                raise ModuleException('Missing path', {'data': ''}, 400)
+
+            if fields.get('path'):
+                relative_path = self._normalize_path(fields['path'])
+                if relative_path not in folders:
+                    # Пустые папки не создаются для файла, которого нет
+                    if not os.path.exists(self._file_full_path(file)):
+                        raise ModuleException(
+                            'File not found', {'data': ''}, 404
+                        )
+                    # Папки пути создаются в точке сохранения операции
+                    with self._pg.begin_nested():
+                        folders[relative_path] = self._get_folder(
+                            relative_path, create=True
+                        )
+
+            self._apply_file_update(file, fields, journal, folders)
+            updated[file_id] = file
+        else:
+            raise ModuleException('Invalid operation', {'data': ''}, 400)
+
+        return {'op': op, 'id': file_id, 'file': file.dump()}
+
+    def _flush_batch(
+        self,
+        deleted: Dict[int, File],
+        updated: Dict[int, File],
+        journal: DiskJournal,
+    ):
+        """Пакетная запись результатов операций в БД"""
+
+        if deleted:
+            self._pg.execute(
+                sa.delete(File)
+                .where(File.id == sa.any_(sa.bindparam(
+                    'ids', list(deleted), type_=postgresql.ARRAY(sa.Integer)
+                )))
+                .execution_options(synchronize_session=False)
+            )
+
+            usage = collections.Counter()
+            blobs = collections.Counter()
+            for file in deleted.values():
+                usage[file.category] -= file.size or 0
+                if file.sha256:
+                    blobs[file.sha256] += 1
+
+            self._change_usage_by_category(self._user_id, usage)
+            self._release_blobs(blobs, journal)
+
+        if updated:
+            self._pg.execute(
+                sa.update(File),
+                [
+                    {
+                        'id': file.id,
+                        'name': file.name,
+                        'folder_id': file.folder_id,
+                        'comment': file.comment,
+                        'update_date': file.update_date,
+                    }
+                    for file in updated.values()
+                ],
+            )
 
     def delete_file(self, file_id: int) -> Dict[str, Any]:
         """Удаление файла и записи о нём"""
 
+        with self._disk_transaction() as journal:
+            file = self.get_file_by_id(
+                file_id, session=self._pg, for_update=True
+            )
+            self._discard_files([self._file_full_path(file)], journal)
+            if not file.sha256:
+                self._discard_thumbnails([file.stored_name])
+
+            self._change_usage(
+                file.owner_id, -(file.size or 0), file.category
+            )
+            if file.sha256:
+                self._release_blobs({file.sha256: 1}, journal)
+            self._pg.delete(file)
+            self._logger.debug('Файл успешно удалён', extra={'id': file_id})
+
+        self._invalidate_cache(file.owner_id)
+        return file.dump()
+
+    def get_folders(self) -> List[Dict[str, Any]]:
+        """Список папок пользователя"""
+
         with self._pg.begin():
-            file = self.get_file_by_id(file_id, session=self._pg)
+            folders = (
+                self._pg.query(Folder)
+                .filter(Folder.owner_id == self._user_id)
+                .order_by(Folder.path)
+                .all()
+            )
+
+            self._logger.debug('Папки успешно получены')
+            return [folder.dump() for folder in folders]
+
+    def create_folder(self) -> Dict[str, Any]:
+        """Создание папки вместе с недостающими родительскими"""
+
+        data = request.get_json(silent=True) or {}
+        fields = self._validate_folder_fields(data.get('fields', {}))
+        relative_path = self._normalize_path(fields.get('path'))
+        if relative_path == ROOT_PATH:
+            raise ModuleException('Invalid path', {'data': ''}, 400)
 
-            disk_filename = (
-                f"{file.stored_name}.{file.extension}"
-                if file.extension else file.stored_name
+        with self._pg.begin():
+            folder = self._get_folder(relative_path, create=True)
+            os.makedirs(os.path.join(self._st, folder.path), exist_ok=True)
+
+            self._logger.debug(
+                'Папка успешно создана', extra={'path': folder.path}
             )
+            return folder.dump()
 
-            full_path = os.path.join(
-                self._st,
-                file.relative_path,
-                disk_filename,
+    def update_folder(self, folder_id: int) -> Dict[str, Any]:
+        """Переименование и перенос папки
+
+        Файлы ссылаются на папку по id и не меняются: обновляются строка
+        папки и пути её подпапок, на диске каталог переносится одним rename
+        """
+
+        data = request.get_json(silent=True) or {}
+        fields = self._validate_folder_fields(data.get('fields', {}))
+
+        with self._pg.begin():
+            folder = self._get_folder_by_id(folder_id, for_update=True)
+
+            name = fields.get('name') or folder.name
+            path = fields.get('path')
+            if path:
+                parent_path = self._normalize_path(path)
+                if (
+                    parent_path == folder.path
+                    or parent_path.startswith(folder.path + '/')
+                ):
+                    raise ModuleException(
+                        'Cannot move folder into itself', {'data': ''}, 400
+                    )
+                parent = self._get_folder(parent_path, create=True)
+            elif folder.parent_id is not None:
+                parent = self._pg.query(Folder).get(folder.parent_id)
+            else:
+                parent = None
+
+            old_path = folder.path
+            new_path = f'{parent.path}/{name}' if parent else name
+            if new_path == old_path:
+                return folder.dump()
+
+            exists = self._pg.query(
+                self._pg.query(Folder)
+                .filter(
+                    Folder.owner_id == self._user_id,
+                    Folder.path == new_path,
+                )
+                .exists()
+            ).scalar()
+            if exists:
+                raise ModuleException(
+                    'Folder already exists', {'data': ''}, 409
+                )
+
+            # Пути всех подпапок - одним UPDATE по префиксу
+            self._pg.execute(
+                sa.update(Folder)
+                .where(
+                    Folder.owner_id == self._user_id,
+                    sa.func.left(Folder.path, len(old_path) + 1)
+                    == old_path + '/',
+                )
+                .values(path=sa.func.concat(
+                    new_path, sa.func.substr(Folder.path, len(old_path) + 1)
+                ))
+                .execution_options(synchronize_session=False)
             )
 
-            if os.path.exists(full_path):
-                os.remove(full_path)
+            folder.name = name
+            folder.parent_id = parent.id if parent else None
+            folder.path = new_path
+            folder.update_date = datetime.datetime.utcnow()
+            self._pg.flush()
 
-            self._pg.delete(file)
-            self._logger.debug('Файл успешно удалён', extra={'id': file_id})
+            old_dir = os.path.join(self._st, old_path)
+            new_dir = os.path.join(self._st, new_path)
+            if os.path.exists(old_dir):
+                if os.path.exists(new_dir):
+                    raise ModuleException(
+                        'Folder already exists', {'data': ''}, 409
+                    )
+                os.makedirs(os.path.dirname(new_dir), exist_ok=True)
+                os.rename(old_dir, new_dir)
 
-            return file.dump()
+            self._logger.debug(
+                'Папка успешно перенесена',
+                extra={'id': folder_id, 'from': old_path, 'to': new_path},
+            )
+
+        # Пути файлов в кэше метаданных устарели
+        self._invalidate_cache(self._user_id)
+        return folder.dump()
+
+    def delete_folder(self, folder_id: int) -> Dict[str, Any]:
+        """Удаление пустой папки"""
+
+        with self._pg.begin():
+            folder = self._get_folder_by_id(folder_id, for_update=True)
+
+            not_empty = self._pg.query(
+                self._pg.query(File).filter(File.folder_id == folder.id)
+                .exists()
+            ).scalar() or self._pg.query(
+                self._pg.query(Folder).filter(Folder.parent_id == folder.id)
+                .exists()
+            ).scalar()
+            if not_empty:
+                raise ModuleException('Folder is not empty', {'data': ''}, 409)
+
+            self._pg.delete(folder)
+
+            full_path = os.path.join(self._st, folder.path)
+            if os.path.isdir(full_path):
+                try:
+                    os.rmdir(full_path)
+                except OSError:
+                    self._logger.warning(
+                        f'Не удаётся удалить директорию {full_path}'
+                    )
+
+            self._logger.debug('Папка успешно удалена', extra={'id': folder_id})
+
+        return folder.dump()
+
+    def _get_folder_by_id(
+        self,
+        folder_id: int,
+        for_update: bool = False,
+    ) -> Folder:
+        """Папка пользователя по id"""
+
+        query = self._pg.query(Folder).filter(
+            Folder.id == folder_id,
+            Folder.owner_id == self._user_id,
+        )
+        if for_update:
+            query = query.with_for_update()
+
+        folder = query.one_or_none()
+        if folder is None:
+            raise ModuleException(
+                'Folder not found or access denied', {'data': ''}, 404
+            )
+
+        return folder
+
+    def _get_folder(
+        self,
+        relative_path: str,
+        create: bool = False,
+    ) -> Optional[Folder]:
+        """Папка по пути, None - корень хранилища
+
+        При create=True недостающие папки пути создаются
+        (INSERT ... ON CONFLICT DO NOTHING, безопасно при гонке)
+        """
+
+        if relative_path in ('', ROOT_PATH):
+            return None
+
+        folder = (
+            self._pg.query(Folder)
+            .filter(
+                Folder.owner_id == self._user_id,
+                Folder.path == relative_path,
+            )
+            .one_or_none()
+        )
+        if folder is not None or not create:
+            return folder
+
+        parts = relative_path.split('/')
+        for depth in range(1, len(parts) + 1):
+            path = '/'.join(parts[:depth])
+            self._pg.execute(
+                postgresql.insert(Folder)
+                .values(
+                    owner_id=self._user_id,
+                    parent_id=folder.id if folder else None,
+                    name=parts[depth - 1],
+                    path=path,
+                    creation_date=datetime.datetime.utcnow(),
+                )
+                .on_conflict_do_nothing(constraint='uq_folders_owner_path')
+            )
+            folder = (
+                self._pg.query(Folder)
+                .filter(Folder.owner_id == self._user_id, Folder.path == path)
+                .one()
+            )
+
+        return folder
 
     def get_user_statistics(self) -> Dict[str, Any]:
-        """Статистика пользователя для графиков"""
+        """Статистика пользователя для графиков
 
-        stats = {
-            'total_used_mb': 0,
-            'by_category_mb': {
-                'audio': 0,
-                'video': 0,
-                'images': 0,
-                'documents': 0,
-                'other': 0,
-            }
-        }
+        Считается одним GROUP BY по категории и кэшируется до изменения
+        файлов пользователя
+        """
+
+        cache_key = self._stats_cache_key(self._user_id)
+        stats = self._cache.get(cache_key)
+        if stats is not None:
+            return stats
 
         with self._pg.begin():
-            files = (
-                self._pg.query(File)
+            rows = (
+                self._pg.query(
+                    File.category,
+                    sa.func.coalesce(sa.func.sum(File.size), 0),
+                )
                 .filter(File.owner_id == self._user_id)
+                .group_by(File.category)
                 .all()
             )
 
-        total_bytes = 0
+        by_category = dict.fromkeys(
+            (*self.FILE_CATEGORIES, OTHER_CATEGORY), 0
+        )
+        for category, size in rows:
+            category = category if category in by_category else OTHER_CATEGORY
+            by_category[category] += int(size)
 
-        for file in files:
-            size = file.size or 0
-            total_bytes += size
+        total_used_mb = round(sum(by_category.values()) / 1024 / 1024, 2)
+        stats = {
+            'total_used_mb': total_used_mb,
+            'by_category_mb': {
+                key: round(value / 1024 / 1024, 2)
+                for key, value in by_category.items()
+            },
+            'limit_mb': self.max_user_storage,
+            'free_mb': round(self.max_user_storage - total_used_mb, 2),
+        }
 
-            ext = (file.extension or '').lower()
-            categorized = False
+        self._cache.set(cache_key, stats, ttl=config.stats_cache_ttl)
+        return stats
 
-            for category, extensions in self.FILE_CATEGORIES.items():
-                if ext in extensions:
-                    stats['by_category_mb'][category] += size
-                    categorized = True
-                    break
+    def _invalidate_cache(self, *owner_ids: int):
+        """Сброс кэша статистики и метаданных после изменения файлов"""
 
-            if not categorized:
-                stats['by_category_mb']['other'] += size
+        self._cache.delete(
+            *(self._stats_cache_key(owner_id) for owner_id in owner_ids),
+            *self._metadata.invalidation_keys(*owner_ids),
+        )
 
-        stats['total_used_mb'] = round(total_bytes / 1024 / 1024, 2)
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Попадания в кэш метаданных (счётчики текущего процесса)"""
 
-        for key in stats['by_category_mb']:
-            stats['by_category_mb'][key] = round(
-                stats['by_category_mb'][key] / 1024 / 1024, 2
-            )
+        return self._metadata.stats()
+
+    def _cached_metadata(self, kind: str, key: str, load: Callable[[], Any]):
+        """Метаданные пользователя из кэша или из БД через load"""
+
+        if not self._metadata.enabled or self._user_id is None:
+            return load()
+
+        value, version = self._metadata.get(self._user_id, kind, key)
+        if value is None:
+            value = load()
+            self._metadata.set(self._user_id, version, kind, key, value)
+
+        return value
+
+    @staticmethod
+    def _request_args_key() -> str:
+        """Ключ кэша по параметрам запроса списка"""
 
-        stats['limit_mb'] = self.max_user_storage
-        stats['free_mb'] = round(
-            self.max_user_storage - stats['total_used_mb'], 2
+        raw = urllib.parse.urlencode(sorted(request.args.items(multi=True)))
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    @staticmethod
+    def _stats_cache_key(owner_id: int) -> str:
+        return f'stats:{owner_id}'
+
+    def _get_user_used_bytes(self, for_update: bool = False) -> int:
+        """Сколько байт уже занято пользователем
+
+        for_update - блокировка строки учёта до конца транзакции
+        """
+
+        query = (
+            self._pg.query(UserUsage.used_bytes)
+            .filter(UserUsage.user_id == self._user_id)
         )
+        if for_update:
+            query = query.with_for_update()
 
-        return stats
+        used_bytes = query.scalar()
+        if used_bytes is None:
+            self._init_usage()
+            used_bytes = query.scalar()
 
-    def _get_user_used_bytes(self) -> int:
-        """Сколько байт уже занято пользователем"""
+        return int(used_bytes or 0)
 
-        result = (
-            self._pg.query(File)
-            .filter(File.owner_id == self._user_id)
-            .with_entities(sa.func.coalesce(sa.func.sum(File.size), 0))
+    def _get_pending_upload_bytes(self) -> int:
+        """Место, обещанное открытым сессиям возобновляемой загрузки"""
+
+        pending = (
+            self._pg.query(
+                sa.func.coalesce(sa.func.sum(UploadSession.length), 0)
+            )
+            .filter(UploadSession.owner_id == self._user_id)
             .scalar()
         )
+        return int(pending)
+
+    def _init_usage(self):
+        """Создание строки учёта места по уже загруженным файлам"""
+
+        categories = (*self.FILE_CATEGORIES, OTHER_CATEGORY)
+        size = sa.func.coalesce(File.size, 0)
+        sums = [sa.func.coalesce(sa.func.sum(size), 0)]
+        for category in categories:
+            sums.append(sa.func.coalesce(
+                sa.func.sum(size).filter(File.category == category), 0
+            ))
+
+        columns = ['user_id', 'used_bytes'] + [
+            f'{category}_bytes' for category in categories
+        ]
+        statement = postgresql.insert(UserUsage).from_select(
+            columns,
+            sa.select(sa.literal(self._user_id), *sums)
+            .where(File.owner_id == self._user_id),
+        ).on_conflict_do_nothing(index_elements=['user_id'])
+        self._pg.execute(statement)
+
+    def _reserve_usage(self, size: int, category: str) -> Optional[int]:
+        """Атомарное резервирование места под файл
+
+        Возвращает новый объём занятого места или None, если лимит
+        будет превышен
+        """
+
+        column = f'{category}_bytes'
+        statement = (
+            sa.update(UserUsage)
+            .where(
+                UserUsage.user_id == self._user_id,
+                UserUsage.used_bytes + size <= config.max_user_storage_bytes,
+            )
+            .values({
+                'used_bytes': UserUsage.used_bytes + size,
+                column: getattr(UserUsage, column) + size,
+            })
+            .returning(UserUsage.used_bytes)
+        )
+        return self._pg.execute(statement).scalar_one_or_none()
 
-        return int(result or 0)
+    def _change_usage(self, owner_id: int, delta: int, category: str):
+        """Изменение учтённого места пользователя без проверки лимита"""
+
+        self._change_usage_by_category(owner_id, {category: delta})
+
+    def _change_usage_by_category(
+        self,
+        owner_id: int,
+        deltas: Dict[str, int],
+    ):
+        """Изменение учтённого места сразу по нескольким категориям"""
+
+        deltas = {category: d for category, d in deltas.items() if d}
+        if not deltas:
+            return
+
+        values = {'used_bytes': UserUsage.used_bytes + sum(deltas.values())}
+        for category, delta in deltas.items():
+            column = f'{category}_bytes'
+            values[column] = getattr(UserUsage, column) + delta
+
+        self._pg.execute(
+            sa.update(UserUsage)
+            .where(UserUsage.user_id == owner_id)
+            .values(values)
+        )
+
+    def _raise_storage_limit(self, used_bytes: int):
+        raise ModuleException(
+            'Storage limit exceeded (20 GB)',
+            {
+                'data': {
+                    'used_mb': round(used_bytes / 1024 / 1024, 2),
+                    'limit_mb': self.max_user_storage
+                },
+            },
+            413,
+        )
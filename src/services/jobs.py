@@ -0,0 +1,258 @@
+"""Очередь фоновых задач
+
+JobQueue хранит задачи в Postgres: постановка идёт в транзакции
+вызывающего, поэтому задача появляется только вместе с изменениями,
+которые её породили. LocalJobQueue - замена в памяти процесса
+"""
+
+import collections
+import contextlib
+import datetime
+import itertools
+import threading
+from typing import Any, Dict, Optional
+
+import sqlalchemy as sa
+from base_module.models.logger import ClassesLoggerAdapter
+from models.job import (
+    Job,
+    JOB_ACTIVE_WHERE,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_FILE_ID,
+    JOB_PENDING,
+    JOB_RUNNING,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session as PGSession
+
+
+class JobQueue:
+    """Очередь задач в Postgres (SELECT ... FOR UPDATE SKIP LOCKED)"""
+
+    def __init__(
+        self,
+        pg_connection: PGSession,
+        max_attempts: int = 5,
+        retry_delay: int = 30,
+    ):
+        self._pg = pg_connection
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._logger = ClassesLoggerAdapter.create(self)
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]):
+        """Постановка задачи, выполняется в транзакции вызывающего
+
+        Задача с file_id не ставится, если у файла уже есть активная
+        задача того же вида
+        """
+
+        now = datetime.datetime.utcnow()
+        self._pg.execute(
+            postgresql.insert(Job)
+            .values(
+                kind=kind,
+                payload=payload,
+                status=JOB_PENDING,
+                attempts=0,
+                run_after=now,
+                creation_date=now,
+            )
+            .on_conflict_do_nothing(
+                index_elements=[Job.kind, JOB_FILE_ID],
+                index_where=JOB_ACTIVE_WHERE,
+            )
+        )
+
+    def fetch(self) -> Optional[Job]:
+        """Следующая задача, она помечается выполняемой
+
+        Блокировка строки держится только до смены статуса, поэтому
+        воркеры не мешают друг другу и не держат транзакцию на время
+        выполнения задачи
+        """
+
+        now = datetime.datetime.utcnow()
+        with self._pg.begin():
+            job = (
+                self._pg.query(Job)
+                .filter(Job.status == JOB_PENDING, Job.run_after <= now)
+                .order_by(Job.run_after, Job.id)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if job is None:
+                return None
+
+            job.status = JOB_RUNNING
+            job.attempts += 1
+            job.update_date = now
+
+        return job
+
+    def complete(self, job: Job):
+        with self._pg.begin():
+            self._pg.execute(
+                sa.update(Job)
+                .where(Job.id == job.id)
+                .values(
+                    status=JOB_DONE,
+                    error=None,
+                    update_date=datetime.datetime.utcnow(),
+                )
+            )
+
+    def fail(self, job: Job, error: str):
+        """Ошибка задачи: повтор с растущей задержкой или отказ"""
+
+        now = datetime.datetime.utcnow()
+        values = {'error': error, 'update_date': now}
+        if job.attempts < self._max_attempts:
+            values['status'] = JOB_PENDING
+            values['run_after'] = now + datetime.timedelta(
+                seconds=self._retry_delay * 2 ** (job.attempts - 1)
+            )
+        else:
+            values['status'] = JOB_FAILED
+
+        with self._pg.begin():
+            self._pg.execute(
+                sa.update(Job).where(Job.id == job.id).values(values)
+            )
+
+    def heartbeat(self, job: Job) -> bool:
+        """Отметка, что задача ещё выполняется
+
+        False - задача уже не выполняемая (например, возвращена в очередь)
+        """
+
+        with self._pg.begin():
+            result = self._pg.execute(
+                sa.update(Job)
+                .where(Job.id == job.id, Job.status == JOB_RUNNING)
+                .values(update_date=datetime.datetime.utcnow())
+            )
+        return bool(result.rowcount)
+
+    @contextlib.contextmanager
+    def running(self, job: Job, interval: float):
+        """Выполнение задачи с heartbeat из отдельного потока
+
+        update_date обновляется каждые interval секунд, поэтому
+        requeue_stale не вернёт в очередь долгую, но живую задачу
+        """
+
+        stop = threading.Event()
+
+        def beat():
+            try:
+                while not stop.wait(interval):
+                    try:
+                        self.heartbeat(job)
+                    except Exception as e:
+                        self._logger.warning(
+                            'Не удалось обновить heartbeat задачи',
+                            extra={'id': job.id, 'e': str(e)},
+                        )
+            finally:
+                # Сессия потока heartbeat
+                self._pg.remove()
+
+        thread = threading.Thread(
+            target=beat, name=f'job-heartbeat-{job.id}', daemon=True
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def requeue_stale(self, timeout: int) -> int:
+        """Возврат в очередь задач упавших воркеров"""
+
+        now = datetime.datetime.utcnow()
+        with self._pg.begin():
+            result = self._pg.execute(
+                sa.update(Job)
+                .where(
+                    Job.status == JOB_RUNNING,
+                    Job.update_date < now - datetime.timedelta(
+                        seconds=timeout
+                    ),
+                )
+                .values(status=JOB_PENDING, run_after=now, update_date=now)
+            )
+
+        if result.rowcount:
+            self._logger.warning(
+                f'Возвращено в очередь {result.rowcount} зависших задач'
+            )
+        return result.rowcount
+
+
+class LocalJobQueue:
+    """Очередь задач в памяти процесса с интерфейсом JobQueue
+
+    Для тестов и запуска без Postgres: задачи не переживают процесс
+    и не учитывают транзакции
+    """
+
+    def __init__(self, max_attempts: int = 5):
+        self._max_attempts = max_attempts
+        self._jobs = collections.deque()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.done = []
+        self.failed = []
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]):
+        with self._lock:
+            file_id = payload.get('file_id')
+            if file_id is not None and any(
+                job.kind == kind and job.payload.get('file_id') == file_id
+                for job in self._jobs
+            ):
+                return
+
+            self._jobs.append(Job(
+                id=next(self._ids),
+                kind=kind,
+                payload=payload,
+                status=JOB_PENDING,
+            ))
+
+    def fetch(self) -> Optional[Job]:
+        with self._lock:
+            if not self._jobs:
+                return None
+
+            job = self._jobs.popleft()
+            job.status = JOB_RUNNING
+            job.attempts += 1
+            return job
+
+    def complete(self, job: Job):
+        job.status = JOB_DONE
+        self.done.append(job)
+
+    def fail(self, job: Job, error: str):
+        job.error = error
+        if job.attempts < self._max_attempts:
+            job.status = JOB_PENDING
+            with self._lock:
+                self._jobs.append(job)
+        else:
+            job.status = JOB_FAILED
+            self.failed.append(job)
+
+    def heartbeat(self, job: Job) -> bool:
+        return job.status == JOB_RUNNING
+
+    @contextlib.contextmanager
+    def running(self, job: Job, interval: float):
+        yield
+
+    def requeue_stale(self, timeout: int) -> int:
+        return 0
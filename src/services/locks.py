@@ -0,0 +1,87 @@
+"""Сессионные advisory-блокировки Postgres и блокировки файлов"""
+
+import contextlib
+import fcntl
+import time
+from typing import BinaryIO, Callable, Iterator, Optional
+
+import sqlalchemy as sa
+
+# Ключи блокировок синхронизации: база - всё хранилище,
+# база + id пользователя - хранилище пользователя
+SYNC_LOCK_BASE = 0x4653 << 48
+
+
+@contextlib.contextmanager
+def sync_lock(
+    engine: sa.engine.Engine,
+    owner_id: Optional[int] = None,
+    blocking: bool = True,
+    poll_interval: float = 1.0,
+    on_wait: Optional[Callable[[], None]] = None,
+) -> Iterator[bool]:
+    """Блокировка синхронизации хранилища, отдаёт True, если взята
+
+    Синхронизация пользователя берёт общую блокировку хранилища и
+    исключительную блокировку пользователя, синхронизация всего
+    хранилища - исключительную блокировку хранилища. Блокировки держатся
+    на отдельном соединении в autocommit, без открытой транзакции.
+    Ожидание - опросом, между попытками вызывается on_wait
+    """
+
+    if owner_id is None:
+        locks = [('pg_try_advisory_lock', SYNC_LOCK_BASE)]
+    else:
+        locks = [
+            ('pg_try_advisory_lock_shared', SYNC_LOCK_BASE),
+            ('pg_try_advisory_lock', SYNC_LOCK_BASE + owner_id),
+        ]
+
+    connection = engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT'
+    )
+    acquired = []
+    try:
+        while True:
+            for function, key in locks[len(acquired):]:
+                locked = connection.execute(
+                    sa.select(getattr(sa.func, function)(key))
+                ).scalar()
+                if not locked:
+                    break
+                acquired.append((function, key))
+
+            if len(acquired) == len(locks) or not blocking:
+                break
+            if on_wait is not None:
+                on_wait()
+            time.sleep(poll_interval)
+
+        yield len(acquired) == len(locks)
+    finally:
+        for function, key in reversed(acquired):
+            if function.endswith('_shared'):
+                unlock = sa.func.pg_advisory_unlock_shared(key)
+            else:
+                unlock = sa.func.pg_advisory_unlock(key)
+            connection.execute(sa.select(unlock))
+        connection.close()
+
+
+@contextlib.contextmanager
+def file_lock(path: str) -> Iterator[Optional[BinaryIO]]:
+    """Исключительная блокировка файла (flock) без ожидания
+
+    Отдаёт файл, открытый на чтение и запись, или None, если файл
+    заблокирован другим процессом. Блокировка снимается при закрытии
+    файла. Если файла нет - FileNotFoundError
+    """
+
+    with open(path, 'r+b') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield None
+            return
+
+        yield f
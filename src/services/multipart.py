@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import typing as t
+
+from base_module.models import ModuleException
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File as FilePart,
+    MultipartDecoder,
+    NeedData,
+)
+
+
+class UploadTooLarge(Exception):
+    """Файл превысил допустимый размер во время приёма"""
+
+
+class MultipartFileReceiver:
+    """Потоковый приём multipart/form-data с одним файлом
+
+    Тело читается кусками и разбирается без промежуточного spool werkzeug:
+    часть с файлом пишется сразу в итоговый файл, размер и sha256
+    считаются на лету. Поле с JSON полей формы держится в памяти
+    """
+
+    FIELDS_PART = 'fields'
+    FILE_PART = 'attachment'
+
+    def __init__(
+        self,
+        stream: t.BinaryIO,
+        boundary: bytes,
+        max_file_size: int,
+        chunk_size: int = 1024 * 1024,
+        max_field_size: int = 1024 * 1024,
+    ):
+        self._stream = stream
+        self._boundary = boundary
+        self._max_file_size = max_file_size
+        self._chunk_size = chunk_size
+        self._max_field_size = max_field_size
+
+        self.fields: t.Optional[dict] = None
+        self.filename: t.Optional[str] = None
+        self.path: t.Optional[str] = None
+        self.size = 0
+        self.sha256: t.Optional[str] = None
+
+    def receive(
+        self,
+        target_path: t.Callable[[t.Optional[dict], str], str],
+    ) -> 'MultipartFileReceiver':
+        """Приём тела запроса
+
+        target_path(fields, filename) - путь для записи файла, fields
+        равен None, если поля формы идут в теле после файла
+        """
+
+        decoder = MultipartDecoder(
+            self._boundary, max_form_memory_size=self._max_field_size
+        )
+        part = None
+        sink = None
+        buffer: t.List[bytes] = []
+        out = None
+        digest = None
+
+        try:
+            for data in self._chunks():
+                decoder.receive_data(data)
+                event = decoder.next_event()
+                while not isinstance(event, (Epilogue, NeedData)):
+                    if (
+                        isinstance(event, FilePart)
+                        and event.name == self.FILE_PART
+                        and self.path is None
+                    ):
+                        part, sink = event, 'file'
+                        self.filename = event.filename
+                        self.path = target_path(self.fields, event.filename)
+                        out = open(self.path, 'wb')
+                        digest = hashlib.sha256()
+                    elif isinstance(event, Field):
+                        part, sink, buffer = event, 'field', []
+                    elif isinstance(event, FilePart):
+                        # Лишние файлы не сохраняем
+                        part, sink = event, None
+                    elif isinstance(event, Data):
+                        if sink == 'file':
+                            self.size += len(event.data)
+                            if self.size > self._max_file_size:
+                                raise UploadTooLarge()
+                            out.write(event.data)
+                            digest.update(event.data)
+                            if not event.more_data:
+                                out.close()
+                        elif sink == 'field':
+                            buffer.append(event.data)
+                            if (
+                                not event.more_data
+                                and part.name == self.FIELDS_PART
+                            ):
+                                self.fields = self._load_fields(buffer)
+
+                    event = decoder.next_event()
+        except Exception as e:
+            if out is not None:
+                out.close()
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+            if isinstance(e, ValueError):
+                # Декодер не смог разобрать тело (обрыв, битая граница)
+                raise ModuleException(
+                    'Invalid multipart body', {'error': str(e)}, 400
+                ) from e
+            raise
+
+        if out is not None and not out.closed:
+            out.close()
+        if digest is not None:
+            self.sha256 = digest.hexdigest()
+
+        return self
+
+    def _chunks(self):
+        while True:
+            data = self._stream.read(self._chunk_size)
+            if not data:
+                break
+            yield data
+
+        # None - конец тела для декодера
+        yield None
+
+    @staticmethod
+    def _load_fields(buffer: t.List[bytes]) -> dict:
+        try:
+            fields = json.loads(b''.join(buffer))
+        except ValueError:
+            raise ModuleException('Invalid form fields', {'data': ''}, 400)
+
+        if not isinstance(fields, dict):
+            raise ModuleException('Invalid form fields', {'data': ''}, 400)
+
+        return fields
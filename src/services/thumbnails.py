@@ -0,0 +1,93 @@
+"""Миниатюры изображений фиксированных размеров"""
+
+import os
+import uuid
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+# Длинная сторона миниатюры в пикселях
+THUMBNAIL_SIZES = {
+    'small': 128,
+    'medium': 256,
+    'large': 512,
+}
+THUMBNAIL_MIMETYPE = 'image/jpeg'
+
+
+def render_thumbnails(
+    source_path: str,
+    targets: Dict[str, str],
+    max_pixels: int,
+):
+    """Миниатюры всех размеров за одно декодирование исходника
+
+    targets - размер и путь миниатюры. Файлы пишутся во временные
+    и переименовываются, читатель не увидит недописанный.
+    Изображения больше max_pixels не декодируются -
+    Image.DecompressionBombError
+    """
+
+    largest = max(THUMBNAIL_SIZES[size] for size in targets)
+    with Image.open(source_path) as image:
+        # Размер известен из заголовка, пиксели ещё не прочитаны
+        if image.width * image.height > max_pixels:
+            raise Image.DecompressionBombError(
+                f'Image size ({image.width}x{image.height}) exceeds '
+                f'limit of {max_pixels} pixels'
+            )
+
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        for size, path in sorted(
+                targets.items(), key=lambda item: -THUMBNAIL_SIZES[item[0]]):
+            image.thumbnail((THUMBNAIL_SIZES[size], THUMBNAIL_SIZES[size]))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{uuid.uuid4().hex}'
+            image.save(temp_path, 'JPEG', quality=85, optimize=True)
+            os.replace(temp_path, path)
+
+
+def prune_thumbnails(root: str, max_bytes: int) -> int:
+    """Вытеснение давно не запрошенных миниатюр сверх лимита (LRU)
+
+    Время использования - mtime, обновляется при каждой выдаче.
+    Удаляет, пока размер не опустится до 90% лимита, возвращает
+    число удалённых файлов
+    """
+
+    if not os.path.isdir(root):
+        return 0
+
+    entries = []
+    total = 0
+    with os.scandir(root) as shards:
+        for shard in shards:
+            if not shard.is_dir(follow_symlinks=False):
+                continue
+            with os.scandir(shard.path) as thumbnails:
+                for thumbnail in thumbnails:
+                    stat = thumbnail.stat(follow_symlinks=False)
+                    entries.append((stat.st_mtime, stat.st_size, thumbnail.path))
+                    total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+
+    removed = 0
+    target = max_bytes * 0.9
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+
+    return removed
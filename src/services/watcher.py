@@ -0,0 +1,260 @@
+"""Журнал изменений хранилища на inotify (ctypes, только Linux)
+
+Вместо регулярного полного обхода синхронизатор получает от ядра
+события удаления и переноса и сверяет только затронутые файлы
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from base_module.models.logger import ClassesLoggerAdapter
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+# struct inotify_event без имени: wd, mask, cookie, len
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """Минимальная обёртка над inotify через libc"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+        )
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        self._add_watch.restype = ctypes.c_int
+
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+
+        return wd
+
+    def read(
+        self,
+        timeout: Optional[float],
+    ) -> List[Tuple[int, int, int, str]]:
+        """События (wd, mask, cookie, name), пустой список по таймауту"""
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, _READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SyncBatch(NamedTuple):
+    """Что сверить по накопленным событиям"""
+
+    # Очередь событий ядра переполнилась - нужен полный обход
+    full_scan: bool
+    # Пользователи, из хранилища которых перенесли каталог
+    owner_ids: frozenset
+    # Удалённые или перенесённые файлы
+    stored_names: frozenset
+
+
+class StorageWatcher:
+    """Наблюдение за деревом хранилища
+
+    События копятся delay секунд с первого (за это время успевают
+    завершиться транзакции API, переносящие файлы) или до batch_size
+    файлов и отдаются пачкой. Перенос каталога сверяет владельца, только
+    если парное IN_MOVED_TO (по cookie) не пришло до конца пачки, то есть
+    каталог ушёл из хранилища или к другому владельцу
+    """
+
+    WATCH_MASK = (
+        IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_ONLYDIR | IN_DONT_FOLLOW
+    )
+
+    def __init__(
+        self,
+        root: str,
+        ignore: Iterable[str] = (),
+        delay: float = 2.0,
+        batch_size: int = 1000,
+    ):
+        self._root = os.path.abspath(root)
+        self._ignore = set(ignore)
+        self._delay = delay
+        self._batch_size = batch_size
+        self._paths: Dict[int, str] = {}
+        self._logger = ClassesLoggerAdapter.create(self)
+
+        self._inotify = Inotify()
+        self._watch_tree(self._root, strict=True)
+        self._logger.info(f'Наблюдение за {len(self._paths)} каталогами')
+
+    def batches(self) -> Iterator[SyncBatch]:
+        full_scan = False
+        owner_ids = set()
+        stored_names = set()
+        # cookie переноса каталога -> владелец, ждущие парного IN_MOVED_TO
+        moved_from: Dict[int, int] = {}
+        started = None
+
+        while True:
+            timeout = None
+            if started is not None:
+                timeout = max(started + self._delay - time.monotonic(), 0)
+
+            for wd, mask, cookie, name in self._inotify.read(timeout):
+                if mask & IN_Q_OVERFLOW:
+                    self._logger.warning('Переполнение очереди inotify')
+                    full_scan = True
+                elif mask & IN_IGNORED:
+                    self._paths.pop(wd, None)
+                    continue
+                elif not self._handle(
+                        wd, mask, cookie, name,
+                        owner_ids, stored_names, moved_from,
+                ):
+                    continue
+
+                if started is None:
+                    started = time.monotonic()
+
+            if started is None:
+                continue
+            if (
+                time.monotonic() >= started + self._delay
+                or len(stored_names) >= self._batch_size
+            ):
+                owner_ids.update(moved_from.values())
+                if full_scan or owner_ids or stored_names:
+                    yield SyncBatch(
+                        full_scan,
+                        frozenset(owner_ids),
+                        frozenset(stored_names),
+                    )
+                full_scan = False
+                owner_ids = set()
+                stored_names = set()
+                moved_from = {}
+                started = None
+
+    def close(self):
+        self._inotify.close()
+
+    def _handle(
+        self,
+        wd: int,
+        mask: int,
+        cookie: int,
+        name: str,
+        owner_ids: set,
+        stored_names: set,
+        moved_from: Dict[int, int],
+    ) -> bool:
+        """Разбор события, True - нужна сверка"""
+
+        directory = self._paths.get(wd)
+        if directory is None or name in self._ignore:
+            return False
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # При переносе внутри хранилища wd подкаталогов
+                # сохраняются, обновятся только их пути
+                self._watch_tree(path)
+                if mask & IN_MOVED_TO and cookie in moved_from:
+                    source_owner_id = moved_from.pop(cookie)
+                    if source_owner_id != self._owner_id(path):
+                        owner_ids.add(source_owner_id)
+                return False
+            if mask & IN_MOVED_FROM:
+                # Какие файлы были внутри, неизвестно - владелец сверяется,
+                # если каталог не появится в хранилище до конца пачки
+                owner_id = self._owner_id(path)
+                if owner_id is not None:
+                    moved_from[cookie] = owner_id
+                    return True
+            return False
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            stored_name, _ = os.path.splitext(name)
+            if len(stored_name) == 32 and all(
+                    c in '0123456789abcdef' for c in stored_name):
+                stored_names.add(stored_name)
+                return True
+
+        return False
+
+    def _watch_tree(self, path: str, strict: bool = False):
+        """Наблюдение за каталогом и всеми подкаталогами
+
+        strict - ошибка вместо предупреждения, если наблюдать не удаётся
+        """
+
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            try:
+                wd = self._inotify.add_watch(current, self.WATCH_MASK)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            except OSError as e:
+                # Например, исчерпан fs.inotify.max_user_watches
+                if strict:
+                    raise
+                self._logger.warning(
+                    f'Не удаётся наблюдать за {current}: {e}'
+                )
+                continue
+            self._paths[wd] = current
+
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if (
+                            entry.is_dir(follow_symlinks=False)
+                            and entry.name not in self._ignore
+                        ):
+                            stack.append(entry.path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+    def _owner_id(self, path: str) -> Optional[int]:
+        owner = os.path.relpath(path, self._root).split(os.sep)[0]
+        return int(owner) if owner.isdigit() else None
@@ -0,0 +1,274 @@
+"""Общие фикстуры тестов
+
+Конфиг приложения пишется во временный каталог до импорта модулей
+сервиса. Тесты с БД подключаются к postgres из переменных окружения
+TEST_PG_* и пропускаются, если он недоступен
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import uuid
+
+import psycopg2
+import pytest
+import sqlalchemy as sa
+import yaml
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+sys.path.insert(0, SRC_PATH)
+
+PG_CONFIG = {
+    'host': os.getenv('TEST_PG_HOST', 'localhost'),
+    'port': int(os.getenv('TEST_PG_PORT', 5432)),
+    'user': os.getenv('TEST_PG_USER', 'postgres'),
+    'password': os.getenv('TEST_PG_PASSWORD', 'postgres'),
+    'database': os.getenv('TEST_PG_DATABASE', 'files_test'),
+    'pool_size': 2,
+    'max_pool_connections': 10,
+}
+
+STORAGE_PATH = tempfile.mkdtemp(prefix='files-storage-')
+_config_path = os.path.join(
+    tempfile.mkdtemp(prefix='files-config-'), 'config.yaml'
+)
+with open(_config_path, 'w') as config_file:
+    yaml.safe_dump({
+        'pg': PG_CONFIG,
+        'redis': {
+            'host': os.getenv('TEST_REDIS_HOST', 'localhost'),
+            'port': int(os.getenv('TEST_REDIS_PORT', 6379)),
+        },
+        'storage_path': STORAGE_PATH,
+        'token_cache_ttl': 0,
+    }, config_file)
+os.environ['YAML_PATH'] = _config_path
+
+
+def _pg_available() -> bool:
+    try:
+        psycopg2.connect(
+            host=PG_CONFIG['host'],
+            port=PG_CONFIG['port'],
+            user=PG_CONFIG['user'],
+            password=PG_CONFIG['password'],
+            dbname='postgres',
+            connect_timeout=2,
+        ).close()
+    except psycopg2.OperationalError:
+        return False
+    return True
+
+
+PG_AVAILABLE = _pg_available()
+
+
+@pytest.fixture(scope='session')
+def app():
+    """Приложение на тестовой БД (создаётся при первом подключении)"""
+
+    if not PG_AVAILABLE:
+        pytest.skip('postgres недоступен (TEST_PG_HOST/TEST_PG_PORT)')
+
+    from app import app as flask_app
+
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def pg_session(app):
+    from injectors.connections import pg
+
+    session = pg.acquire_session()
+    yield session
+    session.remove()
+
+
+@pytest.fixture
+def user(client):
+    """Новый пользователь и заголовок авторизации"""
+
+    credentials = {
+        'username': f'user_{uuid.uuid4().hex[:12]}',
+        'password': 'password123',
+    }
+    response = client.post('/api/auth/register', json=credentials)
+    assert response.status_code == 201
+    response = client.post('/api/auth/login', json=credentials)
+    assert response.status_code == 200
+    data = response.get_json()
+    return {
+        'id': data['id'],
+        'headers': {'Authorization': f'Bearer {data["token"]}'},
+    }
+
+
+@pytest.fixture
+def upload(client, user):
+    """Загрузка файла через API, возвращает запись файла"""
+
+    def _upload(content: bytes, filename: str, path: str = None):
+        fields = {'path': path} if path else {}
+        response = client.post(
+            '/api/files',
+            data={
+                'fields': json.dumps(fields),
+                'attachment': (io.BytesIO(content), filename),
+            },
+            headers=user['headers'],
+            content_type='multipart/form-data',
+        )
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()
+
+    return _upload
+
+
+@pytest.fixture
+def explain(pg_session):
+    """План запроса (Query, select или SQL с параметрами) без выполнения
+
+    Seq scan выключается: на маленькой тестовой БД планировщик иначе
+    всегда читает таблицу целиком, а проверяется, что индекс применим.
+    settings - дополнительные параметры планировщика (enable_*)
+    """
+
+    def _explain(query, params=None, **settings) -> str:
+        if not isinstance(query, str):
+            statement = getattr(query, 'statement', query)
+            compiled = statement.compile(
+                dialect=pg_session.get_bind().dialect
+            )
+            query, params = str(compiled), compiled.params
+
+        with pg_session.begin():
+            connection = pg_session.connection()
+            connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            for name, value in settings.items():
+                connection.exec_driver_sql(f'SET LOCAL {name} = {value}')
+            rows = connection.exec_driver_sql(
+                f'EXPLAIN {query}', params
+            ).fetchall()
+        return '\n'.join(row[0] for row in rows)
+
+    return _explain
+
+
+def _insert_files(session, owner_id: int, files: int, folders: int):
+    """Записи файлов и папок пользователя без файлов на диске"""
+
+    params = {'owner_id': owner_id, 'files': files, 'folders': folders}
+    session.execute(sa.text("""
+        INSERT INTO files.folders (owner_id, name, path)
+        SELECT :owner_id, 'dir' || g, 'top' || g % 10 || '/dir' || g
+        FROM generate_series(1, :folders) g
+    """), params)
+    session.execute(sa.text("""
+        INSERT INTO files.files (
+            name, extension, stored_name, size, path, creation_date,
+            update_date, comment, owner_id, folder_id, category
+        )
+        SELECT
+            'file_' || md5(g::text), 'txt',
+            md5(CAST(:owner_id AS text) || '-' || g), g, '',
+            now(), now(), '', :owner_id, d.id, 'documents'
+        FROM generate_series(1, :files) g
+        JOIN files.folders d
+            ON d.owner_id = :owner_id AND d.name = 'dir' || (g % :folders + 1)
+    """), params)
+
+
+def _delete_files(session, owner_ids):
+    params = {'owner_ids': list(owner_ids)}
+    session.execute(sa.text(
+        'DELETE FROM files.files WHERE owner_id = ANY(:owner_ids)'
+    ), params)
+    session.execute(sa.text(
+        'DELETE FROM files.folders WHERE owner_id = ANY(:owner_ids)'
+    ), params)
+
+
+@pytest.fixture(scope='session')
+def other_owners(app):
+    """20 пользователей по 4000 файлов: фон для выборок одного владельца"""
+
+    from injectors.connections import pg
+
+    session = pg.acquire_session()
+    with session.begin():
+        owner_ids = session.execute(sa.text("""
+            INSERT INTO files.users (username, password_hash, created_at)
+            SELECT 'background_' || md5(random()::text), '', now()
+            FROM generate_series(1, 20)
+            RETURNING id
+        """)).scalars().all()
+        for owner_id in owner_ids:
+            _insert_files(session, owner_id, files=4000, folders=100)
+
+    yield owner_ids
+
+    with session.begin():
+        _delete_files(session, owner_ids)
+        session.execute(sa.text(
+            'DELETE FROM files.users WHERE id = ANY(:owner_ids)'
+        ), {'owner_ids': owner_ids})
+    session.remove()
+
+
+@pytest.fixture
+def many_files(user, other_owners, pg_session):
+    """Пользователь с 20000 записей файлов в 500 папках, только в БД
+
+    Вместе с фоном других владельцев планировщик выбирает индексы так
+    же, как на рабочей базе
+    """
+
+    with pg_session.begin():
+        _insert_files(pg_session, user['id'], files=20000, folders=500)
+    # Как после autovacuum: статистика и карта видимости (index only scan)
+    with pg_session.get_bind().connect().execution_options(
+        isolation_level='AUTOCOMMIT'
+    ) as connection:
+        connection.execute(sa.text('VACUUM ANALYZE files.files'))
+        connection.execute(sa.text('VACUUM ANALYZE files.folders'))
+
+    yield user
+
+    with pg_session.begin():
+        _delete_files(pg_session, [user['id']])
+
+
+@pytest.fixture
+def captured_selects(pg_session):
+    """SELECT-запросы к БД, выполненные внутри блока with
+
+    Отдаёт список пар (SQL, параметры) в формате драйвера
+    """
+
+    @contextlib.contextmanager
+    def _capture():
+        statements = []
+
+        def before_execute(
+                conn, cursor, statement, parameters, context, executemany,
+        ):
+            if statement.lstrip()[:6].upper() == 'SELECT':
+                statements.append((statement, parameters))
+
+        engine = pg_session.get_bind()
+        sa.event.listen(engine, 'before_cursor_execute', before_execute)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', before_execute)
+
+    return _capture
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from conftest import STORAGE_PATH
+
+
+def _disk_path(file: dict, relative_path: str = None) -> str:
+    filename = file['stored_name']
+    if file['extension']:
+        filename = f'{filename}.{file["extension"]}'
+    return os.path.join(
+        STORAGE_PATH,
+        str(file['owner_id']),
+        relative_path or file['relative_path'],
+        filename,
+    )
+
+
+def test_batch_invalid_operations_do_not_abort_batch(client, user, upload):
+    moved = upload(b'moved', 'moved.txt')
+    kept = upload(b'kept', 'kept.txt')
+
+    response = client.post(
+        '/api/files/batch',
+        json={'operations': [
+            {'op': 'move', 'id': moved['id'], 'path': 'archive'},
+            {'op': 'update', 'id': kept['id'], 'fields': {'name': 42}},
+            {'op': 'update', 'id': kept['id'], 'fields': {'name': 'x' * 1000}},
+            {'op': 'move', 'id': kept['id'], 'path': ['archive']},
+            {'op': 'update', 'id': kept['id'], 'fields': 'name'},
+            {'op': 'delete', 'id': 'abc'},
+        ]},
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['ok'] + ['error'] * 5
+    assert all(r['code'] == 400 for r in results[1:])
+    assert results[0]['file']['relative_path'] == 'archive'
+
+    assert os.path.exists(_disk_path(moved, 'archive'))
+    assert not os.path.exists(_disk_path(moved))
+    assert os.path.exists(_disk_path(kept))
+
+
+def test_batch_flush_failure_restores_disk(client, user, upload, monkeypatch):
+    from services.files_service import FilesService
+
+    moved = upload(b'moved', 'moved.txt')
+    deleted = upload(b'deleted', 'deleted.txt')
+
+    def failing_flush(self, *args, **kwargs):
+        raise RuntimeError('flush failed')
+
+    monkeypatch.setattr(FilesService, '_flush_batch', failing_flush)
+
+    with pytest.raises(RuntimeError):
+        client.post(
+            '/api/files/batch',
+            json={'operations': [
+                {'op': 'move', 'id': moved['id'], 'path': 'archive'},
+                {'op': 'delete', 'id': deleted['id']},
+            ]},
+            headers=user['headers'],
+        )
+
+    assert os.path.exists(_disk_path(moved))
+    assert not os.path.exists(_disk_path(moved, 'archive'))
+    assert os.path.exists(_disk_path(deleted))
+
+    monkeypatch.undo()
+    files = client.get('/api/files', headers=user['headers']).get_json()
+    assert {f['id']: f['relative_path'] for f in files} == {
+        moved['id']: moved['relative_path'],
+        deleted['id']: deleted['relative_path'],
+    }
+
+
+@pytest.mark.parametrize('method', ['patch', 'delete'])
+def test_single_file_change_locks_row(client, user, upload, captured_selects,
+                                      method):
+    file = upload(b'data', 'file.txt')
+
+    with captured_selects() as statements:
+        response = getattr(client, method)(
+            f'/api/files/{file["id"]}',
+            json={'fields': {'path': 'archive'}},
+            headers=user['headers'],
+        )
+
+    assert response.status_code == 200
+    assert any(
+        'FROM files.files' in sql and 'FOR UPDATE OF files' in sql
+        for sql, _ in statements
+    ), statements
@@ -0,0 +1,71 @@
+import pytest
+
+from services.cache import CacheService, MetadataCache
+
+
+class FakeRedis:
+    """Redis в памяти, который можно «отключить»"""
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError('Redis is down')
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self._check()
+        self.data[key] = value
+
+    def delete(self, *keys):
+        self._check()
+        for key in keys:
+            self.data.pop(key, None)
+
+
+@pytest.fixture
+def redis():
+    return FakeRedis()
+
+
+def _load(metadata, owner_id, value):
+    cached, version = metadata.get(owner_id, 'file', '1')
+    if cached is None:
+        metadata.set(owner_id, version, 'file', '1', value)
+        return value
+    return cached
+
+
+def test_metadata_cache_is_bypassed_while_redis_is_down(redis):
+    # Два процесса с общим Redis
+    first = MetadataCache(CacheService(redis), ttl=300)
+    second_cache = CacheService(redis)
+    second = MetadataCache(second_cache, ttl=300)
+
+    assert _load(first, 1, 'old') == 'old'
+    assert _load(first, 1, 'new') == 'old'
+
+    redis.down = True
+    assert _load(first, 1, 'old') == 'old'
+    # Изменение в другом процессе: сброс версии в Redis не прошёл
+    second_cache.delete(*second.invalidation_keys(1))
+    assert _load(first, 1, 'new') == 'new'
+    assert first.stats()['by_kind']['file']['bypassed'] == 2
+
+
+def test_local_fallback_uses_short_ttl(redis, monkeypatch):
+    cache = CacheService(redis, local_ttl=5)
+    redis.down = True
+    now = 1000.0
+    monkeypatch.setattr('services.cache.time.monotonic', lambda: now)
+
+    cache.set('stats:1', {'total': 1}, ttl=300)
+    assert cache.get('stats:1') == {'total': 1}
+
+    now += 6
+    assert cache.get('stats:1') is None
@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.fixture
+def folder(client, user):
+    return client.post(
+        '/api/files/folders',
+        json={'fields': {'path': 'docs/2025'}},
+        headers=user['headers'],
+    ).get_json()
+
+
+def test_rename_and_move_folder(client, user, folder):
+    response = client.patch(
+        f'/api/files/folders/{folder["id"]}',
+        json={'fields': {'name': 'archive', 'path': '.'}},
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()['path'] == 'archive'
+
+
+@pytest.mark.parametrize('fields', [
+    ['name'],
+    {'name': 1},
+    {'name': ''},
+    {'name': 'a/b'},
+    {'name': '..'},
+    {'name': 'x' * 256},
+    {'path': 1},
+    {'path': 'x' * 256},
+])
+def test_update_folder_invalid_fields(client, user, folder, fields):
+    response = client.patch(
+        f'/api/files/folders/{folder["id"]}',
+        json={'fields': fields},
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('fields', [
+    'docs',
+    {'path': ['docs']},
+    {'path': 'docs/' + 'x' * 256},
+])
+def test_create_folder_invalid_fields(client, user, fields):
+    response = client.post(
+        '/api/files/folders', json={'fields': fields}, headers=user['headers']
+    )
+
+    assert response.status_code == 400
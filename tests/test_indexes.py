@@ -0,0 +1,88 @@
+"""Запросы списков, поиска по имени и статистики читают индексы
+
+Проверяются планы запросов, которые действительно выполняет сервис
+"""
+
+import re
+
+import pytest
+
+from services.files_service import FilesService
+
+
+@pytest.fixture
+def service(app, many_files, pg_session):
+    return FilesService(pg_session, user_id=many_files['id'])
+
+
+@pytest.fixture
+def plans(app, explain, captured_selects):
+    """Планы SELECT-запросов, выполненных call в контексте запроса url"""
+
+    def _plans(call, url='/', **settings):
+        with app.test_request_context(url):
+            with captured_selects() as statements:
+                call()
+
+        assert statements
+        result = [
+            explain(sql, params, **settings) for sql, params in statements
+        ]
+        for plan in result:
+            assert 'Seq Scan' not in plan, plan
+        return '\n'.join(result)
+
+    return _plans
+
+
+def _uses_index(plan: str, index: str) -> bool:
+    """Чтение по индексу: Index Scan, Index Only Scan или Bitmap Index Scan"""
+
+    return re.search(rf'Scan (?:using|on) {index}\b', plan) is not None
+
+
+def test_get_files(service, plans):
+    plan = plans(service._load_files)
+
+    # Любой индекс с owner_id в начале: выбор зависит от статистики
+    assert _uses_index(plan, r'ix_files_owner_\w+'), plan
+
+
+def test_get_files_in_root_folder(service, plans):
+    plan = plans(service._load_files, '/?folder_id=0')
+
+    assert _uses_index(plan, 'ix_files_owner_folder'), plan
+
+
+def test_get_file_by_name(service, plans):
+    def call():
+        with pytest.raises(Exception, match='File not found'):
+            service.get_file_by_name('missing.txt')
+
+    plan = plans(call)
+
+    assert _uses_index(plan, 'ix_files_owner_name_extension'), plan
+
+
+def test_get_user_statistics(service, plans):
+    # Выбор Index Only Scan зависит от карты видимости, которую держат
+    # параллельные транзакции, поэтому прочие виды чтения выключены:
+    # без покрывающего индекса остался бы только Seq Scan
+    plan = plans(
+        service.get_user_statistics,
+        enable_indexscan='off',
+        enable_bitmapscan='off',
+    )
+
+    # Размеры берутся из INCLUDE индекса, таблица не читается
+    assert 'Index Only Scan using ix_files_owner_category on files' in plan
+
+
+def test_get_user_used_bytes(service, plans):
+    def call():
+        with service._pg.begin():
+            service._get_user_used_bytes()
+
+    plan = plans(call)
+
+    assert _uses_index(plan, 'user_usage_pkey'), plan
@@ -0,0 +1,51 @@
+import pytest
+import sqlalchemy as sa
+
+from base_module.config import PgConfig
+from base_module.injectors import QueryInstrumentation
+
+LOCK_KEY = 0x7E57
+
+
+@pytest.fixture
+def instrumentation():
+    return QueryInstrumentation(PgConfig(
+        host='', port=0, user='', password='', database='',
+    ))
+
+
+@pytest.mark.parametrize('statement', [
+    'SELECT * FROM files.jobs WHERE id = 1 FOR UPDATE SKIP LOCKED',
+    'SELECT * FROM files.files FOR NO KEY UPDATE OF files',
+    'SELECT * FROM files.files FOR SHARE',
+    'SELECT pg_try_advisory_lock(1)',
+    "SELECT nextval('files.files_id_seq')",
+])
+def test_side_effects_are_detected(statement):
+    assert QueryInstrumentation.SIDE_EFFECTS_RE.search(statement)
+
+
+def test_plain_select_is_analyzed(pg_session, instrumentation):
+    statement = 'SELECT id, name FROM files.files WHERE owner_id = 1'
+    with pg_session.get_bind().connect() as conn:
+        plan = instrumentation._explain(conn, statement, {})
+
+    assert 'actual time' in plan
+
+
+def test_explain_does_not_repeat_advisory_lock(pg_session, instrumentation):
+    statement = f'SELECT pg_try_advisory_lock({LOCK_KEY})'
+    with pg_session.get_bind().connect() as conn:
+        conn.execute(sa.text(statement))
+        plan = instrumentation._explain(conn, statement, {})
+        unlocked = [
+            conn.execute(
+                sa.text(f'SELECT pg_advisory_unlock({LOCK_KEY})')
+            ).scalar()
+            for _ in range(2)
+        ]
+        conn.rollback()
+
+    assert 'actual time' not in plan
+    # Блокировка взята один раз
+    assert unlocked == [True, False]
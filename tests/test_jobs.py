@@ -0,0 +1,100 @@
+import datetime
+import random
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from models.job import Job, JOB_DONE, JOB_PURGE, JOB_RUNNING, JOB_THUMBNAIL
+from services.jobs import JobQueue
+
+
+def _jobs(pg_session, kind, file_id):
+    with pg_session.begin():
+        return (
+            pg_session.query(Job)
+            .filter(
+                Job.kind == kind,
+                Job.payload['file_id'].as_string() == str(file_id),
+            )
+            .order_by(Job.id)
+            .all()
+        )
+
+
+def test_enqueue_skips_active_duplicate(pg_session):
+    queue = JobQueue(pg_session)
+    file_id = random.randrange(10 ** 12, 10 ** 13)
+
+    for _ in range(2):
+        with pg_session.begin():
+            queue.enqueue(JOB_THUMBNAIL, {'file_id': file_id})
+    assert len(_jobs(pg_session, JOB_THUMBNAIL, file_id)) == 1
+
+    with pg_session.begin():
+        pg_session.execute(
+            sa.update(Job)
+            .where(Job.payload['file_id'].as_string() == str(file_id))
+            .values(status=JOB_DONE)
+        )
+        queue.enqueue(JOB_THUMBNAIL, {'file_id': file_id})
+    assert len(_jobs(pg_session, JOB_THUMBNAIL, file_id)) == 2
+
+
+def test_enqueue_without_file_id_is_not_deduplicated(pg_session):
+    queue = JobQueue(pg_session)
+    names = [uuid.uuid4().hex]
+
+    with pg_session.begin():
+        queue.enqueue(JOB_PURGE, {'names': names})
+        queue.enqueue(JOB_PURGE, {'names': names})
+        count = (
+            pg_session.query(Job)
+            .filter(
+                Job.kind == JOB_PURGE,
+                Job.payload['names'][0].as_string() == names[0],
+            )
+            .count()
+        )
+    assert count == 2
+
+
+def test_thumbnail_requests_enqueue_one_job(client, user, upload,
+                                            pg_session, monkeypatch):
+    from config import config
+
+    file = upload(b'not rendered yet', 'photo.png')
+    monkeypatch.setattr(config, 'jobs_enabled', True)
+
+    for _ in range(3):
+        response = client.get(
+            f'/api/files/{file["id"]}/thumbnail', headers=user['headers']
+        )
+        assert response.status_code == 202
+
+    assert len(_jobs(pg_session, JOB_THUMBNAIL, file['id'])) == 1
+
+
+def test_running_job_heartbeat_prevents_requeue(pg_session):
+    queue = JobQueue(pg_session)
+    started = datetime.datetime.utcnow() - datetime.timedelta(seconds=120)
+    job = Job(
+        kind=JOB_PURGE,
+        payload={'names': []},
+        status=JOB_RUNNING,
+        attempts=1,
+        run_after=started,
+        update_date=started,
+    )
+    with pg_session.begin():
+        pg_session.add(job)
+
+    with queue.running(job, interval=0.05):
+        time.sleep(0.3)
+        # Задача дольше таймаута, но воркер жив
+        queue.requeue_stale(timeout=60)
+
+    with pg_session.begin():
+        pg_session.refresh(job)
+    assert job.status == JOB_RUNNING
+    assert job.update_date > started + datetime.timedelta(seconds=60)
@@ -0,0 +1,155 @@
+"""Разбор Range при скачивании без БД: запрос собирается test_request_context"""
+
+import datetime
+import os
+import re
+
+import flask
+import pytest
+
+from config import config
+from services.files_service import FilesService
+
+ETAG = 'stored-2024-01-01T00:00:00'
+LAST_MODIFIED = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture(scope='module')
+def app():
+    return flask.Flask(__name__)
+
+
+@pytest.fixture(scope='module')
+def service():
+    return FilesService(None)
+
+
+@pytest.fixture(scope='module')
+def content():
+    # Больше куска чтения, диапазоны пересекают границы кусков
+    return os.urandom(5 * 1024 * 1024 + 123)
+
+
+@pytest.fixture(scope='module')
+def file_path(tmp_path_factory, content):
+    path = tmp_path_factory.mktemp('ranges') / 'file.bin'
+    path.write_bytes(content)
+    return str(path)
+
+
+def _response(app, service, file_path, headers):
+    with app.test_request_context(headers=headers):
+        return service._multirange_response(
+            file_path, ETAG, LAST_MODIFIED
+        )
+
+
+def _parts(response):
+    boundary = response.mimetype_params['boundary']
+    body = response.get_data()
+    parts = []
+    for chunk in body.split(f'--{boundary}'.encode())[1:-1]:
+        head, _, data = chunk.partition(b'\r\n\r\n')
+        match = re.search(rb'Content-Range: bytes (\d+)-(\d+)/(\d+)', head)
+        parts.append((int(match[1]), int(match[2]), data[:-2]))
+    return parts
+
+
+@pytest.mark.parametrize('header', [
+    'bytes=0-99,50-150',
+    'bytes=50-150,0-99',
+    'bytes=0-99, 100-150',
+])
+def test_overlapping_ranges_are_merged(app, service, file_path, content,
+                                       header):
+    response = _response(app, service, file_path, {'Range': header})
+
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == (
+        f'bytes 0-150/{len(content)}'
+    )
+    assert response.get_data() == content[:151]
+
+
+def test_suffix_range_before_prefix(app, service, file_path, content):
+    response = _response(
+        app, service, file_path, {'Range': 'bytes=-100,0-10'}
+    )
+
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    size = len(content)
+    assert _parts(response) == [
+        (0, 10, content[:11]),
+        (size - 100, size - 1, content[-100:]),
+    ]
+    assert response.content_length == len(response.get_data())
+
+
+def test_ranges_across_read_chunks(app, service, file_path, content):
+    header = 'bytes=1000000-3000000,65530-65545,4000000-'
+    response = _response(app, service, file_path, {'Range': header})
+
+    assert response.status_code == 206
+    assert _parts(response) == [
+        (65530, 65545, content[65530:65546]),
+        (1000000, 3000000, content[1000000:3000001]),
+        (4000000, len(content) - 1, content[4000000:]),
+    ]
+
+
+def test_too_many_ranges_return_full_file(app, service, file_path, content,
+                                          monkeypatch):
+    monkeypatch.setattr(config, 'download_max_ranges', 2)
+    response = _response(
+        app, service, file_path, {'Range': 'bytes=0-1,10-11,20-21'}
+    )
+
+    assert response.status_code == 200
+    assert 'Content-Range' not in response.headers
+    assert response.content_length == len(content)
+    assert response.get_data() == content
+
+
+@pytest.mark.parametrize('header', ['bytes=abc', 'bytes=5-1,0-1', 'items=0-1'])
+def test_invalid_range_returns_full_file(app, service, file_path, content,
+                                         header):
+    response = _response(app, service, file_path, {'Range': header})
+
+    assert response.status_code == 200
+    assert response.get_data() == content
+
+
+def test_if_range_mismatch_returns_full_file(app, service, file_path,
+                                             content):
+    response = _response(app, service, file_path, {
+        'Range': 'bytes=0-1,10-11',
+        'If-Range': '"other"',
+    })
+
+    assert response.status_code == 200
+    assert response.get_data() == content
+
+
+def test_not_modified(app, service, file_path):
+    response = _response(app, service, file_path, {
+        'Range': 'bytes=0-1,10-11',
+        'If-None-Match': f'"{ETAG}"',
+    })
+
+    assert response.status_code == 304
+
+
+def test_unsatisfiable_ranges(app, service, file_path, content):
+    size = len(content)
+    response = _response(
+        app, service, file_path, {'Range': f'bytes={size}-,{size + 10}-'}
+    )
+
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{size}'
+
+
+@pytest.mark.parametrize('headers', [{}, {'Range': 'bytes=0-99'}])
+def test_single_range_is_left_to_send_file(app, service, file_path, headers):
+    assert _response(app, service, file_path, headers) is None
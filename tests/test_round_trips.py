@@ -0,0 +1,174 @@
+"""Бюджет обращений к БД (запросы + фиксации) на основные запросы API
+
+Счётчики берутся из QueryStats последнего запроса тестового клиента,
+рост числа обращений означает лишние запросы (N+1, повторные чтения)
+"""
+
+import io
+
+from PIL import Image
+
+from base_module.injectors import QueryInstrumentation
+
+# Обращения к БД с учётом проверки токена
+BUDGETS = {
+    'upload': 9,
+    'upload_new_folder': 14,
+    'list': 4,
+    'download': 4,
+    'delete': 8,
+    'search': 4,
+    'batch': 12,
+    'folder_move': 7,
+    'upload_finalize': 11,
+    'thumbnail': 4,
+    'stats': 4,
+}
+
+
+def _round_trips(response=None) -> int:
+    stats = QueryInstrumentation.current()
+    assert stats is not None
+    if response is not None:
+        assert f'desc="{stats.round_trips} round trips"' in (
+            response.headers['Server-Timing']
+        )
+    return stats.round_trips
+
+
+def test_upload(upload):
+    # Первая загрузка пользователя ещё создаёт строку учёта места
+    upload(b'data', 'first.txt')
+
+    upload(b'data', 'root.txt')
+    assert _round_trips() <= BUDGETS['upload']
+
+    upload(b'data', 'nested.txt', path='docs/2025')
+    assert _round_trips() <= BUDGETS['upload_new_folder']
+
+
+def test_list(client, user, upload):
+    for i in range(20):
+        upload(b'data', f'file_{i}.txt', path=f'docs/{i % 4}')
+
+    response = client.get('/api/files', headers=user['headers'])
+
+    assert len(response.get_json()) == 20
+    # Не зависит от числа файлов и папок
+    assert _round_trips(response) <= BUDGETS['list']
+
+
+def test_download(client, user, upload):
+    file = upload(b'data', 'file.txt', path='docs')
+
+    response = client.get(
+        f'/api/files/{file["id"]}/download', headers=user['headers']
+    )
+
+    assert response.get_data() == b'data'
+    assert _round_trips(response) <= BUDGETS['download']
+
+
+def test_delete(client, user, upload):
+    file = upload(b'data', 'file.txt', path='docs')
+
+    response = client.delete(
+        f'/api/files/{file["id"]}', headers=user['headers']
+    )
+
+    assert response.status_code == 200
+    assert _round_trips(response) <= BUDGETS['delete']
+
+
+def test_search(client, user, upload):
+    for i in range(20):
+        upload(b'data', f'report_{i}.txt', path=f'docs/{i % 4}')
+
+    for mode in ('substring', 'prefix'):
+        response = client.get(
+            f'/api/files/search?q=report&mode={mode}', headers=user['headers']
+        )
+
+        assert len(response.get_json()['items']) == 20
+        assert _round_trips(response) <= BUDGETS['search']
+
+
+def test_batch(client, user, upload):
+    upload(b'data', 'existing.txt', path='archive')
+    moved = [upload(b'%d' % i, f'moved_{i}.txt') for i in range(10)]
+    deleted = [upload(b'd%d' % i, f'deleted_{i}.txt') for i in range(10)]
+
+    response = client.post(
+        '/api/files/batch',
+        json={'operations': [
+            *({'op': 'move', 'id': f['id'], 'path': 'archive'} for f in moved),
+            *({'op': 'delete', 'id': f['id']} for f in deleted),
+        ]},
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 200
+    # Удаления - пакетом, папка назначения ищется один раз
+    assert _round_trips(response) <= BUDGETS['batch']
+
+
+def test_folder_move(client, user, upload):
+    for i in range(10):
+        upload(b'data', f'file_{i}.txt', path=f'docs/{i % 3}')
+    folders = client.get('/api/files/folders', headers=user['headers'])
+    docs = next(f for f in folders.get_json() if f['path'] == 'docs')
+
+    response = client.patch(
+        f'/api/files/folders/{docs["id"]}',
+        json={'fields': {'name': 'documents'}},
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 200
+    # Подпапки и файлы не обновляются по одной
+    assert _round_trips(response) <= BUDGETS['folder_move']
+
+
+def test_upload_finalize(client, user):
+    upload = client.post(
+        '/api/files/uploads',
+        json={'fields': {'filename': 'movie.bin', 'size': 4}},
+        headers=user['headers'],
+    ).get_json()
+    client.patch(
+        f'/api/files/uploads/{upload["id"]}',
+        input_stream=io.BytesIO(b'data'),
+        headers={**user['headers'], 'Upload-Offset': '0'},
+    )
+
+    response = client.post(
+        f'/api/files/uploads/{upload["id"]}/finalize',
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 200
+    assert _round_trips(response) <= BUDGETS['upload_finalize']
+
+
+def test_thumbnail(client, user, upload):
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 200), (10, 20, 30)).save(buffer, 'PNG')
+    file = upload(buffer.getvalue(), 'photo.png')
+
+    response = client.get(
+        f'/api/files/{file["id"]}/thumbnail', headers=user['headers']
+    )
+
+    assert response.status_code == 200
+    assert _round_trips(response) <= BUDGETS['thumbnail']
+
+
+def test_stats(client, user, upload):
+    for i in range(10):
+        upload(b'data', f'file_{i}.{("txt", "png", "mp4")[i % 3]}')
+
+    response = client.get('/api/files/stats', headers=user['headers'])
+
+    assert response.status_code == 200
+    # Без кэша: один агрегирующий запрос по категориям
+    assert _round_trips(response) <= BUDGETS['stats']
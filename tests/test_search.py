@@ -0,0 +1,44 @@
+def _names(response):
+    return sorted(item['name'] for item in response.get_json()['items'])
+
+
+def test_substring_search_by_name_extension_and_path(client, user, upload):
+    upload(b'1', 'quarterly.txt')
+    upload(b'2', 'notes.quarterdoc')
+    upload(b'3', 'scan.png', path='archive/quarter')
+    upload(b'4', 'other.txt', path='misc')
+
+    response = client.get(
+        '/api/files/search?q=quarter', headers=user['headers']
+    )
+
+    assert response.status_code == 200
+    assert _names(response) == ['notes', 'quarterly', 'scan']
+
+
+def test_path_filter_matches_folder_path(client, user, upload):
+    upload(b'1', 'a.txt', path='projects/alpha')
+    upload(b'2', 'b.txt', path='projects/beta')
+
+    response = client.get(
+        '/api/files?path=alpha', headers=user['headers']
+    )
+
+    assert [item['name'] for item in response.get_json()] == ['a']
+
+
+def test_substring_filter_uses_trigram_indexes(app, many_files, pg_session,
+                                               explain):
+    from services.files_service import FilesService
+
+    with app.test_request_context():
+        service = FilesService(pg_session, user_id=many_files['id'])
+        plan = explain(
+            service._file_rows_query()
+            .filter(service._substring_filter('quarter'))
+        )
+
+    assert 'ix_files_name_trgm' in plan
+    assert 'ix_files_extension_trgm' in plan
+    # Ветка пути идёт от папок и присоединяет их файлы по индексу
+    assert 'ix_files_owner_folder' in plan
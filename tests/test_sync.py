@@ -0,0 +1,20 @@
+from services.files_service import FilesService
+
+
+def test_disk_scan_reports_progress(user, upload, pg_session, monkeypatch):
+    from config import config
+
+    for i in range(3):
+        upload(b'data', f'file_{i}.txt', path=f'docs/{i}')
+    monkeypatch.setattr(config, 'sync_progress_interval', 0)
+    reports = []
+
+    report = FilesService(pg_session, user_id=user['id']).sync_storage_and_db(
+        progress=reports.append
+    )
+
+    # Прогресс обхода диска - до подсчёта записей в БД
+    scan = [r for r in reports if 'db_total' not in r]
+    assert scan and scan[-1]['disk_files'] <= 3
+    assert report['disk_files'] == 3
+    assert report.get('deleted', 0) == 0
@@ -0,0 +1,44 @@
+import io
+import random
+
+from PIL import Image
+
+from services.files_service import FilesService
+
+
+def _png(width, height) -> bytes:
+    # Случайный цвет: миниатюры одинакового содержимого общие
+    color = tuple(random.randrange(256) for _ in range(3))
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_thumbnail(client, user, upload):
+    file = upload(_png(600, 400), 'photo.png')
+
+    response = client.get(
+        f'/api/files/{file["id"]}/thumbnail?size=small',
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 200
+    with Image.open(io.BytesIO(response.get_data())) as image:
+        assert image.size == (128, 86)
+
+
+def test_image_over_pixel_limit(client, user, upload, pg_session,
+                                monkeypatch):
+    from config import config
+
+    file = upload(_png(600, 400), 'bomb.png')
+    monkeypatch.setattr(config, 'thumbnails_max_pixels', 1000)
+
+    response = client.get(
+        f'/api/files/{file["id"]}/thumbnail', headers=user['headers']
+    )
+    assert response.status_code == 422
+    assert response.get_json()['error'] == 'Cannot render thumbnail'
+
+    # Задача воркера завершается без повторов
+    FilesService(pg_session).generate_thumbnails(file['id'])
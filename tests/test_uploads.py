@@ -0,0 +1,133 @@
+import fcntl
+import io
+import os
+
+from conftest import STORAGE_PATH
+
+
+def _create(client, user, size, filename='movie.bin'):
+    return client.post(
+        '/api/files/uploads',
+        json={'fields': {'filename': filename, 'size': size}},
+        headers=user['headers'],
+    )
+
+
+def _append(client, user, upload_id, offset, body):
+    return client.patch(
+        f'/api/files/uploads/{upload_id}',
+        input_stream=body if hasattr(body, 'read') else io.BytesIO(body),
+        headers={**user['headers'], 'Upload-Offset': str(offset)},
+    )
+
+
+def _temp_path(user, upload_id):
+    return os.path.join(
+        STORAGE_PATH, str(user['id']), '.uploads', f'{upload_id}.part'
+    )
+
+
+def test_upload_in_chunks(client, user):
+    upload = _create(client, user, 10).get_json()
+
+    assert _append(client, user, upload['id'], 0, b'01234').status_code == 200
+    response = _append(client, user, upload['id'], 0, b'xxxxx')
+    assert response.status_code == 409
+    assert response.get_json()['data']['data']['offset'] == 5
+    response = _append(client, user, upload['id'], 5, b'56789')
+    assert response.get_json()['offset'] == 10
+
+    file = client.post(
+        f'/api/files/uploads/{upload["id"]}/finalize',
+        headers=user['headers'],
+    ).get_json()
+    response = client.get(
+        f'/api/files/{file["id"]}/download', headers=user['headers']
+    )
+    assert response.get_data() == b'0123456789'
+
+
+def test_chunk_body_is_read_outside_transaction(client, user, pg_session):
+    upload = _create(client, user, 4).get_json()
+
+    class Body(io.BytesIO):
+        in_transaction = []
+
+        def read(self, *args):
+            self.in_transaction.append(pg_session().in_transaction())
+            return super().read(*args)
+
+        def readinto(self, buffer):
+            self.in_transaction.append(pg_session().in_transaction())
+            return super().readinto(buffer)
+
+    response = _append(client, user, upload['id'], 0, Body(b'data'))
+
+    assert response.status_code == 200
+    assert Body.in_transaction and not any(Body.in_transaction)
+
+
+def test_concurrent_chunk_is_rejected(client, user):
+    upload = _create(client, user, 4).get_json()
+
+    with open(_temp_path(user, upload['id']), 'r+b') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        response = _append(client, user, upload['id'], 0, b'data')
+
+    assert response.status_code == 409
+    assert response.get_json()['error'] == 'Upload is busy'
+
+
+def test_unknown_upload(client, user):
+    for upload_id in ('0' * 32, '..', 'not-a-session'):
+        response = _append(client, user, upload_id, 0, b'data')
+        assert response.status_code == 404
+
+
+def test_open_sessions_count_against_quota(client, user, monkeypatch):
+    from config import config
+
+    monkeypatch.setattr(config, 'max_user_storage_bytes', 100)
+
+    assert _create(client, user, 60).status_code == 201
+    assert _create(client, user, 60).status_code == 413
+    assert _create(client, user, 40).status_code == 201
+
+
+def test_finalize_hashes_outside_transaction(client, user, pg_session,
+                                            monkeypatch):
+    from services.files_service import FilesService
+
+    upload = _create(client, user, 4).get_json()
+    _append(client, user, upload['id'], 0, b'data')
+    in_transaction = []
+    file_sha256 = FilesService._file_sha256
+
+    def _file_sha256(full_path, *args, **kwargs):
+        in_transaction.append(pg_session().in_transaction())
+        return file_sha256(full_path, *args, **kwargs)
+
+    monkeypatch.setattr(
+        FilesService, '_file_sha256', staticmethod(_file_sha256)
+    )
+    response = client.post(
+        f'/api/files/uploads/{upload["id"]}/finalize',
+        headers=user['headers'],
+    )
+
+    assert response.status_code == 200
+    assert in_transaction == [False]
+
+
+def test_finalize_busy_upload_is_rejected(client, user):
+    upload = _create(client, user, 4).get_json()
+    _append(client, user, upload['id'], 0, b'data')
+
+    with open(_temp_path(user, upload['id']), 'r+b') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        response = client.post(
+            f'/api/files/uploads/{upload["id"]}/finalize',
+            headers=user['headers'],
+        )
+
+    assert response.status_code == 409
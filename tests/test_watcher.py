@@ -0,0 +1,69 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+from services.watcher import StorageWatcher
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith('linux'), reason='inotify только в Linux'
+)
+
+
+@pytest.fixture
+def root(tmp_path):
+    storage = tmp_path / 'storage'
+    for directory in ('1/docs', '1/photos', '2'):
+        (storage / directory).mkdir(parents=True)
+    return storage
+
+
+@pytest.fixture
+def watcher(root):
+    watcher = StorageWatcher(str(root), delay=0.2)
+    yield watcher
+    watcher.close()
+
+
+def _stored_file(directory) -> str:
+    stored_name = uuid.uuid4().hex
+    (directory / f'{stored_name}.txt').write_bytes(b'data')
+    return stored_name
+
+
+def test_rename_inside_owner_does_not_sync_owner(root, watcher):
+    stored_name = _stored_file(root / '1')
+    batches = watcher.batches()
+
+    os.rename(root / '1' / 'docs', root / '1' / 'documents')
+    os.remove(root / '1' / f'{stored_name}.txt')
+
+    batch = next(batches)
+    assert not batch.full_scan
+    assert batch.owner_ids == frozenset()
+    assert batch.stored_names == {stored_name}
+
+
+def test_moved_subdirectory_stays_watched(root, watcher):
+    os.rename(root / '1' / 'docs', root / '1' / 'documents')
+    stored_name = _stored_file(root / '1' / 'documents')
+    batches = watcher.batches()
+
+    os.remove(root / '1' / 'documents' / f'{stored_name}.txt')
+
+    assert next(batches).stored_names == {stored_name}
+
+
+def test_move_out_of_storage_syncs_owner(root, tmp_path, watcher):
+    os.rename(root / '1' / 'docs', tmp_path / 'docs')
+
+    batch = next(watcher.batches())
+    assert batch.owner_ids == {1}
+
+
+def test_move_to_other_owner_syncs_source_owner(root, watcher):
+    os.rename(root / '1' / 'photos', root / '2' / 'photos')
+
+    batch = next(watcher.batches())
+    assert batch.owner_ids == {1}